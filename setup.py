@@ -54,7 +54,7 @@ setup(
     # keywords=["keyword1", "keyword2", "keyword3"],
 
     # List out the packages to include when running build/install/distribute
-    packages=find_packages("src", exclude=['tests*']),
+    packages=find_packages("src", exclude=['tests*', 'benchmarks*']),
 
     # For more fine grain control over modules included or excluded use py_modules
     # py_modules=[splitext(basename(i))[0] for i in glob.glob("src/**/*.py")],
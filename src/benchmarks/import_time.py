@@ -0,0 +1,81 @@
+"""
+Import time benchmarks
+
+Imports each module in a fresh python process and records how long the import took, and how long the package
+resources (factory default config, AMI cache, config schema and common strings) then take to load on first use.
+The fastest of the repeated runs is reported.
+
+Usage:
+    import_time [<module>...] [--repeat=<N>]
+
+Options:
+  -h --help                     Show this screen.
+  --repeat=<N>                  Number of times each module is imported, the fastest run is reported [default: 5].
+"""
+
+import json
+import os
+import subprocess
+import sys
+from docopt import docopt
+
+MODULES = [
+    'environmentbase.resources',
+    'environmentbase.template',
+    'environmentbase.environmentbase',
+    'environmentbase.cli',
+    'environmentbase.networkbase'
+]
+
+# Run in the fresh process, prints the import and resource loading times as json
+MEASURE_SCRIPT = """
+import json, time
+start_time = time.time()
+import %(module)s
+import_seconds = time.time() - start_time
+
+from environmentbase import resources
+start_time = time.time()
+resources.get_factory_default_config()
+resources.get_factory_default_ami_cache()
+resources.get_config_requirements()
+resources.get_common_strings()
+print json.dumps({'import_seconds': import_seconds, 'resources_seconds': time.time() - start_time})
+"""
+
+
+def measure_import(module, repeat):
+    """
+    Imports module repeat times, each time in a new python process
+    :return dict: fastest import and resource loading times
+    """
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src_dir, os.environ.get('PYTHONPATH')])))
+
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', MEASURE_SCRIPT % {'module': module}], env=env)
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        'import_seconds': min(run['import_seconds'] for run in runs),
+        'resources_seconds': min(run['resources_seconds'] for run in runs)
+    }
+
+
+def main():
+    args = docopt(__doc__)
+    repeat = int(args['--repeat'])
+
+    row_format = '{:<36} {:>12} {:>16}'
+    print row_format.format('module', 'import (s)', 'resources (s)')
+
+    for module in args['<module>'] or MODULES:
+        result = measure_import(module, repeat)
+        print row_format.format(module, '%.3f' % result['import_seconds'], '%.3f' % result['resources_seconds'])
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Template generation benchmarks
+
+Runs create_action() for NetworkBase and the example controllers against synthetic configs, with S3 stubbed out, and
+records wall time, peak memory and the size of the generated templates for each scenario.  Each scenario runs in its
+own process so peak memory isn't shared between scenarios.
+
+Usage:
+    template_generation [<scenario>...] [--repeat=<N>] [--baseline=<FILE>] [--save-baseline] [--tolerance=<FRACTION>]
+    template_generation --list
+    template_generation --run-scenario=<scenario> --result-file=<FILE> [--repeat=<N>]
+
+Options:
+  -h --help                     Show this screen.
+  --list                        List the available scenarios.
+  --repeat=<N>                  Number of times each scenario is generated, the fastest run is reported [default: 3].
+  --baseline=<FILE>             Results to compare against [default: benchmarks/baseline.json].
+  --save-baseline               Save the results as the new baseline instead of comparing against it.
+  --tolerance=<FRACTION>        Allowed growth over the baseline before a result counts as a regression [default: 0.2].
+  --run-scenario=<scenario>     Internal, runs a single scenario in the current process.
+  --result-file=<FILE>          Internal, file the single scenario result is written to.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from docopt import docopt
+
+try:
+    import resource
+except ImportError:
+    # Peak memory isn't available on Windows
+    resource = None
+
+from environmentbase import networkbase, resources as res, utility
+from environmentbase.patterns.base_network import BaseNetwork
+from environmentbase.patterns.ha_cluster import HaCluster
+from environmentbase.patterns.rds import RDS
+from environmentbase.template import Template
+
+# Scenario settings: controller (None for the synthetic BenchmarkController, else '<example module>.<class>'),
+# az_count, subnet layers, HaCluster children, RDS children and the nesting level of those children.
+# examples/nested_child_stack.py isn't included, its controller doesn't create the subnets its child template uses.
+SCENARIOS = [
+    {'name': 'example_base_network', 'controller': 'base_network.MyEnvClass'},
+    {'name': 'example_basic', 'controller': 'basic.MyEnvClass'},
+    {'name': 'example_child_stack', 'controller': 'child_stack.MyRootTemplate'},
+    {'name': 'network_1az_1layer', 'az_count': 1, 'layers': 1},
+    {'name': 'network_6az_20layers', 'az_count': 6, 'layers': 20},
+    {'name': 'children_100', 'clusters': 50, 'databases': 50},
+    {'name': 'nesting_4', 'clusters': 10, 'databases': 10, 'nesting': 4},
+    {'name': 'large', 'az_count': 6, 'layers': 20, 'clusters': 50, 'databases': 50, 'nesting': 4}
+]
+
+SCENARIO_DEFAULTS = {'controller': None, 'az_count': 3, 'layers': 2, 'clusters': 0, 'databases': 0, 'nesting': 1}
+
+# Results compared against the baseline, with the direction that counts as a regression being an increase
+COMPARED_RESULTS = ['wall_seconds', 'peak_memory_kb', 'output_bytes']
+
+
+class NestingTemplate(Template):
+    """
+    Intermediate template used to nest the benchmark children below the root template
+    """
+
+    def __init__(self, name, children):
+        super(NestingTemplate, self).__init__(name)
+        self.children = children
+
+    def build_hook(self):
+        for child in self.children:
+            self.add_child_template(child)
+
+
+class BenchmarkController(networkbase.NetworkBase):
+    """
+    NetworkBase controller adding the HaCluster and RDS children of a synthetic scenario
+    """
+
+    scenario = SCENARIO_DEFAULTS
+
+    def create_hook(self):
+        super(BenchmarkController, self).create_hook()
+
+        children = [HaCluster(name='Cluster%d' % index) for index in range(self.scenario['clusters'])]
+
+        private_layers = self.template.subnets.get('private', {}).keys()
+        if private_layers:
+            children += [RDS('db%d' % index, subnet_set=private_layers[0]) for index in range(self.scenario['databases'])]
+
+        # Each nesting level beyond the first adds a template between the root and the children
+        for level in reversed(range(1, self.scenario['nesting'])):
+            children = [NestingTemplate('Level%d' % level, children)]
+
+        for child in children:
+            self.add_child_template(child)
+
+
+class StubS3Resource(object):
+    """
+    Stands in for the boto3 S3 resource, recording the size of each uploaded template
+    """
+
+    def __init__(self):
+        self.meta = self
+        self.client = self
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body, ACL):
+        self.uploads[Key] = len(Body)
+        return {'ETag': '"%s"' % hashlib.md5(Body).hexdigest()}
+
+    def head_object(self, Bucket, Key):
+        return {}
+
+
+class StubView(object):
+    """
+    View leaving the controller idle so the benchmark can run the create action itself
+    """
+
+    config_filename = None
+
+    def update_config(self, config):
+        pass
+
+    def process_request(self, controller):
+        pass
+
+
+def get_scenario(name):
+    for scenario in SCENARIOS:
+        if scenario['name'] == name:
+            return dict(SCENARIO_DEFAULTS, **scenario)
+    raise ValueError('Unknown scenario %s, use --list to see the available scenarios' % name)
+
+
+def get_scenario_config(scenario):
+    config = copy.deepcopy(res.get_factory_default_config())
+    config.update(copy.deepcopy(BaseNetwork.DEFAULT_CONFIG))
+
+    config['template']['include_timestamp'] = False
+    config['template']['skip_unchanged_uploads'] = False
+
+    config['network']['az_count'] = scenario['az_count']
+    config['network']['subnet_config'] = [{
+        'type': 'public' if index % 2 == 0 else 'private',
+        'size': '24',
+        'name': 'layer%d' % index
+    } for index in range(scenario['layers'])]
+
+    return config
+
+
+def get_controller_class(scenario):
+    if not scenario['controller']:
+        return BenchmarkController
+
+    (module_name, class_name) = scenario['controller'].rsplit('.', 1)
+    module = __import__('examples.' + module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+
+def get_peak_memory_kb():
+    if not resource:
+        return None
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, KB elsewhere
+    return peak_memory / 1024 if sys.platform == 'darwin' else peak_memory
+
+
+def run_scenario(scenario, repeat):
+    """
+    Generates the scenario's templates repeat times in a scratch directory
+    :return dict: fastest wall time, peak memory of this process, number and total size of the generated templates
+    """
+    controller_class = get_controller_class(scenario)
+    wall_times = []
+    s3_resource = None
+
+    original_dir = os.getcwd()
+    original_get_boto_resource = utility.get_boto_resource
+
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp()
+        s3_resource = StubS3Resource()
+        utility.get_boto_resource = lambda config, service_name: s3_resource
+
+        try:
+            os.chdir(work_dir)
+            with open(res.DEFAULT_AMI_CACHE_FILENAME + res.EXTENSIONS[0], 'w') as f:
+                f.write(json.dumps(res.get_factory_default_ami_cache()))
+
+            controller = controller_class(view=StubView(), config_file_override=get_scenario_config(scenario))
+            controller.scenario = scenario
+
+            start_time = time.time()
+            controller.create_action()
+            wall_times.append(time.time() - start_time)
+        finally:
+            utility.get_boto_resource = original_get_boto_resource
+            os.chdir(original_dir)
+            shutil.rmtree(work_dir)
+
+    return {
+        'wall_seconds': min(wall_times),
+        'peak_memory_kb': get_peak_memory_kb(),
+        'output_bytes': sum(s3_resource.uploads.values()),
+        'templates': len(s3_resource.uploads)
+    }
+
+
+def run_scenario_process(scenario_name, repeat):
+    """
+    Runs one scenario in a fresh python process, the scenario's own output is discarded
+    """
+    (handle, result_file) = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src_dir, os.environ.get('PYTHONPATH')])))
+    command = [sys.executable, '-m', 'benchmarks.template_generation',
+               '--run-scenario=' + scenario_name, '--result-file=' + result_file, '--repeat=%d' % repeat]
+
+    try:
+        # Started outside of src_dir so the package is imported by absolute path, the scenario changes directory
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command, cwd=os.path.dirname(result_file), env=env, stdout=devnull)
+
+        with open(result_file) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_file)
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return list: (scenario, result name, baseline value, current value) of every result that grew beyond the tolerance
+    """
+    regressions = []
+    for (scenario_name, result) in sorted(results.iteritems()):
+        for key in COMPARED_RESULTS:
+            previous = baseline.get(scenario_name, {}).get(key)
+            if previous and result[key] is not None and result[key] > previous * (1 + tolerance):
+                regressions.append((scenario_name, key, previous, result[key]))
+    return regressions
+
+
+def print_results(results, baseline):
+    row_format = '{:<28} {:>12} {:>16} {:>14} {:>10}'
+    print row_format.format('scenario', 'wall (s)', 'peak mem (KB)', 'output (B)', 'templates')
+
+    for (scenario_name, result) in sorted(results.iteritems()):
+        print row_format.format(
+            scenario_name, '%.3f' % result['wall_seconds'], result['peak_memory_kb'], result['output_bytes'],
+            result['templates'])
+
+        previous = baseline.get(scenario_name)
+        if previous:
+            print row_format.format(
+                '  baseline', '%.3f' % previous['wall_seconds'], previous['peak_memory_kb'], previous['output_bytes'],
+                previous['templates'])
+
+
+def main():
+    args = docopt(__doc__)
+    repeat = int(args['--repeat'])
+
+    if args['--list']:
+        for scenario in SCENARIOS:
+            print scenario['name']
+        return 0
+
+    if args['--run-scenario']:
+        result = run_scenario(get_scenario(args['--run-scenario']), repeat)
+        with open(args['--result-file'], 'w') as f:
+            f.write(json.dumps(result))
+        return 0
+
+    scenario_names = args['<scenario>'] or [scenario['name'] for scenario in SCENARIOS]
+    for scenario_name in scenario_names:
+        get_scenario(scenario_name)
+
+    results = {}
+    for scenario_name in scenario_names:
+        print 'Running %s' % scenario_name
+        results[scenario_name] = run_scenario_process(scenario_name, repeat)
+
+    baseline_file = args['--baseline']
+    if args['--save-baseline']:
+        with open(baseline_file, 'w') as f:
+            f.write(json.dumps(results, indent=4, sort_keys=True, separators=(',', ': ')))
+        print_results(results, {})
+        print '\nSaved baseline to %s' % baseline_file
+        return 0
+
+    baseline = {}
+    if os.path.isfile(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    regressions = compare(results, baseline, float(args['--tolerance']))
+    for (scenario_name, key, previous, current) in regressions:
+        print 'REGRESSION %s %s: %s -> %s' % (scenario_name, key, previous, current)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,12 @@
-from . import networkbase
+from . import cli
 
 
 def main():
-    networkbase.NetworkBase()
+    # The arguments are parsed before the controller is imported, --help and --version don't wait for it to load
+    view = cli.CLI()
+
+    from . import networkbase
+    networkbase.NetworkBase(view=view)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,183 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+import troposphere as t
+from troposphere import Parameter, Output
+import utility
+import version
+
+BUILD_CACHE_DIRNAME = '.build_cache'
+
+
+class BuildCache(object):
+    """
+    Opt-in cache of child template builds, stored as one json file per build under <directory>/.build_cache.
+
+    A child template is fingerprinted after the parent has attached its common parameters and before its build_hook()
+    runs.  The fingerprint covers:
+    - the arguments the template was constructed with
+    - the config sections named in the template class's get_config_schema() and the 'template' section
+    - everything already attached to the template (common parameters, RegionMap, resources built in __init__)
+    - the source of every loaded environmentbase module, of the template class (and its bases) and of the controller
+    When a later run produces the same fingerprint the rendered template and the parameter/output signature the parent
+    wired against are restored instead of calling build_hook().
+    Only templates without child stacks of their own are stored: a restored template isn't built, so the child stacks
+    its rendered template points at would not be saved or uploaded by the run.  The source of the template classes
+    merged into a stored template and the content of the files read while building it (bootstrap scripts read through
+    Template.get_file_contents(), resources.read_file() or resources.get_resource()) are re-checked before an entry
+    is reused.
+
+    As build_hook() isn't called on a hit, attributes it would have set on the template (anything besides its
+    parameters, outputs and rendered template) are missing on a restored template.
+    """
+
+    def __init__(self, directory, config, controller_class=None):
+        """
+        :param directory: Directory holding the .build_cache directory (the local template directory)
+        :param config: Loaded and validated environmentbase config
+        :param controller_class: EnvironmentBase subclass driving the build, its source is part of every fingerprint
+        """
+        self.directory = os.path.join(directory, BUILD_CACHE_DIRNAME)
+        self.config = config
+        self._source_hashes = {}
+
+        # Fingerprint of the code shared by every template: this package, troposphere and the controller
+        package_files = [inspect.getsourcefile(module) for (name, module) in sys.modules.items()
+                         if module and (name == 'environmentbase' or name.startswith('environmentbase.'))]
+        controller_files = self._get_class_source_files(controller_class) if controller_class else []
+        self._common_code = {
+            'version': version.__version__,
+            'troposphere': t.__version__,
+            'sources': self._get_source_hashes(package_files + controller_files)
+        }
+
+    def _get_source_hash(self, file_path):
+        if file_path not in self._source_hashes:
+            with open(file_path, 'rb') as f:
+                self._source_hashes[file_path] = hashlib.sha256(f.read()).hexdigest()
+        return self._source_hashes[file_path]
+
+    def _get_source_hashes(self, file_paths):
+        return {file_path: self._get_source_hash(file_path) for file_path in file_paths if file_path}
+
+    @staticmethod
+    def _get_class_source_files(a_class):
+        """
+        Source files of the modules defining a_class and all of its base classes
+        """
+        return [inspect.getsourcefile(sys.modules[cls.__module__]) for cls in inspect.getmro(a_class) if cls is not object]
+
+    @staticmethod
+    def _get_config_sections(template_class):
+        sections = {'template'}
+        for cls in inspect.getmro(template_class):
+            if hasattr(cls, 'get_config_schema'):
+                sections.update(cls.get_config_schema().keys())
+        return sections
+
+    def _get_entry_path(self, fingerprint):
+        return os.path.join(self.directory, fingerprint + '.json')
+
+    def get_fingerprint(self, template):
+        """
+        Computes the build fingerprint of a child template whose common parameters have been attached
+        :return string: hex digest, or None if the template can't be fingerprinted reliably (it is then always rebuilt)
+        """
+        template_class = type(template)
+        try:
+            fingerprint = {
+                'code': self._common_code,
+                'template_code': self._get_source_hashes(self._get_class_source_files(template_class)),
+                'template_class': template_class.__module__ + '.' + template_class.__name__,
+                'init_args': getattr(template, '_init_args', None),
+                'config': {section: self.config.get(section) for section in self._get_config_sections(template_class)},
+                'inputs': template.to_dict()
+            }
+            # Anything without a stable json form falls back to its repr, default object reprs include the object's
+            # address so they never match a previous run
+            serialized = json.dumps(utility.tropo_to_dict(fingerprint), sort_keys=True, separators=(',', ':'), default=repr)
+        except (TypeError, ValueError, IOError):
+            return None
+
+        return hashlib.sha256(serialized).hexdigest()
+
+    def restore(self, template, fingerprint):
+        """
+        Restores a previous build of the template matching fingerprint
+        :return bool: True if the build was restored, False if the template needs to be built
+        """
+        if not fingerprint or not os.path.isfile(self._get_entry_path(fingerprint)):
+            return False
+
+        with open(self._get_entry_path(fingerprint), 'r') as f:
+            try:
+                entry = json.load(f)
+            except ValueError:
+                return False
+
+        # Templates created inside the subtree and the files read while building aren't known until the template is
+        # built, check they are unchanged
+        for file_hashes in [entry['subtree_code'], entry['files_read']]:
+            for (file_path, file_hash) in file_hashes.iteritems():
+                if not os.path.isfile(file_path) or self._get_source_hash(file_path) != file_hash:
+                    return False
+
+        template.parameters = {title: utility.restore_declaration(Parameter, title, rendered)
+                               for (title, rendered) in entry['parameters'].iteritems()}
+        template.outputs = {title: utility.restore_declaration(Output, title, rendered)
+                            for (title, rendered) in entry['outputs'].iteritems()}
+        template.content_hash = entry['content_hash']
+        template._template_dict = entry['template_dict']
+
+        # Like a freshly built template's, the generation date is only part of the rendered template
+        if template.include_dateGenerated_output:
+            template._template_dict.setdefault('Outputs', {})['dateGenerated'] = utility.tropo_to_dict(
+                template.get_date_generated_output())
+        return True
+
+    def record_signature(self, template, fingerprint):
+        """
+        Records the parameters and outputs of a freshly built template as the parent wired against them.
+        The entry is written by store() once the template has been rendered.
+        """
+        template._build_cache_entry = {
+            'fingerprint': fingerprint,
+            'parameters': utility.tropo_to_dict(template.parameters),
+            'outputs': utility.tropo_to_dict(template.outputs)
+        }
+
+    def store(self, template):
+        """
+        Writes the build of a rendered template previously passed to record_signature()
+        """
+        entry = getattr(template, '_build_cache_entry', None)
+        if not entry or any(not merge for (_, merge, _, _, _) in template._child_templates):
+            return
+
+        # The generation date is added afresh when the entry is restored
+        template_dict = dict(template.to_template_dict())
+        outputs = {title: output for (title, output) in template_dict.get('Outputs', {}).iteritems()
+                   if title != 'dateGenerated'}
+        template_dict.pop('Outputs', None)
+        if outputs:
+            template_dict['Outputs'] = outputs
+
+        entry['content_hash'] = template.content_hash
+        entry['template_dict'] = template_dict
+        entry['subtree_code'] = self._get_source_hashes(self._get_subtree_source_files(template))
+        entry['files_read'] = self._get_source_hashes(template._files_read)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        with open(self._get_entry_path(entry['fingerprint']), 'w') as f:
+            f.write(utility.to_compact_json(entry))
+
+    def _get_subtree_source_files(self, template):
+        source_files = []
+        for (child_template, _, _, _, _) in template._child_templates:
+            source_files.extend(self._get_class_source_files(type(child_template)))
+            source_files.extend(self._get_subtree_source_files(child_template))
+        return source_files
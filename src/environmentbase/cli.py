@@ -5,24 +5,30 @@ environmentbase
 Tool bundle manages generation, deployment, and feedback of cloudformation resources.
 
 Usage:
-    environmentbase (init|create|deploy|delete) [--config-file <FILE_LOCATION>] [--debug] [--template-file=<TEMPLATE_FILE>]
+    environmentbase (init|create|deploy|delete) [--config-file <FILE>] [--debug] [--profile] [--template-file=<FILE>] [--import-times]
 
 Options:
   -h --help                            Show this screen.
   -v --version                         Show version.
   --debug                              Prints parent template to console out.
+  --profile                            Writes a json timing report of the action next to the templates.
   --config-file <CONFIG_FILE>          Name of json configuration file. Default value is config.json
   --stack-name <STACK_NAME>            User-definable value for the CloudFormation stack being deployed.
   --template-file=<TEMPLATE_FILE>      Name of template to be either generated or deployed.
+  --import-times                       Prints how long each module took to import once the action is done.
 """
 
 from docopt import docopt
 import version
 import json
+from profiler import ImportTimer
 
 
 class CLI(object):
 
+    # Arguments update_config() applies to the config, subclasses overriding it should extend the list
+    CONFIG_ARGS = ['--debug', '--profile', '--template-file']
+
     def __init__(self, quiet=False, doc=__doc__):
         """
         CLI constructor is responsible for parsing sys.argv to collect configuration information.
@@ -34,6 +40,12 @@ class CLI(object):
 
         self.args = docopt(doc, version='environmentbase %s' % version.__version__)
 
+        # Modules imported from here on are timed, including the AWS SDKs the action imports on first use
+        self.import_timer = None
+        if self.args.get('--import-times'):
+            self.import_timer = ImportTimer()
+            self.import_timer.start()
+
         # Parsing this config filename here is required since
         # the file is already loaded in self.update_config()
         self.config_filename = self.args.get('--config-file')
@@ -50,10 +62,19 @@ class CLI(object):
             if not self.quiet:
                 print "CLI arguments", json.dumps(self.args, indent=4, sort_keys=True)
 
+        if self.args.get('--profile'):
+            config['global']['profile'] = True
+
         template_file = self.args.get('--template-file')
         if template_file is not None:
             config['global']['environment_name'] = template_file
 
+    def get_config_args(self):
+        """
+        The arguments update_config() applies to the config, loaded configs are only reused with the same values
+        """
+        return {arg: self.args.get(arg) for arg in self.CONFIG_ARGS}
+
     def _process_request_helper(self, controller):
         if self.args.get('init', False):
             controller.init_action()
@@ -74,12 +95,17 @@ class CLI(object):
         """
         print
 
-        # Allow the full stack trace to print out when the debug flag is enabled
-        if self.args.get('--debug'):
-            self._process_request_helper(controller)
-        # Otherwise catch it and print the error message
-        else:
-            try:
+        try:
+            # Allow the full stack trace to print out when the debug flag is enabled
+            if self.args.get('--debug'):
                 self._process_request_helper(controller)
-            except Exception as e:
-                print "ERROR:\n\t{}\n\nTry running with the --debug flag\n".format(e.message)
+            # Otherwise catch it and print the error message
+            else:
+                try:
+                    self._process_request_helper(controller)
+                except Exception as e:
+                    print "ERROR:\n\t{}\n\nTry running with the --debug flag\n".format(e.message)
+        finally:
+            if self.import_timer:
+                self.import_timer.stop()
+                self.import_timer.print_report()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import utility
+import version
+
+CONFIG_CACHE_FILENAME = '.config_cache.json'
+
+
+class ConfigCache(object):
+    """
+    Opt-in cache of the loaded and validated config, stored as a single json file next to the config file.
+
+    An entry is reused when all of these are unchanged:
+    - the content of the config file
+    - the CLI arguments applied to the config (see CLI.get_config_args())
+    - the config schema, including the schemas of the registered config handlers, and the package version
+    - the environment variables that could override a config value (named after one of the config's sections)
+    A hit skips parsing, the CLI overrides and the validation of the config.
+
+    The config is stored before the environment overrides are applied, so values passed through environment
+    variables (typically secrets) are never written to disk, they're applied again to the loaded config.
+    """
+
+    def __init__(self, config_path, config_args, schema):
+        """
+        :param config_path: Path of the config file
+        :param config_args: CLI arguments applied to the config by the view's update_config()
+        :param schema: Config schema merged with the config handlers' schemas
+        """
+        self.file_path = os.path.join(os.path.dirname(os.path.abspath(config_path)), CONFIG_CACHE_FILENAME)
+
+        with open(config_path, 'rb') as f:
+            inputs = {
+                'version': version.__version__,
+                'config_file': hashlib.sha256(f.read()).hexdigest(),
+                'config_args': config_args,
+                'schema': schema
+            }
+        self.fingerprint = hashlib.sha256(utility.to_compact_json(inputs)).hexdigest()
+
+    @staticmethod
+    def _get_environment_hash(config):
+        """
+        Hashes the environment variables that may override a value of config, e.g. TEMPLATE_EC2_KEY_DEFAULT for the
+        'template' section.  The values are hashed so they are not written to disk.
+        """
+        prefixes = tuple(section.upper() + '_' for section in config if isinstance(section, basestring))
+        overrides = sorted((name, value) for (name, value) in os.environ.iteritems() if name.startswith(prefixes))
+        return hashlib.sha256(json.dumps(overrides, separators=(',', ':'))).hexdigest()
+
+    def load(self):
+        """
+        :return dict: Config stored by a previous run with the same inputs, None if there's none
+        """
+        if not os.path.isfile(self.file_path):
+            return None
+
+        with open(self.file_path, 'r') as f:
+            try:
+                entry = json.load(f)
+            except ValueError:
+                return None
+
+        if entry.get('fingerprint') != self.fingerprint:
+            return None
+
+        config = entry['config']
+        if entry.get('environment') != self._get_environment_hash(config):
+            return None
+
+        return config
+
+    def store(self, config):
+        """
+        Replaces the cached config with config, loaded from the inputs this cache was created with and validated
+        once the environment overrides were applied.  Configs that change through the json round trip (e.g. yaml
+        mappings with non-string keys) aren't cached, as a hit skips the validation that would catch the change.
+        :return bool: True if the config was stored
+        """
+        if json.loads(utility.to_compact_json(config)) != config:
+            return False
+
+        entry = {
+            'fingerprint': self.fingerprint,
+            'environment': self._get_environment_hash(config),
+            'config': config
+        }
+
+        # Only readable by the user, like the config file it's a copy of should be
+        fd = os.open(self.file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(utility.to_compact_json(entry))
+
+        return True
@@ -0,0 +1,97 @@
+import fnmatch
+import re
+import resources as res
+
+# Characters making a schema key a 'filename' pattern rather than a literal key
+WILDCARD_CHARACTERS = re.compile(r'[*?\[]')
+
+
+class ConfigValidator(object):
+    """
+    Config schema compiled into a tree of validators, built once and reused for every config validated against it.
+
+    Schema keys match config keys the way fnmatch does ('?', '*', [XYZ], [!XYZ]): literal keys are looked up directly
+    and wildcard keys are compiled into regular expressions.  Schema values are a type name (see resources.get_type()),
+    a nested schema (dict) or a list (only the value's type is checked).
+
+    validate() reports every violation in one pass rather than stopping at the first one.
+    """
+
+    def __init__(self, schema):
+        """
+        :param schema: Config schema, e.g. config_schema.json merged with the config handlers' get_config_schema()
+        """
+        # [(key, value check)] and [(key, compiled pattern, value check)], checks are None for values not checked
+        self._literal_keys = []
+        self._wildcard_keys = []
+
+        for (key, requirement) in sorted(schema.iteritems()):
+            check = self._compile_requirement(key, requirement)
+            if WILDCARD_CHARACTERS.search(key):
+                self._wildcard_keys.append((key, re.compile(fnmatch.translate(key)), check))
+            else:
+                self._literal_keys.append((key, check))
+
+    @staticmethod
+    def _compile_requirement(key, requirement):
+        """
+        :return function: check(value, path, errors) appending a message to errors when the value is invalid
+        """
+        if isinstance(requirement, basestring):
+            required_type = res.get_type(requirement)
+            if required_type is None:
+                raise ValueError("Unknown type %s for %s in the config schema" % (requirement, key))
+
+            def check_type(value, path, errors):
+                if not isinstance(value, required_type):
+                    errors.append("Type mismatch in config, %s should be of type %s, not %s" %
+                                  (path, requirement, type(value).__name__))
+            return check_type
+
+        elif isinstance(requirement, dict):
+            nested_validator = ConfigValidator(requirement)
+
+            def check_section(value, path, errors):
+                if not isinstance(value, dict):
+                    errors.append("Type mismatch in config, %s should be a dict, not %s" % (path, type(value).__name__))
+                else:
+                    nested_validator._validate(value, path, errors)
+            return check_section
+
+        elif isinstance(requirement, list):
+            def check_list(value, path, errors):
+                if not isinstance(value, list):
+                    errors.append("Type mismatch in config, %s should be a list, not %s" % (path, type(value).__name__))
+            return check_list
+
+        return None
+
+    def validate(self, config):
+        """
+        :param config: Loaded config to validate
+        :return list: Messages describing each violation, empty when the config is valid
+        """
+        errors = []
+        self._validate(config, '', errors)
+        return errors
+
+    def _validate(self, config, path, errors):
+        prefix = path + '.' if path else ''
+
+        for (key, check) in self._literal_keys:
+            if key not in config:
+                errors.append("Config file missing section " + prefix + key)
+            elif check:
+                check(config[key], prefix + key, errors)
+
+        if not self._wildcard_keys:
+            return
+
+        config_keys = sorted(key for key in config if isinstance(key, basestring))
+        for (key, pattern, check) in self._wildcard_keys:
+            matches = [config_key for config_key in config_keys if pattern.match(config_key)]
+            if not matches:
+                errors.append("Config file missing section " + prefix + key)
+            elif check:
+                for matching_key in matches:
+                    check(config[matching_key], prefix + matching_key, errors)
@@ -3,27 +3,112 @@ import os.path
 import copy
 import re
 import sys
-import botocore.exceptions
-from boto import cloudformation, sts
+from fnmatch import fnmatch
 from troposphere import Parameter, Output
 from template import Template
 import cli
 import resources as res
-from fnmatch import fnmatch
 import utility
 import monitor
-import yaml
+from upload_manifest import UploadManifest
+from build_cache import BuildCache
+from config_cache import ConfigCache
+from config_validator import ConfigValidator
+from profiler import Profiler
 import logging
 import json
+import gzip
 import tempfile
+from multiprocessing.pool import ThreadPool
 
 TIMEOUT = 60
 
+# Default number of worker threads used to upload and save generated templates
+DEFAULT_UPLOAD_CONCURRENCY = 8
+
 
 class ValidationError(Exception):
     pass
 
 
+# Key of the prefix index nodes ending a complete environment variable name, holds (name, value)
+ENV_INDEX_VALUE = None
+
+
+def _index_environment(environ):
+    """
+    Builds a character trie of the environment variable names
+    :param environ: Environment variables (e.g. os.environ)
+    :return dict: Root node, each node maps the next character to its child node and ENV_INDEX_VALUE to (name, value)
+    """
+    root = {}
+    for (name, value) in environ.iteritems():
+        node = root
+        for character in name:
+            node = node.setdefault(character, {})
+        node[ENV_INDEX_VALUE] = (name, value)
+    return root
+
+
+def _find_env_prefix(node, prefix):
+    """
+    :return dict: Node of the prefix index below node matching prefix, None if no variable name continues with it
+    """
+    for character in prefix:
+        node = node.get(character)
+        if node is None:
+            return None
+    return node
+
+
+def _find_schema_requirement(schema, key):
+    """
+    :return: Schema value of the config key, literal schema keys take precedence over wildcards. None if unknown.
+    """
+    if not schema:
+        return None
+    if key in schema:
+        return schema[key]
+    for (schema_key, requirement) in schema.iteritems():
+        if fnmatch(key, schema_key):
+            return requirement
+    return None
+
+
+def _convert_env_value(env_value, requirement):
+    """
+    Convert an environment variable string to the type required by the config schema. Values that can't be
+    converted are left as strings for the schema validation to report.
+    :param requirement: Schema value of the config key (type name or list), None if unknown
+    """
+    required_type = res.get_type(requirement) if isinstance(requirement, basestring) else None
+
+    # Convert true/false strings to booleans unless the schema asks for something else
+    if requirement is None or required_type is bool:
+        if env_value.lower() == 'true':
+            return True
+        elif env_value.lower() == 'false':
+            return False
+
+    elif required_type in (int, float):
+        try:
+            return required_type(env_value)
+        except ValueError:
+            pass
+
+    elif required_type is list or isinstance(requirement, list):
+        # Either a json list or comma separated values
+        if env_value.strip().startswith('['):
+            try:
+                return json.loads(env_value)
+            except ValueError:
+                pass
+        else:
+            return [item.strip() for item in env_value.split(',') if item.strip()]
+
+    return env_value
+
+
 class EnvConfig(object):
 
     def __init__(self, config_handlers=None):
@@ -63,7 +148,9 @@ class EnvironmentBase(object):
         self.ignore_outputs = ['templateValidationHash', 'dateGenerated']
         self.stack_outputs = {}
         self._config_handlers = []
+        self._config_validator = None
         self.stack_monitor = None
+        self.profiler = Profiler(enabled=False)
         self._ami_cache = None
         self.cfn_connection = None
         self.sts_credentials = None
@@ -169,38 +256,93 @@ class EnvironmentBase(object):
         return template_dir
 
     @staticmethod
-    def serialize_templates_helper(template, s3_client, s3_upload=True):
-
+    def serialize_templates_helper(template, s3_client, s3_upload=True, upload_pool=None, upload_manifest=None):
+        """
+        Renders the template and then each of its child templates depth first (children can only be rendered after
+        their parent has processed them). Uploading and saving each rendered template is handed to upload_pool when
+        provided, so that S3 latency overlaps with rendering the rest of the tree.
+        :param upload_manifest: UploadManifest used to skip uploading templates that have not changed
+        :return list: pending multiprocessing AsyncResults of the upload_pool tasks, empty when run serially
+        """
         # Create stack resources for template and all child templates
-        raw_json = template.to_template_json()
+        # The template is rendered once, both the uploaded and local forms are dumped from the same dict
+        template_dict = template.to_template_dict()
+
+        pending_saves = []
+        save_args = (template, template_dict, s3_client, s3_upload, upload_manifest)
+        if upload_pool:
+            pending_saves.append(upload_pool.apply_async(EnvironmentBase._save_template, save_args))
 
         # Recursively iterate through each child template to serialize it and process its children
         for child, _, _, _, _ in template._child_templates:
-            EnvironmentBase.serialize_templates_helper(
+            pending_saves.extend(EnvironmentBase.serialize_templates_helper(
                 template=child,
                 s3_client=s3_client,
-                s3_upload=s3_upload)
+                s3_upload=s3_upload,
+                upload_pool=upload_pool,
+                upload_manifest=upload_manifest))
+
+        if not upload_pool:
+            EnvironmentBase._save_template(*save_args)
+
+        return pending_saves
+
+    @staticmethod
+    def _save_template(template, template_dict, s3_client, s3_upload, upload_manifest=None):
+        """
+        Uploads the rendered template to S3 (optionally) and writes it to file under the same resource path.
+        Safe to run from a worker thread, the summary is printed with a single statement so lines don't interleave.
+        """
+        upload_skipped = False
 
         if s3_upload:
-            # Upload the template to the s3 bucket under the template_prefix
-            s3_client.Bucket(Template.template_bucket_default).put_object(
-                Key=template.resource_path,
-                Body=raw_json,
-                ACL=Template.upload_acl
-            )
+            # The low level client is thread safe and returns the ETag of the upload
+            client = s3_client.meta.client
+            bucket = Template.template_bucket_default
+            body = utility.to_template_body(template_dict, Template.output_format)
+
+            if upload_manifest:
+                content_hash = upload_manifest.get_content_hash(body)
+                upload_skipped = upload_manifest.is_uploaded(
+                    client, bucket, template.resource_path, content_hash, Template.upload_acl)
+
+            if not upload_skipped:
+                # Upload the template to the s3 bucket under the template_prefix
+                with Template.profiler.span('upload', template=template.name):
+                    response = client.put_object(
+                        Bucket=bucket,
+                        Key=template.resource_path,
+                        Body=body,
+                        ACL=Template.upload_acl
+                    )
+
+                if upload_manifest:
+                    upload_manifest.record_upload(
+                        bucket, template.resource_path, content_hash, Template.upload_acl, response.get('ETag'))
 
         # Save the template locally with the same file hierarchy as on s3
-        with open(template.resource_path, 'w') as output_file:
-            reloaded_template = json.loads(raw_json)
-            output_file.write(json.dumps(reloaded_template, indent=4, separators=(',', ':')))
+        local_path = template.resource_path
+        with Template.profiler.span('save_local', template=template.name):
+            local_body = utility.to_pretty_json(template_dict, separators=(',', ':'))
+            if Template.gzip_local_templates:
+                local_path += '.gz'
+                # No file name or timestamp in the gzip header, so unchanged templates produce identical artifacts
+                with open(local_path, 'wb') as output_file:
+                    with gzip.GzipFile(filename='', mode='wb', fileobj=output_file, mtime=0) as gzip_file:
+                        gzip_file.write(local_body)
+            else:
+                with open(local_path, 'w') as output_file:
+                    output_file.write(local_body)
 
-        print "Generated {} template".format(template.name)
+        message = "Generated {} template\n".format(template.name)
 
         if s3_upload:
-            print "S3:\t{}".format(utility.get_template_s3_url(Template.template_bucket_default, template.resource_path))
-
-        print "Local:\t{}\n".format(template.resource_path)
+            message += "S3:\t{}{}\n".format(
+                utility.get_template_s3_url(Template.template_bucket_default, template.resource_path),
+                ' (unchanged, upload skipped)' if upload_skipped else '')
 
+        message += "Local:\t{}\n".format(local_path)
+        print message
 
     def serialize_templates(self):
         s3_client = utility.get_boto_resource(self.config, 's3')
@@ -208,10 +350,40 @@ class EnvironmentBase(object):
 
         s3_upload = self.config.get('template').get('s3_upload', True)
 
-        EnvironmentBase.serialize_templates_helper(
-            template=self.template,
-            s3_client=s3_client,
-            s3_upload=s3_upload)
+        # Number of templates uploaded/saved concurrently, 1 (or less) serializes everything on the calling thread.
+        # The pool only pays off by overlapping S3 latency, shutting it down costs ~0.1s so local only runs go without
+        upload_concurrency = self.config.get('template').get('upload_concurrency', DEFAULT_UPLOAD_CONCURRENCY)
+        upload_pool = ThreadPool(upload_concurrency) if s3_upload and upload_concurrency > 1 else None
+
+        # Remember what was uploaded so templates that haven't changed since the last run aren't uploaded again
+        upload_manifest = None
+        if s3_upload and self.config.get('template').get('skip_unchanged_uploads', True):
+            upload_manifest = UploadManifest(
+                local_file_path,
+                verify_remote=self.config.get('template').get('verify_skipped_uploads', False))
+
+        completed = False
+        try:
+            pending_saves = EnvironmentBase.serialize_templates_helper(
+                template=self.template,
+                s3_client=s3_client,
+                s3_upload=s3_upload,
+                upload_pool=upload_pool,
+                upload_manifest=upload_manifest)
+
+            # Wait for every upload, re-raising the first failure
+            for pending_save in pending_saves:
+                pending_save.get()
+            completed = True
+        finally:
+            if upload_pool:
+                upload_pool.close()
+                upload_pool.join()
+
+            # Record the successful uploads even if some of them failed, keys from earlier runs are only dropped once
+            # every template of this run has been written
+            if upload_manifest:
+                upload_manifest.save(prune=completed)
 
     def estimate_cost(self, template_name=None, template_url=None, stack_params=None):
         cfn_conn = utility.get_boto_client(self.config, 'cloudformation')
@@ -255,13 +427,43 @@ class EnvironmentBase(object):
         Loads and validates config, initializes a new template instance, and writes it to file.
         Override the create_hook in your environment to inject all of your cloudformation resources
         """
-        self.load_config()
-        self.initialize_template()
+        self._start_profiler('create')
+        self._load_profiled_config()
+
+        with self.profiler.span('initialize_template'):
+            self.initialize_template()
 
         # Do custom troposphere resource creation in your overridden copy of this method
-        self.create_hook()
+        with self.profiler.span('create_hook'):
+            self.create_hook()
+
+        with self.profiler.span('serialize_templates'):
+            self.serialize_templates()
+
+        self._write_timing_report()
+
+    def _start_profiler(self, action):
+        """
+        Starts recording the timing spans of a controller action.
+        Profiling is enabled by the global.profile setting (or --profile on the CLI) which is only known once the config
+        is loaded, so spans are recorded until _load_profiled_config() finds out whether they are wanted.
+        """
+        self.profiler = Profiler(action)
+        Template.profiler = self.profiler
+
+    def _load_profiled_config(self):
+        with self.profiler.span('load_config'):
+            self.load_config()
 
-        self.serialize_templates()
+        self.profiler.enabled = self.globals.get('profile', False)
+
+    def _write_timing_report(self):
+        """
+        Writes the timing report of the current action next to the templates as <environment_name>.<action>.timing.json
+        """
+        if self.profiler.enabled:
+            file_name = '%s.%s.timing.json' % (self.globals.get('environment_name'), self.profiler.action)
+            self.profiler.write_report(os.path.join(self._ensure_template_dir_exists(), file_name))
 
     def _ensure_stack_is_deployed(self, stack_name='UnnamedStack', sns_topic=None, stack_params=[]):
         """
@@ -269,6 +471,9 @@ class EnvironmentBase(object):
         First attempts to issue an update stack command
         If this fails because the stack does not yet exist, then issues a create stack command
         """
+        # The AWS SDKs are imported by the actions using them, so the CLI starts quickly for the others
+        import botocore.exceptions
+
         is_successful = False
         notification_arns = []
 
@@ -334,8 +539,11 @@ class EnvironmentBase(object):
         Override the deploy_hook in your environment to intercept the deployment process
         This can be useful for creating resources using boto outside of cloudformation
         """
-        self.load_config()
-        self.deploy_hook()
+        self._start_profiler('deploy')
+        self._load_profiled_config()
+
+        with self.profiler.span('deploy_hook'):
+            self.deploy_hook()
 
         stack_name = self.config['global']['environment_name']
 
@@ -347,13 +555,15 @@ class EnvironmentBase(object):
 
         try:
             # First try to do an update-stack... if it doesn't exist, then try create-stack
-            is_successful = self._ensure_stack_is_deployed(
-                stack_name,
-                sns_topic=topic,
-                stack_params=self.deploy_parameter_bindings)
+            with self.profiler.span('deploy_stack'):
+                is_successful = self._ensure_stack_is_deployed(
+                    stack_name,
+                    sns_topic=topic,
+                    stack_params=self.deploy_parameter_bindings)
 
             if self.stack_monitor and is_successful:
-                self.stack_monitor.start_stack_monitor(queue, stack_name, debug=self.globals['print_debug'])
+                with self.profiler.span('monitor_stack'):
+                    self.stack_monitor.start_stack_monitor(queue, stack_name, debug=self.globals['print_debug'])
 
         except KeyboardInterrupt:
             if self.stack_monitor:
@@ -364,6 +574,8 @@ class EnvironmentBase(object):
         if self.stack_monitor:
             self.stack_monitor.cleanup_stack_monitor(topic, queue)
 
+        self._write_timing_report()
+
     def delete_action(self):
         """
         Default delete_action invoked by CLI
@@ -371,60 +583,20 @@ class EnvironmentBase(object):
         Override the delete_hook in your environment to intercept the delete process with your own code
         This can be useful for deleting any resources that were created outside of cloudformation
         """
-        self.load_config()
-        self.delete_hook()
+        self._start_profiler('delete')
+        self._load_profiled_config()
+
+        with self.profiler.span('delete_hook'):
+            self.delete_hook()
 
         cfn_conn = utility.get_boto_client(self.config, 'cloudformation')
         stack_name = self.config['global']['environment_name']
 
-        cfn_conn.delete_stack(StackName=stack_name)
+        with self.profiler.span('delete_stack'):
+            cfn_conn.delete_stack(StackName=stack_name)
         print "\nSuccessfully issued delete stack command for %s\n" % stack_name
 
-    def _validate_config_helper(self, schema, config, path):
-        # Check each requirement
-        for (req_key, req_value) in schema.iteritems():
-
-            # Check for key match, usually only one match but parametrized keys can have multiple matches
-            # Uses 'filename' match, similar to regex but only supports '?', '*', [XYZ], [!XYZ]
-            filter_fun = lambda candidate_key: fnmatch(candidate_key, req_key)
-
-            # Find all config keys matching the requirement
-            matches = filter(filter_fun, config.keys())
-            if not matches:
-                message = "Config file missing section " + str(path) + ('.' if path is not '' else '') + req_key
-                raise ValidationError(message)
-
-            # Validate each matching config entry
-            for matching_key in matches:
-                new_path = path + ('.' if path is not '' else '') + matching_key
-
-                # ------------ value check -----------
-                if isinstance(req_value, basestring):
-                    req_type = res.get_type(req_value)
-
-                    if not isinstance(config[matching_key], req_type):
-                        message = "Type mismatch in config, %s should be of type %s, not %s" % \
-                                  (new_path, req_value, type(config[matching_key]).__name__)
-                        raise ValidationError(message)
-                    # else:
-                    #     print "%s validated: %s == %s" % (new_path, req_value, type(config[matching_key]).__name__)
-
-                # if the schema is nested another level .. we must go deeper
-                elif isinstance(req_value, dict):
-                    matching_value = config[matching_key]
-                    if not isinstance(matching_value, dict):
-                        message = "Type mismatch in config, %s should be a dict, not %s" % \
-                                  (new_path, type(matching_value).__name__)
-                        raise ValidationError(message)
-
-                    self._validate_config_helper(req_value, matching_value, new_path)
-
-                elif isinstance(req_value, list):
-                    matching_value = config[matching_key]
-                    if not isinstance(matching_value, list):
-                        message = "Type mismatch in config, %s should be a list, not %s" % \
-                                  (new_path, type(matching_value).__name__)
-                        raise ValidationError(message)
+        self._write_timing_report()
 
     def _validate_region(self, config):
         """
@@ -435,23 +607,43 @@ class EnvironmentBase(object):
         if region_name not in valid_regions:
             raise ValidationError('Unrecognized region name: ' + region_name)
 
-    def _validate_config(self, config, factory_schema=res.CONFIG_REQUIREMENTS):
+    def _validate_config(self, config, factory_schema=None):
         """
         Compares provided dict against TEMPLATE_REQUIREMENTS. Checks that required all sections and values are present
-        and that the required types match. Throws ValidationError if not valid.
+        and that the required types match. Throws ValidationError listing every violation if not valid.
         :param config: dict to be validated
+        :param factory_schema: Schema to validate against, the package's config schema (config_schema.json) by default
         """
-        config_reqs_copy = copy.deepcopy(factory_schema)
-
-        # Merge in any requirements provided by config handlers
-        for handler in self._config_handlers:
-            config_reqs_copy.update(handler.get_config_schema())
+        # The default schema merged with the config handlers' schemas is only compiled once
+        if factory_schema is None:
+            if not self._config_validator:
+                self._config_validator = self._compile_config_validator(res.get_config_requirements())
+            validator = self._config_validator
+        else:
+            validator = self._compile_config_validator(factory_schema)
 
-        self._validate_config_helper(config_reqs_copy, config, '')
+        errors = validator.validate(config)
+        if errors:
+            raise ValidationError('\n'.join(errors))
 
         # # Validate region
         # self._validate_region(config)
 
+    def _compile_config_validator(self, factory_schema):
+        """
+        Compiles factory_schema merged with the schemas provided by the config handlers
+        """
+        return ConfigValidator(self._merge_config_schema(factory_schema))
+
+    def _merge_config_schema(self, factory_schema):
+        """
+        :return dict: factory_schema updated with the schemas provided by the config handlers
+        """
+        schema = dict(factory_schema)
+        for handler in self._config_handlers:
+            schema.update(handler.get_config_schema())
+        return schema
+
     def _add_config_handler(self, handler):
         """
         Register classes that will augment the configuration defaults and/or validation logic here
@@ -464,9 +656,10 @@ class EnvironmentBase(object):
             raise ValidationError('Class %s cannot be a config handler, missing get_config_schema()' % type(handler).__name__ )
 
         self._config_handlers.append(handler)
+        self._config_validator = None
 
     @staticmethod
-    def _config_env_override(config, path, print_debug=False):
+    def _config_env_override(config, path, print_debug=False, schema=None):
         """
         Update config value with values from the environment variables. If the environment variable exists
         the config value is replaced with its value.
@@ -493,35 +686,55 @@ class EnvironmentBase(object):
         Would replace those two database passwords if the following is run from the shell:
         > export DB_LABEL1_PASSWORD=myvoiceismypassword12345
         > export DB_LABEL2_PASSWORD=myvoiceismyotherpassword12345
+
+        The environment is only scanned once, into a prefix index of the variable names. The config is then only
+        walked down the sections some variable name starts with, so only the overrides actually set are paid for.
+
+        :param config: Config (section) to update in place
+        :param path: Path of the config section, '' for the whole config
+        :param print_debug: Print the config paths checked against the environment
+        :param schema: Config schema of the section, used to convert the string values to int, float, bool and list
         """
-        for key, val in config.iteritems():
-            new_path = path + ('.' if path is not '' else '') + key
-            env_name = '_'.join(new_path.split('.')).upper()
+        node = _index_environment(os.environ)
+        if path:
+            node = _find_env_prefix(node, '_'.join(path.split('.')).upper() + '_')
 
-            if not isinstance(val, dict):
-                env_value = os.environ.get(env_name)
-                if print_debug:
-                    print "Checking %s (%s)" % (env_name, new_path)
+        if node:
+            EnvironmentBase._apply_env_overrides(config, path, node, schema, print_debug)
 
-                if env_value is None:
-                    continue
+    @staticmethod
+    def _apply_env_overrides(config, path, env_index, schema, print_debug):
+        """
+        Replace the config values named by env_index, see _config_env_override()
+        :param env_index: Node of the environment variable prefix index matching path
+        """
+        for key, val in config.iteritems():
+            if not isinstance(key, basestring):
+                continue
 
-                # TODO: Need better schema validation for non-string values from env vars
+            node = _find_env_prefix(env_index, key.upper())
+            if node is None:
+                continue
 
-                # Convert true/false strings to booleans for schema validation
-                if env_value.lower() == 'true':
-                    env_value = True
-                elif env_value.lower() == 'false':
-                    env_value = False
+            new_path = path + ('.' if path else '') + key
+            requirement = _find_schema_requirement(schema, key)
 
-                default_value = config.get(key)
-                config[key] = env_value if env_value is not None else default_value
+            if isinstance(val, dict):
+                node = node.get('_')
+                if node:
+                    EnvironmentBase._apply_env_overrides(
+                        val, new_path, node, requirement if isinstance(requirement, dict) else None, print_debug)
+                continue
 
-                if env_value is not None:
-                    print "* Updating %s from '%s' to value of '%s'" % (new_path, default_value, env_name)
+            if print_debug:
+                print "Checking %s" % new_path
 
-            else:
-                EnvironmentBase._config_env_override(config[key], new_path, print_debug=print_debug)
+            if ENV_INDEX_VALUE not in node:
+                continue
+
+            (env_name, env_value) = node[ENV_INDEX_VALUE]
+            config[key] = _convert_env_value(env_value, requirement)
+            print "* Updating %s from '%s' to value of '%s'" % (new_path, val, env_name)
 
     def generate_config(self):
         """
@@ -536,7 +749,7 @@ class EnvironmentBase(object):
             if not overwrite == 'y':
                 return
 
-        config = copy.deepcopy(res.FACTORY_DEFAULT_CONFIG)
+        config = copy.deepcopy(res.get_factory_default_config())
 
         # Merge in any defaults provided by registered config handlers
         for handler in self._config_handlers:
@@ -556,25 +769,44 @@ class EnvironmentBase(object):
         if not view:
             view = self.view
 
-        # Allow overriding of the entire config object
-        if self.config_file_override:
-            config = self.config_file_override
+        schema = self._merge_config_schema(res.get_config_requirements())
 
-        # Else read from file
-        else:
-            config = res.load_file('', self.config_filename)
+        # Reuse the config a previous run loaded and validated from the same inputs (see global.config_cache)
+        config_cache = None if self.config_file_override else self._get_config_cache(view, schema)
+        config = config_cache.load() if config_cache else None
+        is_cache_hit = config is not None
+
+        if not is_cache_hit:
+            # Allow overriding of the entire config object
+            if self.config_file_override:
+                config = self.config_file_override
+
+            # Else read from file
+            else:
+                config = res.load_file('', self.config_filename)
+
+            # Load in cli config overrides
+            view.update_config(config)
 
-        # Load in cli config overrides
-        view.update_config(config)
+        # The cache holds the config as it was before the environment overrides, which may hold secrets (e.g.
+        # passwords), so they are applied again on a hit
+        uncached_config = None
+        if not is_cache_hit and config_cache and config['global'].get('config_cache', False):
+            uncached_config = copy.deepcopy(config)
 
         # record value of the debug variable
         debug = config['global']['print_debug']
 
         # Check the environment variables for any overrides
-        self._config_env_override(config, '', print_debug=debug)
+        self._config_env_override(config, '', print_debug=debug, schema=schema)
+
+        # Validate results, a hit was validated with the same environment overrides when it was stored
+        if not is_cache_hit:
+            self._validate_config(config)
+
+        if uncached_config is not None:
+            config_cache.store(uncached_config)
 
-        # Validate and save results
-        self._validate_config(config)
         self.config = config
 
         # Save shortcut references to commonly referenced config sections
@@ -587,6 +819,20 @@ class EnvironmentBase(object):
             self.stack_monitor.add_handler(self)
 
 
+    def _get_config_cache(self, view, schema):
+        """
+        :return ConfigCache: Cache of the config loaded from self.config_filename through view, None if the view's
+        config overrides can't be identified (it has no get_config_args()) or the config file doesn't exist
+        """
+        if not callable(getattr(view, 'get_config_args', None)):
+            return None
+
+        config_path = res.test_file('', self.config_filename)
+        if not config_path:
+            return None
+
+        return ConfigCache(config_path, view.get_config_args(), schema)
+
     def initialize_template(self):
         """
         Create new Template instance, set description and common parameters and load AMI cache.
@@ -599,6 +845,34 @@ class EnvironmentBase(object):
         Template.stack_timeout = self.template_args.get("timeout_in_minutes")
         Template.upload_acl = self.template_args.get('s3_upload_acl')
         Template.include_timestamp = self.template_args.get('include_timestamp')
+        Template.include_content_hash = self.template_args.get('include_content_hash', False)
+
+        # Reuse the builds of child templates whose inputs and code are unchanged since the last create
+        if self.template_args.get('build_cache', False):
+            Template.build_cache = BuildCache(self._ensure_template_dir_exists(), self.config, controller_class=type(self))
+        else:
+            Template.build_cache = None
+
+        # Split templates exceeding the CloudFormation template limits into nested stacks
+        Template.auto_shard = self.template_args.get('auto_shard', False)
+
+        # Only keep the RegionMap entries each template looks up, in the regions it will be deployed to
+        Template.prune_region_map = self.template_args.get('prune_region_map', False)
+        Template.target_regions = self.template_args.get('target_regions') or None
+
+        # Pass the subnets to the child templates as one list parameter per layer rather than one parameter per subnet
+        Template.subnet_list_parameters = self.template_args.get('subnet_list_parameters', False)
+
+        # Only re-export the child outputs consumed by an ancestor or sibling template (and the listed ones)
+        Template.selective_output_propagation = self.template_args.get('selective_output_propagation', False)
+        Template.exported_outputs = self.template_args.get('exported_outputs') or []
+
+        output_format = self.template_args.get('output_format', 'pretty')
+        if output_format not in utility.TEMPLATE_OUTPUT_FORMATS:
+            raise ValidationError('template.output_format must be one of: %s' % ', '.join(utility.TEMPLATE_OUTPUT_FORMATS))
+        Template.output_format = output_format
+        Template.gzip_local_templates = self.template_args.get('gzip_local_templates', False)
+        Template.compress_user_data = self.template_args.get('compress_user_data', False)
 
         Template.include_templateValidationHash_output = self.template_args.get('include_templateValidationHash_output')
         Template.include_dateGenerated_output = self.template_args.get('include_dateGenerated_output')
@@ -645,7 +919,7 @@ class EnvironmentBase(object):
                 return
 
         with open(ami_cache_filename, 'w') as f:
-            f.write(json.dumps(res.FACTORY_DEFAULT_AMI_CACHE, indent=4, separators=(',', ': ')))
+            f.write(json.dumps(res.get_factory_default_ami_cache(), indent=4, separators=(',', ': ')))
             print "Generated AMI cache file at %s\n" % ami_cache_filename
 
     def to_json(self):
@@ -671,15 +945,18 @@ class EnvironmentBase(object):
     # - self.common_security_group
     # - self.utility_bucket
     # - self.subnets: keyed by type, layer, and AZ index (e.g. self.subnets['public']['web'][1])
-    def add_child_template(self, child_template, merge=False, depends_on=[]):
+    def add_child_template(self, child_template, merge=False, depends_on=[], propagate_outputs=True):
         """
         Saves reference to provided template. References are processed in write_template_to_file().
         :param child_template: The Environmentbase Template you want to associate with the current instances
         :param depends_on: List of upstream resources that must be processes before the provided template
         :param merge: Determines whether the resource is attached as a child template or all of its resources merged
         into the current template
+        :param propagate_outputs: Re-export the child's outputs from the root template, True, False or the list of
+        output names to re-export
         """
-        return self.template.add_child_template(child_template, merge=merge, depends_on=depends_on)
+        return self.template.add_child_template(child_template, merge=merge, depends_on=depends_on,
+                                                propagate_outputs=propagate_outputs)
 
 
     def write_stack_outputs_to_file(self, event_data):
@@ -747,6 +1024,7 @@ class EnvironmentBase(object):
         We persist the CFN connection so that we don't create a new session with each request
         """
         if not self.cfn_connection:
+            from boto import cloudformation
             self.cfn_connection = cloudformation.connect_to_region(self.config.get('boto').get('region_name'))
         return self.cfn_connection
 
@@ -756,6 +1034,7 @@ class EnvironmentBase(object):
         We persist the STS credentials so that we don't create a new session with each request
         """
         if not self.sts_credentials:
+            from boto import sts
             sts_connection = sts.STSConnection()
             assumed_role = sts_connection.assume_role(
                 role_arn=role_arn,
@@ -23,6 +23,6 @@ class NetworkBase(EnvironmentBase):
         base_network_template = BaseNetwork('BaseNetwork', network_config, nat_config)
         self.add_child_template(base_network_template)
 
-        self.template._subnets = base_network_template._subnets.copy()
+        self.template._subnets = base_network_template._subnets.clone()
         self.template._vpc_id = GetAtt(base_network_template.name, 'Outputs.vpcId')
 
@@ -0,0 +1,72 @@
+from collections import MutableMapping
+
+
+class OverlayDict(MutableMapping):
+    """
+    Mapping layered over a base dict: reads fall through to the base, writes and deletes only change the overlay.
+    Only the entries written to the overlay are held in it, get_delta() returns them.
+
+    It's a MutableMapping rather than a dict subclass, so dict(overlay), {}.update(overlay) and **overlay go through
+    keys()/__getitem__ and see the base entries too.  It renders as a plain dict (see JSONrepr()).
+
+    Used by Template.merge() so the merged template sees the parent's parameters, resources, etc. without copying
+    them, and only what it adds is copied back into the parent.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self._overlay = {}
+        # Base keys deleted through the overlay
+        self._hidden = set()
+
+    def get_delta(self):
+        """
+        Returns the entries written to the overlay, including those replacing a base entry
+        """
+        return dict(self._overlay)
+
+    def _has_base_key(self, key):
+        return key in self.base and key not in self._hidden
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        if self._has_base_key(key):
+            return self.base[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._overlay or self._has_base_key(key)
+
+    has_key = __contains__
+
+    def __setitem__(self, key, value):
+        self._overlay[key] = value
+        self._hidden.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._overlay.pop(key, None)
+        if key in self.base:
+            self._hidden.add(key)
+
+    def __iter__(self):
+        for key in self._overlay:
+            yield key
+        for key in self.base:
+            if key not in self._hidden and key not in self._overlay:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        return dict(self)
+
+    def JSONrepr(self):
+        # Rendered by troposphere's json encoder and utility.tropo_to_dict() like the dict it stands for
+        return dict(self)
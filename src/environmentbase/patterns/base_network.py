@@ -1,7 +1,5 @@
 from troposphere import Ref, FindInMap, Output, GetAZs, Select
 import troposphere.ec2 as ec2
-import boto.vpc
-import boto
 from ipcalc import Network
 import ha_nat
 import netaddr
@@ -145,13 +143,7 @@ class BaseNetwork(Template):
             subnet_name = subnet_layer + 'AZ' + str(subnet_az)
 
             # Save the subnet references to the template object
-            if subnet_type not in self._subnets:
-                self._subnets[subnet_type] = {}
-
-            if subnet_layer not in self._subnets[subnet_type]:
-                self._subnets[subnet_type][subnet_layer] = []
-
-            self._subnets[subnet_type][subnet_layer].append(Ref(subnet_name))
+            self._subnets.add(subnet_type, subnet_layer, Ref(subnet_name), az_index=int(subnet_az))
 
     def create_network_components(self, network_config, nat_config):
         """
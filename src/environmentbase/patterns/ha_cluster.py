@@ -45,7 +45,9 @@ class HaCluster(Template):
                  elb_custom_tags={},
                  scaling_policies=None,
                  creation_policy_timeout=None,
-                 allow_default_ingress=True):
+                 allow_default_ingress=True,
+                 compress_user_data=None,
+                 inline_sg_rules=False):
         
         # This will be the name used in resource names and descriptions
         self.name = name
@@ -59,6 +61,9 @@ class HaCluster(Template):
         # This is a dictionary of environment variables to inject into the instances
         self.env_vars = env_vars
 
+        # Gzip the userdata script (env_vars holding Refs etc. stay uncompressed), None uses the template.compress_user_data config
+        self.compress_user_data = compress_user_data
+
         # These define the lower and upper boundaries of the autoscaling group
         self.min_size = min_size
         self.max_size = max_size
@@ -123,6 +128,9 @@ class HaCluster(Template):
         # Internet facing ELBs would allow ingress from PUBLIC_ACCESS_CIDR and private ELBs will allow ingress from the VPC CIDR
         self.allow_default_ingress = allow_default_ingress
 
+        # Add the ELB to cluster ingress rules to the cluster security group itself rather than as separate resources
+        self.inline_sg_rules = inline_sg_rules
+
         super(HaCluster, self).__init__(template_name=self.name)
 
 
@@ -164,10 +172,7 @@ class HaCluster(Template):
         set it out here so we can pass the same subnet to template.add_elb()
         """
         if not self.subnet_layer:
-            if len(self._subnets.get('private')) > 0:
-                self.subnet_layer = self._subnets['private'].keys()[0]
-            else:
-                self.subnet_layer = self._subnets['public'].keys()[0]
+            self.subnet_layer = self._subnets.get_default_layer('private', 'public')
 
     def add_security_groups(self):
         """
@@ -213,11 +218,12 @@ class HaCluster(Template):
         if self.elb_health_check_port:
             cluster_sg_ingress_ports.add(self.elb_health_check_port)
 
-        for cluster_sg_ingress_port in cluster_sg_ingress_ports:
-            self.create_reciprocal_sg(
-                elb_sg, elb_sg_name,
-                ha_cluster_sg, ha_cluster_sg_name,
-                from_port=cluster_sg_ingress_port)
+        # Contiguous ports are opened as a single port range
+        self.create_reciprocal_sgs(
+            elb_sg, elb_sg_name,
+            ha_cluster_sg, ha_cluster_sg_name,
+            ports=cluster_sg_ingress_ports,
+            inline=self.inline_sg_rules)
 
         self.security_groups = {'ha_cluster': ha_cluster_sg, 'elb': elb_sg}
 
@@ -286,7 +292,7 @@ class HaCluster(Template):
         Wrapper method to encapsulate process of constructing userdata for the autoscaling group
         Sets self.user_data_payload constructed from the passed in user_data and env_vars 
         """
-        self.user_data_payload = self.construct_user_data(self.env_vars, self.user_data)
+        self.user_data_payload = self.construct_user_data(self.env_vars, self.user_data, compress=self.compress_user_data)
 
 
     def add_cluster_asg(self):
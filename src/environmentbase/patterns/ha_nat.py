@@ -137,7 +137,7 @@ class HaNat(Template):
         if self.enable_ntp:
             user_data.append(resources.get_resource('ntp_takeover.sh'))
         if self.extra_user_data:
-            user_data.append(open(self.extra_user_data).read())
+            user_data.append(resources.read_file(self.extra_user_data))
 
         nat_asg_name = "Nat%sASG" % str(self.subnet_index)
 
@@ -162,7 +162,7 @@ class HaNat(Template):
         ))
 
         # Create the NAT in a public subnet
-        subnet_layer = self._subnets['public'].keys()[0]
+        subnet_layer = self._subnets.get_default_layer('public')
 
         nat_asg = self.add_resource(AutoScalingGroup(
             nat_asg_name,
@@ -177,7 +177,7 @@ class HaNat(Template):
             LaunchConfigurationName=Ref(nat_launch_config),
             HealthCheckGracePeriod=30,
             HealthCheckType="EC2",
-            VPCZoneIdentifier=[self._subnets['public'][subnet_layer][self.subnet_index]],
+            VPCZoneIdentifier=[self._subnets.get_az_subnets(self.subnet_index, 'public')[subnet_layer]],
             CreationPolicy=CreationPolicy(
                 ResourceSignal=ResourceSignal(
                     Count=1,
@@ -1,3 +1,4 @@
+import copy
 from environmentbase.template import Template
 import environmentbase.resources as res
 from environmentbase.networkbase import NetworkBase
@@ -102,8 +103,8 @@ class RDS(Template):
             Default=db_config.get('db_instance_type_default'),
             Type='String',
             Description='DB Instance Type for the RDS instance.',
-            AllowedValues=res.COMMON_STRINGS.get('valid_db_instance_types'),
-            ConstraintDescription=res.COMMON_STRINGS.get('valid_db_instance_type_message')))
+            AllowedValues=res.get_str('valid_db_instance_types'),
+            ConstraintDescription=res.get_str('valid_db_instance_type_message')))
 
         name_param = self.add_parameter(Parameter(
             db_label.lower() + self.tier_name.title() + 'RdsDbName',
@@ -251,7 +252,7 @@ class Controller(NetworkBase):
         # Create the rds instance pattern (includes standard standard parameters)
         my_db = RDS(
             'dbTier',
-            subnet_set=self.template.subnets['private'].keys()[0],
+            subnet_set=self.template.subnets.get_default_layer('private'),
             config_map=db_config)
 
         # Attach pattern as a child template
@@ -303,7 +304,7 @@ if __name__ == '__main__':
         }
     }
 
-    my_config = res.FACTORY_DEFAULT_CONFIG
+    my_config = copy.deepcopy(res.get_factory_default_config())
     my_config['db'] = db_config
 
     env_config = EnvConfig(config_handlers=[RDS])
@@ -0,0 +1,181 @@
+import __builtin__
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Profiler(object):
+    """
+    Records nested timing spans for a controller action (create/deploy/delete) and writes them as a json report.
+    Spans nest per thread, spans opened on a thread with no open span (e.g. the upload workers) are recorded at the
+    top level.  A disabled profiler records nothing, so spans can be left in place at no cost.
+
+    Report format:
+    {
+        "action": <action name>,
+        "started": <UTC start time>,
+        "seconds": <total duration>,
+        "spans": [{"name": <phase>, "start": <offset from the start>, "seconds": <duration>, <attributes>,
+                   "children": [<nested spans>]}],
+        "totals": {<phase>: {"count": <number of spans>, "seconds": <summed duration>}},
+        "templates": {<child template name>: <seconds spent processing it, including its own children>}
+    }
+    """
+
+    def __init__(self, action=None, enabled=True):
+        self.action = action
+        self.enabled = enabled
+        self.spans = []
+        self.started = datetime.utcnow()
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get_open_spans(self):
+        if not hasattr(self._local, 'open_spans'):
+            self._local.open_spans = []
+        return self._local.open_spans
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Times the enclosed block as a span named after the phase, nested under the span currently open on this thread
+        :param attributes: Extra json serializable values recorded with the span, e.g. template=<template name>
+        """
+        if not self.enabled:
+            yield
+            return
+
+        span = dict(attributes, name=name, start=time.time() - self._start_time, children=[])
+        open_spans = self._get_open_spans()
+
+        if open_spans:
+            open_spans[-1]['children'].append(span)
+        else:
+            with self._lock:
+                self.spans.append(span)
+
+        open_spans.append(span)
+        try:
+            yield
+        finally:
+            open_spans.pop()
+            span['seconds'] = time.time() - self._start_time - span['start']
+
+    def get_report(self):
+        totals = {}
+        templates = {}
+
+        pending = list(self.spans)
+        while pending:
+            span = pending.pop()
+            pending.extend(span['children'])
+
+            total = totals.setdefault(span['name'], {'count': 0, 'seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] += span.get('seconds', 0.0)
+
+            if span['name'] == 'process_child_template':
+                templates[span['template']] = span.get('seconds', 0.0)
+
+        return {
+            'action': self.action,
+            'started': str(self.started),
+            'seconds': time.time() - self._start_time,
+            'spans': self.spans,
+            'totals': totals,
+            'templates': templates
+        }
+
+    def write_report(self, file_path):
+        """
+        Writes the timing report to file_path, nothing is written when the profiler is disabled
+        """
+        if not self.enabled:
+            return
+
+        directory = os.path.dirname(file_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(file_path, 'w') as f:
+            f.write(json.dumps(self.get_report(), indent=4, sort_keys=True, separators=(',', ': ')))
+
+        print 'Timing report: %s\n' % file_path
+
+
+class ImportTimer(object):
+    """
+    Records how long each module takes to import while started, by wrapping __import__.  Imports nest, a module's
+    cumulative time includes the modules it imports in turn while its self time doesn't.  Only imports that load new
+    modules are recorded, the time spent in those already loaded is negligible.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self._original_import = None
+        self._child_seconds = []
+
+    def start(self):
+        if self._original_import is None:
+            self._original_import = __builtin__.__import__
+            __builtin__.__import__ = self._timed_import
+
+    def stop(self):
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        loaded_count = len(sys.modules)
+        self._child_seconds.append(0.0)
+        start_time = time.time()
+        try:
+            module = self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            seconds = time.time() - start_time
+            child_seconds = self._child_seconds.pop()
+            if self._child_seconds:
+                self._child_seconds[-1] += seconds
+
+        if len(sys.modules) > loaded_count:
+            timing = self.modules.setdefault(self._get_module_name(name, module, fromlist), {'seconds': 0.0, 'self_seconds': 0.0})
+            timing['seconds'] += seconds
+            timing['self_seconds'] += seconds - child_seconds
+
+        return module
+
+    @staticmethod
+    def _get_module_name(name, module, fromlist):
+        """
+        Full name of the imported module, __import__ returns the package of 'import a.b' and resolves implicit
+        relative imports (e.g. 'import utility' inside environmentbase) to the package's module
+        """
+        module_name = getattr(module, '__name__', name)
+        if fromlist:
+            # 'from package import module' loads the module rather than the package
+            imported = getattr(module, fromlist[0], None) if len(fromlist) == 1 else None
+            return imported.__name__ if isinstance(imported, type(sys)) else module_name
+
+        top_level = name.partition('.')[0]
+        if module_name.endswith('.' + top_level):
+            return module_name[:-len(top_level)] + name
+        return name
+
+    def get_report(self, limit=None):
+        """
+        @return [list] (module name, cumulative seconds, self seconds) slowest first
+        """
+        report = sorted(((name, timing['seconds'], timing['self_seconds']) for (name, timing) in self.modules.iteritems()),
+                        key=lambda row: row[1], reverse=True)
+        return report[:limit] if limit else report
+
+    def print_report(self, limit=30):
+        row_format = '{:<48} {:>12} {:>12}'
+        print row_format.format('module', 'cumul (ms)', 'self (ms)')
+        for (name, seconds, self_seconds) in self.get_report(limit):
+            print row_format.format(name, '%.1f' % (seconds * 1000), '%.1f' % (self_seconds * 1000))
@@ -1,6 +1,16 @@
-from pkg_resources import resource_string, resource_exists
-import yaml, json
+import json
 import os
+import sys
+from contextlib import contextmanager
+
+
+def _load_yaml(content):
+    """
+    Parses yaml (or json) content with libyaml's C parser when PyYAML was built with it, it's several times faster than
+    the pure python one.  yaml is slow to import so it's only imported once something is parsed.
+    """
+    import yaml
+    return yaml.load(content, Loader=getattr(yaml, 'CLoader', yaml.Loader))
 
 
 def _test_filelike(parent, basename, validator):
@@ -24,6 +34,8 @@ def _test_filelike(parent, basename, validator):
 
 
 def test_resource(parent, basename, relative_to_module_name=__name__):
+    # pkg_resources is slow to import, it's only needed for resources that aren't plain files on disk
+    from pkg_resources import resource_exists
     resource_test = lambda file_path: resource_exists(relative_to_module_name, file_path)
     return _test_filelike(parent, basename, resource_test)
 
@@ -35,35 +47,170 @@ def test_file(parent, basename):
 
 def get_yaml_resource(resource_name, relative_to_module_name=__name__):
     """
-    Get package resource as json
+    Get package resource as json, parsed again on each call (see get_factory_default_config() etc. for the shared ones)
+    """
+    return _load_yaml(get_resource(resource_name, relative_to_module_name))
+
+
+# Process-wide cache of file and package resource contents: key -> (modification time, contents)
+# Keys are (path, transform) for read_file() and (module, resource name) for get_resource()
+_content_cache = {}
+
+# (module, resource name) -> (resource path within the package, path on disk or None when zipped)
+_resource_paths = {}
+
+# Resource name -> parsed contents of the factory default resources, see _get_parsed_resource()
+_parsed_resources = {}
+
+# Sets collecting the paths of the files read, see record_file_reads()
+_read_recorders = []
+
+
+def _get_mtime(file_path):
+    try:
+        return os.path.getmtime(file_path)
+    except OSError:
+        return None
+
+
+def _get_cached(key, mtime, load):
+    """
+    Returns the cached contents for key, calling load() to (re)read them when missing or when mtime has changed
     """
-    return yaml.load(get_resource(resource_name, relative_to_module_name))
+    cached = _content_cache.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, load())
+        _content_cache[key] = cached
+    return cached[1]
+
+
+def _record_read(file_path):
+    for recorder in _read_recorders:
+        recorder.add(file_path)
+
+
+@contextmanager
+def record_file_reads(file_paths):
+    """
+    Adds the path of every file read through read_file() and get_resource() (cached or not) to the set file_paths
+    while the context is active.  Resources only available from a zipped archive aren't recorded.
+    """
+    _read_recorders.append(file_paths)
+    try:
+        yield file_paths
+    finally:
+        _read_recorders.pop()
+
+
+def clear_cache():
+    """
+    Forgets all cached file and resource contents
+    """
+    _content_cache.clear()
+    _resource_paths.clear()
+    _parsed_resources.clear()
+
+
+def read_file(file_path, transform=None):
+    """
+    Reads a file through the process-wide cache, it's read again only once its modification time changes.
+    :param transform: Function applied to the file contents before they're cached (e.g. splitting them into lines),
+    cached separately per transform.  Cached values are shared, so transform should return something immutable.
+    """
+    file_path = os.path.abspath(file_path)
+    _record_read(file_path)
+
+    def load():
+        with open(file_path, 'r') as f:
+            content = f.read()
+        return transform(content) if transform else content
+
+    return _get_cached((file_path, transform), _get_mtime(file_path), load)
+
+
+def _get_resource_path(resource_name, relative_to_module_name):
+    key = (relative_to_module_name, resource_name)
+    if key not in _resource_paths:
+        # Resources of a package on disk are read (and checked for changes) as plain files, only those in a zipped
+        # archive go through pkg_resources
+        module = sys.modules.get(relative_to_module_name)
+        disk_path = None
+        if module is not None and os.path.isfile(getattr(module, '__file__', '')):
+            disk_path = test_file(os.path.join(os.path.dirname(os.path.abspath(module.__file__)), 'data'), resource_name)
+
+        if disk_path:
+            file_path = os.path.join('data', os.path.basename(disk_path))
+        else:
+            file_path = test_resource('data', resource_name, relative_to_module_name)
+
+        _resource_paths[key] = (file_path, disk_path)
+
+    return _resource_paths[key]
 
 
 def get_resource(resource_name, relative_to_module_name=__name__):
     """
     Retrieves resource embedded in the package (even if installed as a zipped archive).
+    Contents are cached for the process, resources on disk are read again when their modification time changes.
     """
-    file_path = test_resource('data', resource_name, relative_to_module_name)
-    file_content = resource_string(relative_to_module_name, file_path)
-    return file_content
+    (file_path, disk_path) = _get_resource_path(resource_name, relative_to_module_name)
+
+    if disk_path:
+        _record_read(disk_path)
+
+        def load():
+            with open(disk_path, 'rb') as f:
+                return f.read()
+    else:
+        def load():
+            from pkg_resources import resource_string
+            return resource_string(relative_to_module_name, file_path)
+
+    return _get_cached((relative_to_module_name, resource_name), _get_mtime(disk_path) if disk_path else None, load)
+
+
+def _get_parsed_resource(resource_name):
+    """
+    Parses one of this package's yaml resources on first use, the parsed contents are shared by every caller
+    """
+    if resource_name not in _parsed_resources:
+        _parsed_resources[resource_name] = get_yaml_resource(resource_name)
+    return _parsed_resources[resource_name]
 
 EXTENSIONS = ['.json', '.yaml', '.yml']
 
 DEFAULT_CONFIG_FILENAME = 'config'
-FACTORY_DEFAULT_CONFIG = get_yaml_resource(DEFAULT_CONFIG_FILENAME)
+DEFAULT_AMI_CACHE_FILENAME = 'ami_cache'
+CONFIG_REQUIREMENTS_FILENAME = 'config_schema'
+COMMON_STRINGS_FILENAME = 'common_strings'
 
 
-DEFAULT_AMI_CACHE_FILENAME = 'ami_cache'
-FACTORY_DEFAULT_AMI_CACHE = get_yaml_resource(DEFAULT_AMI_CACHE_FILENAME)
+def get_factory_default_config():
+    """
+    Returns the factory default config, it's shared so deep copy it before making any changes
+    """
+    return _get_parsed_resource(DEFAULT_CONFIG_FILENAME)
 
 
-CONFIG_REQUIREMENTS_FILENAME = 'config_schema'
-CONFIG_REQUIREMENTS = get_yaml_resource(CONFIG_REQUIREMENTS_FILENAME)
+def get_factory_default_ami_cache():
+    """
+    Returns the factory default AMI cache (region -> AMI name -> AMI id), shared like the factory default config
+    """
+    return _get_parsed_resource(DEFAULT_AMI_CACHE_FILENAME)
 
 
-COMMON_STRINGS_FILENAME = 'common_strings'
-COMMON_STRINGS = get_yaml_resource(COMMON_STRINGS_FILENAME)
+def get_config_requirements():
+    """
+    Returns the config schema, the sections and keys every config must have and their types
+    """
+    return _get_parsed_resource(CONFIG_REQUIREMENTS_FILENAME)
+
+
+def get_common_strings():
+    """
+    Returns the common strings (regular expressions, constraint messages, allowed values) used by the templates
+    """
+    return _get_parsed_resource(COMMON_STRINGS_FILENAME)
 
 
 def load_file(parent, basename):
@@ -85,7 +232,7 @@ def load_yaml_file(file_path):
     with open(file_path, 'r') as f:
         try:
             content = f.read()
-            parsed_content = yaml.load(content)
+            parsed_content = _load_yaml(content)
         except ValueError:
             print '%s could not be parsed' % file_path
             raise
@@ -111,7 +258,7 @@ def load_json_file(file_path):
 
 
 def get_str(key, default=None):
-    return COMMON_STRINGS.get(key, default)
+    return get_common_strings().get(key, default)
 
 
 def get_type(typename):
@@ -0,0 +1,325 @@
+from collections import OrderedDict
+from troposphere import Ref, Select
+
+
+class SubnetLayerList(list):
+    """
+    The subnets of a layer passed to a template as a single List<AWS::EC2::Subnet::Id> parameter.
+
+    It's the list of Select()s of each AZ's subnet from the parameter, so indexing, iterating and slicing work like
+    any other layer, but used directly as a property value (e.g. VPCZoneIdentifier) it renders as a single Ref of the
+    parameter.
+    """
+
+    def __init__(self, parameter, subnet_count):
+        """
+        @param parameter [Parameter] The List<AWS::EC2::Subnet::Id> parameter holding the subnets
+        @param subnet_count [int] Number of subnets (AZs) in the layer
+        """
+        super(SubnetLayerList, self).__init__(Select(index, Ref(parameter)) for index in range(subnet_count))
+        self.parameter = parameter
+
+    def JSONrepr(self):
+        return Ref(self.parameter).JSONrepr()
+
+
+def _raise_read_only(*args, **kwargs):
+    raise TypeError('The subnets of a read only SubnetRegistry can\'t be modified, clone() the registry instead')
+
+
+class ReadOnlyList(list):
+    """
+    List of a read only SubnetRegistry's layer subnets, it's still a list so it can be used as a property value
+    """
+
+    append = extend = insert = remove = pop = reverse = sort = _raise_read_only
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _raise_read_only
+
+    def __reduce__(self):
+        # Copies and pickles are rebuilt from the items rather than by appending them
+        return (ReadOnlyList, (list(self),))
+
+
+class ReadOnlyLayers(OrderedDict):
+    """
+    Layers of a subnet type in a read only SubnetRegistry
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ReadOnlyLayers, self).__init__(*args, **kwargs)
+        self._read_only = True
+
+    def __setitem__(self, key, value, *args):
+        if getattr(self, '_read_only', False):
+            _raise_read_only()
+        OrderedDict.__setitem__(self, key, value, *args)
+
+    def __delitem__(self, key, *args):
+        _raise_read_only()
+
+    def clear(self):
+        _raise_read_only()
+
+
+class SubnetRegistry(dict):
+    """
+    Subnets of a template keyed by type, layer and AZ index (e.g. registry['public']['web'][1]), with indexes so the
+    type of a layer, the subnets of an AZ and the default layer of a type are found without scanning.
+
+    Layers keep their insertion order, so the default layer of a type is the first one added.  Subnets are added
+    through add() (or by assigning a whole type), which keeps the indexes up to date; the nested dicts and lists are
+    shared between clones and must not be modified in place.
+
+    clone() is copy-on-write: the clone shares the type dicts, layer lists and indexes with the original until either
+    of them adds a subnet, at which point only the parts being written are copied.
+
+    version is incremented by every change, so views derived from the registry (see Template.subnets) can tell whether
+    they're still current.  freeze() makes a registry read only, its clones are writable.
+    """
+
+    def __init__(self, subnets=None):
+        super(SubnetRegistry, self).__init__()
+        # layer -> type
+        self._layer_types = {}
+        # AZ index -> [(layer, subnet)] in insertion order
+        self._az_subnets = {}
+        # Types, (type, layer) pairs and indexes this registry may modify in place, everything else is shared
+        self._owned = set()
+        self.version = 0
+        self._frozen = False
+
+        for (subnet_type, layers) in (subnets or {}).iteritems():
+            self[subnet_type] = layers
+
+    def __setitem__(self, subnet_type, layers):
+        """
+        Replaces all the layers of subnet_type, indexing each layer's subnets by their position as the AZ index
+        """
+        self._check_writable()
+        self.version += 1
+
+        for subnet_layer in self.get(subnet_type, {}).keys():
+            self._remove_layer(subnet_layer)
+            self._owned.discard((subnet_type, subnet_layer))
+
+        self._own_type(subnet_type, OrderedDict())
+        for (subnet_layer, subnets) in layers.iteritems():
+            if isinstance(subnets, SubnetLayerList):
+                self.add_list(subnet_type, subnet_layer, subnets)
+                continue
+
+            self.add_layer(subnet_type, subnet_layer)
+            for subnet in subnets:
+                self.add(subnet_type, subnet_layer, subnet)
+
+    # Writes bypassing the indexes are only guarded against on read only registries
+    def __delitem__(self, subnet_type):
+        self._check_writable()
+        super(SubnetRegistry, self).__delitem__(subnet_type)
+
+    def clear(self):
+        self._check_writable()
+        super(SubnetRegistry, self).clear()
+
+    def pop(self, *args):
+        self._check_writable()
+        return super(SubnetRegistry, self).pop(*args)
+
+    def popitem(self):
+        self._check_writable()
+        return super(SubnetRegistry, self).popitem()
+
+    def setdefault(self, *args):
+        self._check_writable()
+        return super(SubnetRegistry, self).setdefault(*args)
+
+    def update(self, *args, **kwargs):
+        self._check_writable()
+        super(SubnetRegistry, self).update(*args, **kwargs)
+
+    def __reduce__(self):
+        # The default dict pickling adds the items with __setitem__ before the indexes exist
+        return (SubnetRegistry, (), (dict(self), self.__dict__))
+
+    def __setstate__(self, state):
+        (subnets, attributes) = state
+        dict.update(self, subnets)
+        self.__dict__.update(attributes)
+
+    def _check_writable(self):
+        if self._frozen:
+            _raise_read_only()
+
+    def _own_type(self, subnet_type, layers=None):
+        if layers is None:
+            if subnet_type in self._owned:
+                return super(SubnetRegistry, self).__getitem__(subnet_type)
+            layers = OrderedDict(self.get(subnet_type, {}))
+
+        super(SubnetRegistry, self).__setitem__(subnet_type, layers)
+        self._owned.add(subnet_type)
+        return layers
+
+    def _own_layer(self, subnet_type, subnet_layer):
+        layers = self._own_type(subnet_type)
+        if (subnet_type, subnet_layer) not in self._owned:
+            layers[subnet_layer] = list(layers.get(subnet_layer, []))
+            self._owned.add((subnet_type, subnet_layer))
+        return layers[subnet_layer]
+
+    def _own_indexes(self):
+        if 'indexes' not in self._owned:
+            self._layer_types = dict(self._layer_types)
+            self._az_subnets = {az: list(subnets) for (az, subnets) in self._az_subnets.iteritems()}
+            self._owned.add('indexes')
+
+    def _remove_layer(self, subnet_layer):
+        self.version += 1
+        self._own_indexes()
+        self._layer_types.pop(subnet_layer, None)
+        for (az_index, subnets) in self._az_subnets.items():
+            self._az_subnets[az_index] = [(layer, subnet) for (layer, subnet) in subnets if layer != subnet_layer]
+
+    def add_layer(self, subnet_type, subnet_layer):
+        """
+        Registers an empty subnet_layer of subnet_type, does nothing if the layer is already registered
+        """
+        if subnet_layer in self.get(subnet_type, {}):
+            return
+
+        self._check_writable()
+        if subnet_layer in self._layer_types:
+            raise ValueError('Subnet layer %s is already registered as type %s' %
+                             (subnet_layer, self._layer_types[subnet_layer]))
+
+        self.version += 1
+        self._own_layer(subnet_type, subnet_layer)
+        self._own_indexes()
+        self._layer_types[subnet_layer] = subnet_type
+
+    def add(self, subnet_type, subnet_layer, subnet, az_index=None):
+        """
+        Appends subnet to the subnet_layer of subnet_type
+        @param subnet [Ref|Parameter] The subnet to add
+        @param az_index [int] AZ index of the subnet, defaults to its position in the layer
+        """
+        self._check_writable()
+        self.add_layer(subnet_type, subnet_layer)
+
+        if isinstance(self[subnet_type][subnet_layer], SubnetLayerList):
+            raise ValueError('Subnet layer %s is a list parameter, subnets can\'t be added to it' % subnet_layer)
+
+        self.version += 1
+        subnets = self._own_layer(subnet_type, subnet_layer)
+        if az_index is None:
+            az_index = len(subnets)
+        subnets.append(subnet)
+
+        self._own_indexes()
+        self._az_subnets.setdefault(az_index, []).append((subnet_layer, subnet))
+        return subnet
+
+    def add_list(self, subnet_type, subnet_layer, subnet_list):
+        """
+        Registers subnet_layer of subnet_type as a SubnetLayerList, indexing its subnets by position as the AZ index
+        """
+        self._check_writable()
+        if self.get(subnet_type, {}).get(subnet_layer):
+            raise ValueError('Subnet layer %s already has subnets' % subnet_layer)
+
+        self.version += 1
+        self.add_layer(subnet_type, subnet_layer)
+        self._own_type(subnet_type)[subnet_layer] = subnet_list
+        self._owned.add((subnet_type, subnet_layer))
+
+        self._own_indexes()
+        for (az_index, subnet) in enumerate(subnet_list):
+            self._az_subnets.setdefault(az_index, []).append((subnet_layer, subnet))
+        return subnet_list
+
+    def clone(self):
+        """
+        Returns a copy-on-write copy of this registry
+        """
+        other = SubnetRegistry()
+        dict.update(other, self)
+        other._layer_types = self._layer_types
+        other._az_subnets = self._az_subnets
+
+        # Neither side owns anything after cloning, the first write to a part copies it
+        self._owned = set()
+        return other
+
+    def freeze(self):
+        """
+        Makes this registry read only: adding subnets raises a TypeError, as does modifying its layer dicts and lists
+        @return self
+        """
+        for (subnet_type, layers) in self.items():
+            # List parameter layers are shared as is
+            dict.__setitem__(self, subnet_type, ReadOnlyLayers(
+                (subnet_layer, subnets if isinstance(subnets, SubnetLayerList) else ReadOnlyList(subnets))
+                for (subnet_layer, subnets) in layers.iteritems()))
+
+        self._owned = set()
+        self._frozen = True
+        return self
+
+    def map(self, function):
+        """
+        Returns a new registry with function applied to every subnet, keeping the layer order and the AZ indexes
+        """
+        az_indexes = {(subnet_layer, id(subnet)): az_index
+                      for (az_index, subnets) in self._az_subnets.iteritems()
+                      for (subnet_layer, subnet) in subnets}
+
+        other = SubnetRegistry()
+        for (subnet_type, layers) in self.iteritems():
+            for (subnet_layer, subnets) in layers.iteritems():
+                # The Selects of a list parameter don't need mapping, the list is shared
+                if isinstance(subnets, SubnetLayerList):
+                    other.add_list(subnet_type, subnet_layer, subnets)
+                    continue
+
+                other.add_layer(subnet_type, subnet_layer)
+                for subnet in subnets:
+                    other.add(subnet_type, subnet_layer, function(subnet), az_indexes.get((subnet_layer, id(subnet))))
+        return other
+
+    def get_type(self, subnet_layer):
+        """
+        Return the subnet type (public/private) that subnet_layer belongs to, None if the layer is unknown
+        """
+        return self._layer_types.get(subnet_layer)
+
+    def get_layers(self, subnet_type):
+        """
+        Return the layers of subnet_type in the order they were added
+        """
+        return self.get(subnet_type, {}).keys()
+
+    def get_default_layer(self, *subnet_types):
+        """
+        Return the first layer added for the first of subnet_types that has any, None if none of them do
+        e.g. get_default_layer('private', 'public') prefers a private layer and falls back to a public one
+        """
+        for subnet_type in subnet_types:
+            for subnet_layer in self.get(subnet_type, {}):
+                return subnet_layer
+        return None
+
+    def get_subnets(self, subnet_layer):
+        """
+        Return the subnets of subnet_layer ordered by AZ, an empty list if the layer is unknown
+        """
+        subnet_type = self._layer_types.get(subnet_layer)
+        if subnet_type is None:
+            return []
+        return self[subnet_type][subnet_layer]
+
+    def get_az_subnets(self, az_index, subnet_type=None):
+        """
+        Return OrderedDict(layer -> subnet) of the subnets in the AZ, optionally only those of subnet_type
+        """
+        return OrderedDict((layer, subnet) for (layer, subnet) in self._az_subnets.get(az_index, [])
+                           if subnet_type is None or self._layer_types[layer] == subnet_type)
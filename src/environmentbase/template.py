@@ -6,19 +6,91 @@ import troposphere as t
 import troposphere.constants as tpc
 import troposphere.elasticloadbalancing as elb
 import troposphere.cloudformation as cf
+import base64
+import gzip
 import hashlib
-import json
+import io
 import os
+import re
 import time
 from datetime import datetime
 import resources as res
 import utility
+from profiler import Profiler
+from overlay import OverlayDict
+from subnet_registry import SubnetRegistry, SubnetLayerList
 
 from toolz.dicttoolz import merge
 
 
 DEFAULT_TO_MIN_SIZE = object()
 
+# Room left for the stack resource (and its parameters) each resource shard adds to the sharded template
+SHARD_STACK_BYTES = 4096
+
+# Share of max_template_bytes filled with resources when sharding, the rest is left for the shard's parameters/outputs
+SHARD_FILL_RATIO = 0.8
+
+# Stands for the template's outputs among the referrers of a resource when sharding
+OUTPUT_REFERRER = object()
+
+# (resource type, attribute) of the GetAtt attributes returning a list rather than a string.  Stack parameters and
+# outputs are strings, so these cross a shard boundary comma delimited: as a CommaDelimitedList shard parameter bound to
+# a Join, or as a joined shard output split again where it's referenced
+LIST_ATTRIBUTES = {
+    ('AWS::DirectoryService::MicrosoftAD', 'DnsIpAddresses'),
+    ('AWS::DirectoryService::SimpleAD', 'DnsIpAddresses'),
+    ('AWS::EC2::NetworkInterface', 'SecondaryPrivateIpAddresses'),
+    ('AWS::EC2::Subnet', 'Ipv6CidrBlocks'),
+    ('AWS::EC2::VPC', 'CidrBlockAssociations'),
+    ('AWS::EC2::VPC', 'Ipv6CidrBlocks'),
+    ('AWS::ElasticLoadBalancingV2::LoadBalancer', 'SecurityGroups'),
+    ('AWS::Route53::HostedZone', 'NameServers')
+}
+
+# Compressed user data: MIME boundary of the multipart payload and the file the uncompressed preamble writes the
+# variables holding intrinsic functions (Ref, Join, ...) to, sourced by the compressed script
+USER_DATA_BOUNDARY = '==EnvironmentBaseUserData=='
+USER_DATA_ENV_FILE = '/var/lib/cloud/instance/user-data.env'
+
+
+class SharedParameter(Parameter):
+    """
+    Parameter declaration shared by several templates (see Template.get_common_parameter()), read only once created
+    """
+
+    def __init__(self, title, **kwargs):
+        super(SharedParameter, self).__init__(title, **kwargs)
+        self.__dict__['_read_only'] = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_read_only'):
+            raise AttributeError('%s is shared between templates and read only, add a new Parameter instead' % self.title)
+        super(SharedParameter, self).__setattr__(name, value)
+
+
+class RefViewField(object):
+    """
+    Template field whose Ref view is cached by the matching Template property (e.g. _vpc_id for vpc_id), assigning the
+    field drops the cached view.  The fields are reassigned rather than updated in place, except for the subnets which
+    are added to through the SubnetRegistry, see Template.subnets.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, template, owner):
+        if template is None:
+            return self
+        try:
+            return template.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, template, value):
+        template.__dict__[self.name] = value
+        template.__dict__.setdefault('_ref_views', {}).pop(self.name, None)
+
 
 class Template(t.Template):
     """
@@ -37,6 +109,63 @@ class Template(t.Template):
     # Timeout period after which to fail if a child stack has not reached a COMPLETE state
     stack_timeout = '60'
 
+    # Key child templates by a hash of their content (instead of a timestamp) so unchanged templates keep their S3 URL
+    include_content_hash = False
+
+    # Optional BuildCache, set once by the controller, used to skip rebuilding child templates that haven't changed
+    build_cache = None
+
+    # Profiler recording timing spans for the current controller action, set once by the controller
+    profiler = Profiler(enabled=False)
+
+    # Json format of the template body uploaded to S3 (see utility.TEMPLATE_OUTPUT_FORMATS)
+    output_format = 'pretty'
+
+    # Gzip the local copy of each template, saved as <resource_path>.gz
+    gzip_local_templates = False
+
+    # Move resources into generated nested stacks when a template exceeds the CloudFormation template limits below
+    auto_shard = False
+
+    # Gzip the user data scripts built by construct_user_data() into a multipart payload cloud-init decompresses
+    compress_user_data = False
+
+    # Drop the RegionMap regions/keys a rendered template doesn't look up, optionally keeping only the target regions
+    prune_region_map = False
+    target_regions = None
+
+    # Only re-export the child outputs something can consume, see add_child_outputs_to_parameter_binding()
+    selective_output_propagation = False
+    # Child outputs always re-exported by their parent when selective_output_propagation is on
+    exported_outputs = []
+
+    # Pass each subnet layer to the child templates as a single List<AWS::EC2::Subnet::Id> parameter (see SubnetLayerList)
+    # instead of one parameter per subnet
+    subnet_list_parameters = False
+
+    # Common parameter declarations shared by the child templates, see get_common_parameter()
+    _common_parameters = {}
+
+    # Fields returned as Ref views by the properties below
+    _vpc_cidr = RefViewField('_vpc_cidr')
+    _vpc_id = RefViewField('_vpc_id')
+    _common_security_group = RefViewField('_common_security_group')
+    _utility_bucket = RefViewField('_utility_bucket')
+    _ec2_key = RefViewField('_ec2_key')
+    _subnets = RefViewField('_subnets')
+
+    # CloudFormation template limits
+    max_resources = 200
+    max_parameters = 60
+    max_outputs = 60
+    max_template_bytes = 460800
+
+    def __new__(cls, *args, **kwargs):
+        # Record the constructor arguments, they are part of the build cache fingerprint
+        template = super(Template, cls).__new__(cls)
+        template._init_args = (args, kwargs)
+        return template
+
     def __init__(self, template_name):
         """
         Init method for environmentbase.Template class
@@ -54,7 +183,20 @@ class Template(t.Template):
         self._child_template_references = []
         self.manual_parameter_bindings = {}
 
-        self._subnets = {}
+        self._subnets = SubnetRegistry()
+
+        # Set once a parent processes this template, the root template is never processed as a child
+        self._is_child_template = False
+
+        # Ref views of the fields above returned by the properties below, see _get_ref_view()
+        self._ref_views = {}
+
+        # Paths of the files read while building this template (and the templates merged into it), see BuildCache
+        self._files_read = set()
+
+        # Populated by to_template_dict(), rendering has side effects (child stacks are added) so it only happens once
+        self._template_dict = None
+        self.content_hash = None
 
     def _ref_maybe(self, item):
         """
@@ -69,6 +211,9 @@ class Template(t.Template):
         if isinstance(item, (t.AWSDeclaration, t.AWSObject)):
             return Ref(item)
 
+        elif isinstance(item, SubnetRegistry):
+            return item.map(self._ref_maybe)
+
         elif isinstance(item, list):
             items = []
             for i in item:
@@ -84,36 +229,57 @@ class Template(t.Template):
         else:
             return item
 
+    def _get_ref_view(self, field_name):
+        """
+        Returns _ref_maybe() of the named field, computed once and dropped when the field is assigned (see RefViewField)
+        """
+        try:
+            return self._ref_views[field_name]
+        except KeyError:
+            view = self._ref_views[field_name] = self._ref_maybe(getattr(self, field_name))
+            return view
+
     @property
     def vpc_cidr(self):
-        return self._ref_maybe(self._vpc_cidr)
+        return self._get_ref_view('_vpc_cidr')
 
     @property
     def vpc_id(self):
-        return self._ref_maybe(self._vpc_id)
+        return self._get_ref_view('_vpc_id')
 
     @property
     def common_security_group(self):
-        return self._ref_maybe(self._common_security_group)
+        return self._get_ref_view('_common_security_group')
 
     @property
     def utility_bucket(self):
-        return self._ref_maybe(self._utility_bucket)
+        return self._get_ref_view('_utility_bucket')
 
     @property
     def ec2_key(self):
-        return self._ref_maybe(self._ec2_key)
+        return self._get_ref_view('_ec2_key')
 
     @property
     def subnets(self):
-        return self._ref_maybe(self._subnets)
+        """
+        Read only Ref view of the subnets, shared by every caller until the subnets are reassigned or added to
+        """
+        # The registry is added to in place, its version tells whether the view is still current
+        cached = self._ref_views.get('_subnets')
+        if cached and cached[0] == self._subnets.version:
+            return cached[1]
+
+        view = self._ref_maybe(self._subnets).freeze()
+        self._ref_views['_subnets'] = (self._subnets.version, view)
+        return view
 
-    def __get_template_hash(self):
+    def __get_template_hash(self, template_dict):
         """
         Private method holds process for hashing this template for future validation.
+        @param template_dict [dict] rendered template (see to_dict()) to hash in its canonical compact form
         """
         m = hashlib.sha256()
-        m.update(self.__validation_formatter())
+        m.update(utility.to_compact_json(template_dict))
         return m.hexdigest()
 
     def merge(self, other_template):
@@ -130,32 +296,36 @@ class Template(t.Template):
 
         other_template.build_hook()
 
-        self.metadata.update(other_template.metadata)
-        self.conditions.update(other_template.conditions)
-        self.mappings.update(other_template.mappings)
-        self.outputs.update(other_template.outputs)
-        self.parameters.update(other_template.parameters)
-        self.resources.update(other_template.resources)
+        # Only what the other template added is copied back, unless it replaced one of the overlays outright
+        for attribute in ['metadata', 'conditions', 'mappings', 'outputs', 'parameters', 'resources']:
+            own_values = getattr(self, attribute)
+            other_values = getattr(other_template, attribute)
+            if isinstance(other_values, OverlayDict) and other_values.base is own_values:
+                own_values.update(other_values.get_delta())
+            else:
+                own_values.update(other_values)
 
     def copy_attributes_from(self, other_template):
         """
-        Copies all attributes from the other template into this one
+        Shares all attributes from the other template with this one
         These typically get initialized for a template when add_child_template is called
         from the controller, but that never happens when merging two templates
+        The parameters, mappings, etc. are overlays of the other template's rather than copies, this template sees the
+        other template's entries but anything it adds or removes is only kept in its overlay (see OverlayDict)
         """
         self._vpc_cidr               = other_template._vpc_cidr
         self._vpc_id                 = other_template._vpc_id
         self._common_security_group  = other_template._common_security_group
         self._utility_bucket         = other_template._utility_bucket
 
-        self._subnets    = other_template.subnets.copy()
+        self._subnets    = other_template.subnets.clone()
 
-        self.parameters = other_template.parameters.copy()
-        self.mappings   = other_template.mappings.copy()
-        self.metadata   = other_template.metadata.copy()
-        self.conditions = other_template.conditions.copy()
-        self.outputs    = other_template.outputs.copy()
-        self.resources  = other_template.resources.copy()
+        self.parameters = OverlayDict(other_template.parameters)
+        self.mappings   = OverlayDict(other_template.mappings)
+        self.metadata   = OverlayDict(other_template.metadata)
+        self.conditions = OverlayDict(other_template.conditions)
+        self.outputs    = OverlayDict(other_template.outputs)
+        self.resources  = OverlayDict(other_template.resources)
 
     def build_hook(self):
         """
@@ -203,39 +373,163 @@ class Template(t.Template):
         """
         return {}
 
-    def to_template_json(self):
+    def to_dict(self):
+        """
+        Renders this template into plain python dicts and lists (the same structure troposphere's to_json() encodes).
+        The result shares no references with the troposphere objects, so it can be hashed and dumped repeatedly.
+        """
+        template_dict = {}
+        if self.description:
+            template_dict['Description'] = self.description
+        if self.metadata:
+            template_dict['Metadata'] = self.metadata
+        if self.conditions:
+            template_dict['Conditions'] = self.conditions
+        if self.mappings:
+            template_dict['Mappings'] = self.mappings
+        if self.outputs:
+            template_dict['Outputs'] = self.outputs
+        if self.parameters:
+            template_dict['Parameters'] = self.parameters
+        if self.version:
+            template_dict['AWSTemplateFormatVersion'] = self.version
+        template_dict['Resources'] = self.resources
+
+        return utility.tropo_to_dict(template_dict)
+
+    @staticmethod
+    def _prune_region_map(template_dict):
         """
-        Process all child templates recursively and render this template as json with a timestamp identifying
-        when it was generated along with a SHA256 hash representing the template for validation purposes
+        Removes the RegionMap keys that no FindInMap('RegionMap', ...) in the rendered template looks up, and the
+        regions outside of Template.target_regions (when set).  Regions left without keys are removed, as is the
+        RegionMap itself when nothing uses it.  Lookups of a non-literal key keep every key.
+        @param template_dict [dict] rendered template (see to_dict()), pruned in place
+        """
+        region_map = template_dict.get('Mappings', {}).get('RegionMap')
+        if region_map is None:
+            return
+
+        # Keys and literal regions looked up, None for the keys when any lookup isn't a literal key
+        used_keys = set()
+        used_regions = set()
+        pending = [value for (section, value) in template_dict.iteritems() if section != 'Mappings']
+        while pending:
+            snippet = pending.pop()
+            if isinstance(snippet, list):
+                pending.extend(snippet)
+                continue
+            elif not isinstance(snippet, dict):
+                continue
+
+            for (key, value) in snippet.iteritems():
+                if key == 'Fn::FindInMap' and isinstance(value, list) and len(value) == 3:
+                    (map_name, region, map_key) = value
+                    if not isinstance(map_name, basestring):
+                        # Could be any mapping, leave the RegionMap as is
+                        return
+                    elif map_name == 'RegionMap':
+                        if isinstance(region, basestring):
+                            used_regions.add(region)
+                        if used_keys is not None:
+                            used_keys = used_keys | {map_key} if isinstance(map_key, basestring) else None
+                pending.append(value)
+
+        regions = set(region_map)
+        if Template.target_regions:
+            regions &= set(Template.target_regions) | used_regions
+
+        pruned = {}
+        for region in regions:
+            values = region_map[region]
+            if used_keys is not None:
+                values = {key: value for (key, value) in values.iteritems() if key in used_keys}
+            if values:
+                pruned[region] = values
+
+        if pruned:
+            template_dict['Mappings']['RegionMap'] = pruned
+        else:
+            del template_dict['Mappings']['RegionMap']
+            if not template_dict['Mappings']:
+                del template_dict['Mappings']
+
+    def to_template_dict(self):
         """
-        self.process_child_templates()
+        Process all child templates recursively and render this template as a dict with a timestamp identifying
+        when it was generated along with a SHA256 hash representing the template for validation purposes.
+        The template is rendered exactly once, the generated outputs are added to the rendered dict directly.
+        Subsequent calls return the same dict.
+        """
+        if self._template_dict is not None:
+            return self._template_dict
+
+        # The files read by the merged templates' build_hook() are part of this template's build
+        with res.record_file_reads(self._files_read):
+            self.process_child_templates()
 
         # strip existing values
         for output_key in ['dateGenerated', 'templateValidationHash']:
             if output_key in self.outputs:
                 self.outputs.pop(output_key)
 
+        if Template.auto_shard:
+            with Template.profiler.span('shard_resources', template=self.name):
+                self.shard_resources()
+
+        with Template.profiler.span('render', template=self.name):
+            template_dict = self.to_dict()
+
+            if Template.prune_region_map:
+                self._prune_region_map(template_dict)
+
+            # The content hash excludes the generated outputs, so it only changes when the template itself does
+            if self.include_templateValidationHash_output or Template.include_content_hash:
+                self.content_hash = self.__get_template_hash(template_dict)
+
         # generate the template validation hash
-        if self.include_templateValidationHash_output and 'templateValidationHash' not in self.outputs:
-            self.add_output(Output(
+        if self.include_templateValidationHash_output:
+            self.__add_generated_output(template_dict, Output(
                 'templateValidationHash',
-                Value=self.__get_template_hash(),
+                Value=self.content_hash,
                 Description='Hash of this template that can be used as a simple means of validating whether a template has been changed since it was generated.'))
 
         # set the date that this template was generated
-        if self.include_dateGenerated_output and 'dateGenerated' not in self.outputs:
-            self.add_output(Output(
-                'dateGenerated',
-                Value=str(datetime.utcnow()),
-                Description='UTC datetime representation of when this template was generated'))
+        if self.include_dateGenerated_output:
+            self.__add_generated_output(template_dict, self.get_date_generated_output())
+
+        self._template_dict = template_dict
+
+        # The views are only read while building, don't hold on to them for the rest of the run
+        self._ref_views = {}
+
+        if Template.build_cache:
+            Template.build_cache.store(self)
 
-        return self.to_json()
+        return template_dict
 
-    def __validation_formatter(self):
+    def to_template_json(self):
+        """
+        Process all child templates recursively and render this template as json with a timestamp identifying
+        when it was generated along with a SHA256 hash representing the template for validation purposes
+        """
+        return utility.to_pretty_json(self.to_template_dict())
+
+    @staticmethod
+    def get_date_generated_output():
+        """
+        Output holding the date the template is being generated, see include_dateGenerated_output
+        """
+        return Output(
+            'dateGenerated',
+            Value=str(datetime.utcnow()),
+            Description='UTC datetime representation of when this template was generated')
+
+    def __add_generated_output(self, template_dict, output):
         """
-        Validation formatter helps to ensure consistent formatting for hash validation workflow
+        Adds the output to this template and to the already rendered template_dict, avoiding a second render
         """
-        return json.dumps(json.loads(self.to_json()), separators=(',', ':'))
+        self.add_output(output)
+        template_dict.setdefault('Outputs', {})[output.title] = utility.tropo_to_dict(output)
 
     def add_parameter_idempotent(self, troposphere_parameter):
         """
@@ -287,6 +581,9 @@ class Template(t.Template):
 
         self.add_common_parameters(ec2_key, parent_subnets)
 
+        if Template.subnet_list_parameters:
+            parent.bind_subnet_list_parameters(self)
+
     def _merge_region_map(self, map1, map2):
         for key in set(map1.keys() + map2.keys()):
             yield (key, merge(map1[key], map2[key]))
@@ -300,30 +597,31 @@ class Template(t.Template):
             commonSecurityGroup,
             utilityBucket,
             each subnet: [public|private]Subnet[0-9]
+            or with subnet_list_parameters, each subnet layer: <layer>Subnets
         """
-        self._vpc_cidr = self.add_parameter(Parameter(
+        self._vpc_cidr = self.add_parameter(Template.get_common_parameter(
             'vpcCidr',
             Description='CIDR of the VPC network',
             Type='String',
             AllowedPattern=res.get_str('cidr_regex'),
             ConstraintDescription=res.get_str('cidr_regex_message')))
 
-        self._vpc_id = self.add_parameter(Parameter(
+        self._vpc_id = self.add_parameter(Template.get_common_parameter(
             'vpcId',
             Description='ID of the VPC network',
             Type='String'))
 
-        self._common_security_group = self.add_parameter(Parameter(
+        self._common_security_group = self.add_parameter(Template.get_common_parameter(
             'commonSecurityGroup',
             Description='Security Group ID of the common security group for this environment',
             Type='String'))
 
-        self._utility_bucket = self.add_parameter(Parameter(
+        self._utility_bucket = self.add_parameter(Template.get_common_parameter(
             'utilityBucket',
             Description='Name of the S3 bucket used for infrastructure utility',
             Type='String'))
 
-        self._ec2_key = self.add_parameter(Parameter(
+        self._ec2_key = self.add_parameter(Template.get_common_parameter(
            'ec2Key',
             Type='String',
             Default=ec2_key,
@@ -334,7 +632,7 @@ class Template(t.Template):
             ConstraintDescription=res.get_str('ec2_key_message')
         ))
 
-        self.template_bucket_param = self.add_parameter(Parameter(
+        self.template_bucket_param = self.add_parameter(Template.get_common_parameter(
             Template.template_bucket_param,
             Type='String',
             Default=Template.template_bucket_default,
@@ -345,31 +643,84 @@ class Template(t.Template):
             ConstraintDescription=res.get_str('ascii_only_message')
         ))
 
-        for subnet_type in parent_subnets:
-            if subnet_type not in self._subnets:
-                self._subnets[subnet_type] = {}
+        for (subnet_type, subnet_layers) in parent_subnets.iteritems():
+            for (subnet_layer, subnets) in subnet_layers.iteritems():
+                if Template.subnet_list_parameters:
+                    subnet_list = self.add_parameter(Template.get_common_parameter(
+                        subnet_layer + 'Subnets',
+                        Description='%s subnets' % subnet_layer,
+                        Type='List<AWS::EC2::Subnet::Id>'))
+                    self._subnets.add_list(subnet_type, subnet_layer, SubnetLayerList(subnet_list, len(subnets)))
+                    continue
 
-            for subnet_layer in parent_subnets[subnet_type]:
-                if subnet_layer not in self._subnets[subnet_type]:
-                    self._subnets[subnet_type][subnet_layer] = []
+                self._subnets.add_layer(subnet_type, subnet_layer)
 
-                for subnet in parent_subnets[subnet_type][subnet_layer]:
+                for subnet in subnets:
                     if isinstance(subnet, Parameter):
                         subnet_name = subnet.title
                     else:
                         subnet_name = subnet.data['Ref']
-                    self._subnets[subnet_type][subnet_layer].append(self.add_parameter(Parameter(
+                    self._subnets.add(subnet_type, subnet_layer, self.add_parameter(Template.get_common_parameter(
                         subnet_name,
                         Description=subnet_name,
                         Type='String')))
 
+    def bind_subnet_list_parameters(self, child_template):
+        """
+        Binds each subnet list parameter of the child template (see subnet_list_parameters) to the comma delimited
+        subnets of the same layer in this template, the form CloudFormation takes list parameters of nested stacks in
+        """
+        for subnet_layers in child_template._subnets.itervalues():
+            for (subnet_layer, subnets) in subnet_layers.iteritems():
+                if not isinstance(subnets, SubnetLayerList) or subnets.parameter.title in self.manual_parameter_bindings:
+                    continue
+
+                self.manual_parameter_bindings[subnets.parameter.title] = self._get_subnet_list_value(subnet_layer)
+
+    def _get_subnet_list_value(self, subnet_layer):
+        """
+        Returns the subnets of subnet_layer joined into a comma delimited string
+        """
+        subnets = self._subnets.get_subnets(subnet_layer)
+        if isinstance(subnets, SubnetLayerList):
+            return Join(',', subnets)
+
+        values = []
+        for subnet in self._ref_maybe(subnets):
+            # Subnets are matched by name like the single subnet parameters are, e.g. the root template's subnets
+            # resolve to the outputs of the network template, unmatched ones pass through this template
+            if isinstance(subnet, Ref):
+                subnet_name = subnet.data['Ref']
+                if self._resolve_stack_parameter(subnet_name) is None:
+                    self.add_parameter(Template.get_common_parameter(subnet_name, Description=subnet_name, Type='String'))
+                subnet = self._resolve_stack_parameter(subnet_name)
+            values.append(subnet)
+
+        return Join(',', values)
 
     @staticmethod
-    def construct_user_data(env_vars={}, user_data=''):
+    def get_common_parameter(title, **properties):
+        """
+        Returns the shared, read only SharedParameter declared with title and properties, creating it on first use.
+        Every child template declares the same common parameters, sharing them saves building (and holding) identical
+        Parameter objects for each child.
+        """
+        # Keyed by the canonical json of the properties, their values may be lists (e.g. AllowedValues)
+        key = (title, utility.to_compact_json(properties))
+        parameter = Template._common_parameters.get(key)
+        if parameter is None:
+            parameter = SharedParameter(title, **properties)
+            Template._common_parameters[key] = parameter
+        return parameter
+
+
+    @staticmethod
+    def construct_user_data(env_vars={}, user_data='', compress=None):
         """
         Wrapper method to encapsulate process of constructing userdata for a launch configuration
         @param env_vars [dict] A dictionary containining key value pairs to set as environment variables in the userdata
         @param user_data [string] Contents of the user data script as a string
+        @param compress [bool] Gzip the script (see build_bootstrap()), defaults to Template.compress_user_data
         Returns user_data_payload [string[]] Userdata payload ready to be dropped into a launch configuration
         """
         # At least one of env_vars or user_data must exist
@@ -387,7 +738,8 @@ class Template(t.Template):
 
         return Template.build_bootstrap(
             bootstrap_files=[user_data],
-            variable_declarations=variable_declarations
+            variable_declarations=variable_declarations,
+            compress=Template.compress_user_data if compress is None else compress
         )
 
 
@@ -395,14 +747,20 @@ class Template(t.Template):
     def build_bootstrap(bootstrap_files=None,
                         variable_declarations=None,
                         cleanup_commands=None,
-                        prepend_line='#!/bin/bash'):
+                        prepend_line='#!/bin/bash',
+                        compress=False):
         """
         Method encapsulates process of building out the bootstrap given a set of variables and a bootstrap file to source from
         Returns base 64-wrapped, joined bootstrap to be applied to an instnace
         @param bootstrap_files [ string[] ] list of paths to the bash script(s) to read as the source for the bootstrap action to created
         @param variable_declaration [ list ] list of lines to add to the head of the file - used to inject bash variables into the script
         @param cleanup_commnds [ string[] ] list of lines to add at the end of the file - used for layer-specific details
+        @param compress [bool] Gzip the script into a multipart payload (see build_compressed_bootstrap())
         """
+        if compress:
+            return Template.build_compressed_bootstrap(
+                bootstrap_files, variable_declarations, cleanup_commands, prepend_line)
+
         if prepend_line != '':
             ret_val = [prepend_line]
         else:
@@ -419,6 +777,67 @@ class Template(t.Template):
                 ret_val.append(line)
         return Base64(Join("\n", ret_val))
 
+    @staticmethod
+    def build_compressed_bootstrap(bootstrap_files=None,
+                                   variable_declarations=None,
+                                   cleanup_commands=None,
+                                   prepend_line='#!/bin/bash'):
+        """
+        Same as build_bootstrap() but with the script gzipped, as a MIME multipart payload cloud-init decompresses.
+        The script can't contain intrinsic functions once compressed, so the variable declarations that aren't plain
+        strings (Joins of Refs, etc.) are written to USER_DATA_ENV_FILE by a small uncompressed preamble script which
+        the compressed script sources first.
+        """
+        intrinsic_declarations = [line for line in variable_declarations or [] if not isinstance(line, basestring)]
+
+        script = [prepend_line] if prepend_line != '' else []
+        if intrinsic_declarations:
+            script.append('. ' + USER_DATA_ENV_FILE)
+        script.extend(line for line in variable_declarations or [] if isinstance(line, basestring))
+        for file_name_or_content in bootstrap_files:
+            script.extend(Template.get_file_contents(file_name_or_content))
+        script.extend(cleanup_commands or [])
+
+        if not all(isinstance(line, basestring) for line in script):
+            raise ValueError('Compressed user data only supports intrinsic functions in the variable declarations')
+
+        content = '\n'.join(script)
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        # Fixed mtime and no file name so the same script always compresses to the same bytes
+        buf = io.BytesIO()
+        with gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0) as f:
+            f.write(content)
+        encoded = base64.b64encode(buf.getvalue())
+
+        ret_val = [
+            'Content-Type: multipart/mixed; boundary="%s"' % USER_DATA_BOUNDARY,
+            'MIME-Version: 1.0',
+            '']
+
+        if intrinsic_declarations:
+            ret_val.extend([
+                '--' + USER_DATA_BOUNDARY,
+                'Content-Type: text/x-shellscript; charset="us-ascii"',
+                'MIME-Version: 1.0',
+                '',
+                '#!/bin/bash',
+                "cat > %s <<'EOF'" % USER_DATA_ENV_FILE])
+            ret_val.extend(intrinsic_declarations)
+            ret_val.extend(['EOF', ''])
+
+        ret_val.extend([
+            '--' + USER_DATA_BOUNDARY,
+            'Content-Type: application/x-gzip',
+            'MIME-Version: 1.0',
+            'Content-Transfer-Encoding: base64',
+            ''])
+        ret_val.extend(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+        ret_val.extend(['--' + USER_DATA_BOUNDARY + '--', ''])
+
+        return Base64(Join("\n", ret_val))
+
     @staticmethod
     def get_file_contents(file_name_or_content):
         """
@@ -426,17 +845,22 @@ class Template(t.Template):
         If file is not found the variable is interpreted as the file content itself.
         @param file_name_or_content [string] path to file to read or content itself
         """
-        ret_val = []
-        if not os.path.isfile(file_name_or_content):
-            content = file_name_or_content.split('\n')
-        else:
-            with open(file_name_or_content) as f:
-                content = f.readlines()
+        # Multi-line strings are always content, no need to ask the file system
+        if '\n' not in file_name_or_content and os.path.isfile(file_name_or_content):
+            return list(res.read_file(file_name_or_content, Template._get_bootstrap_file_lines))
 
-        for line in content:
-            if not line.startswith('#~'):
-                ret_val.append(line.replace("\n", ""))
-        return ret_val
+        return [line for line in file_name_or_content.split('\n') if not line.startswith('#~')]
+
+    @staticmethod
+    def _get_bootstrap_file_lines(file_content):
+        """
+        Lines of a bootstrap file without newlines and '#~' comments, as cached by resources.read_file()
+        """
+        lines = file_content.split('\n')
+        # A trailing newline doesn't start another line
+        if lines[-1] == '':
+            lines.pop()
+        return tuple(line for line in lines if not line.startswith('#~'))
 
     def add_ami_mapping(self, json_data):
         """
@@ -548,7 +972,8 @@ class Template(t.Template):
                 launch_config_metadata=None,
                 creation_policy=None,
                 update_policy=None,
-                depends_on=[]):
+                depends_on=[],
+                compress_user_data=None):
         """
         Wrapper method used to create an EC2 Launch Configuration and Auto Scaling group
         @param layer_name [string] friendly name of the set of instances being created - will be set as the name for instances deployed
@@ -557,6 +982,7 @@ class Template(t.Template):
         @param ami_name [string] Name of the AMI to deploy as defined within the RegionMap lookup for the deployed region
         @param ec2_key [Troposphere.Parameter | Troposphere.Ref(Troposphere.Parameter)] Input parameter used to gather the name of the EC2 key to use to secure access to instances launched within this Auto Scaling group
         @param user_data [string[]] Array of strings (lines of bash script) to be set as the user data as a bootstrap script for instances launched within this Auto Scaling group
+            With compress_user_data a plain string (script contents or path) is compressed with construct_user_data()
         @param security_groups [Troposphere.ec2.SecurityGroup[]] array of security groups to be applied to instances within this Auto Scaling group
         @param min_size [int|Parameter] value to set as the minimum number of instances for the Auto Scaling group
         @param max_size [int|Parameter] value to set as the maximum number of instances for the Auto Scaling group
@@ -570,8 +996,14 @@ class Template(t.Template):
         @param load_balancer [Troposphere.elasticloadbalancing.LoadBalancer] Object reference to an ELB to be assigned to this auto scaling group
         @param instance_monitoring [Boolean] indicates that detailed monitoring should be turned on for all instnaces launched within this Auto Scaling group
         @param subnet_layer [string] string indicating which subnet layer instances are being launched into
+        @param compress_user_data [bool] gzip a plain string user_data script, defaults to Template.compress_user_data
         """
 
+        if compress_user_data is None:
+            compress_user_data = Template.compress_user_data
+        if compress_user_data and isinstance(user_data, basestring) and user_data:
+            user_data = self.construct_user_data(user_data=user_data, compress=True)
+
         # Ensure that all the passed in parameters are Ref objects
         if ec2_key and type(ec2_key) != Ref:
             ec2_key = Ref(ec2_key)
@@ -594,10 +1026,7 @@ class Template(t.Template):
 
         # If subnet_layer isn't passed in, try a private subnet if available, else a public subnet
         if not subnet_layer:
-            if len(self._subnets.get('private')) > 0:
-                subnet_layer = self._subnets['private'].keys()[0]
-            else:
-                subnet_layer = self._subnets['public'].keys()[0]
+            subnet_layer = self._subnets.get_default_layer('private', 'public')
 
         subnet_type = self.get_subnet_type(subnet_layer)
 
@@ -784,7 +1213,7 @@ class Template(t.Template):
             # If subnet layer is not passed in, determine based on the scheme
             # -- Pick a public subnet if it's internet-facing, else pick a private one
             subnet_type = 'public' if scheme == 'internet-facing' else 'private'
-            subnet_layer = self._subnets[subnet_type].keys()[0]
+            subnet_layer = self._subnets.get_default_layer(subnet_type)
 
         ## Add optional parameters for LoadBalancer to this dictionary
         optional_elb_kwargs = {}
@@ -925,7 +1354,8 @@ class Template(t.Template):
                              destination_group_name,
                              from_port,
                              to_port=None,
-                             ip_protocol='tcp'):
+                             ip_protocol='tcp',
+                             inline=False):
         """
         Helper method creates reciprocal ingress and egress rules given two existing security groups and a range of ports
         @param source_group [Troposphere.ec2.SecurityGroup] Object reference to the source security group
@@ -935,6 +1365,10 @@ class Template(t.Template):
         @param from_port [string] lower boundary of the port range to set for the secuirty group rules
         @param to_port [string] upper boundary of the port range to set for the security group rules
         @param ip_protocol [string] name of the IP protocol to set this rule for
+        @param inline [boolean] add the ingress rule to the destination group's SecurityGroupIngress instead of creating a
+            SecurityGroupIngress resource (only when destination_group is a SecurityGroup object).  The egress rule is
+            always a separate resource: inline egress rules replace the group's default allow all egress rule, and
+            inlining both rules would make the groups depend on each other.
         """
         if to_port is None:
             to_port = from_port
@@ -950,18 +1384,27 @@ class Template(t.Template):
         # A Ref cannot be created from an object that is already a GetAtt
         # and possibly some other CFN types, so expand this list if you discover another one
         CFN_TYPES = [GetAtt]
+        inline_group = destination_group if inline and isinstance(destination_group, ec2.SecurityGroup) else None
         if type(source_group) not in CFN_TYPES:
             source_group = Ref(source_group)
         if type(destination_group) not in CFN_TYPES:
             destination_group = Ref(destination_group)
 
-        self.add_resource(ec2.SecurityGroupIngress(
-            destination_group_name + 'Ingress' + source_group_name + label_suffix,
-            SourceSecurityGroupId=source_group,
-            GroupId=destination_group,
-            FromPort=from_port,
-            ToPort=to_port,
-            IpProtocol=ip_protocol))
+        if inline_group:
+            ingress_rules = inline_group.properties.setdefault('SecurityGroupIngress', [])
+            ingress_rules.append(ec2.SecurityGroupRule(
+                SourceSecurityGroupId=source_group,
+                FromPort=from_port,
+                ToPort=to_port,
+                IpProtocol=ip_protocol))
+        else:
+            self.add_resource(ec2.SecurityGroupIngress(
+                destination_group_name + 'Ingress' + source_group_name + label_suffix,
+                SourceSecurityGroupId=source_group,
+                GroupId=destination_group,
+                FromPort=from_port,
+                ToPort=to_port,
+                IpProtocol=ip_protocol))
 
         self.add_resource(ec2.SecurityGroupEgress(
             source_group_name + 'Egress' + destination_group_name + label_suffix,
@@ -971,6 +1414,57 @@ class Template(t.Template):
             ToPort=to_port,
             IpProtocol=ip_protocol))
 
+    def create_reciprocal_sgs(self,
+                              source_group,
+                              source_group_name,
+                              destination_group,
+                              destination_group_name,
+                              ports,
+                              ip_protocol='tcp',
+                              inline=False):
+        """
+        Batch version of create_reciprocal_sg(), creates the reciprocal rules for a set of ports with contiguous ports
+        merged into port ranges (see coalesce_ports()), so the same traffic is allowed with fewer rules
+        @param ports [list] ports and/or (from_port, to_port) tuples to open between the two security groups
+        @param inline [boolean] add the ingress rules to the destination group itself (see create_reciprocal_sg())
+        """
+        for (from_port, to_port) in self.coalesce_ports(ports):
+            self.create_reciprocal_sg(
+                source_group, source_group_name,
+                destination_group, destination_group_name,
+                from_port=from_port,
+                to_port=to_port,
+                ip_protocol=ip_protocol,
+                inline=inline)
+
+    @staticmethod
+    def coalesce_ports(ports):
+        """
+        Merges ports and (from_port, to_port) ranges into the fewest ranges covering the same ports
+        Ports that aren't numbers (e.g. a Ref to a port parameter) can't be merged and are kept as single port ranges
+        @param ports [list] ports (int or numeric string) and/or (from_port, to_port) tuples
+        @return [list] (from_port, to_port) tuples sorted by port, single ports keep the value they were given as
+        """
+        ranges = []
+        unmerged = []
+        for port in ports:
+            (from_port, to_port) = port if isinstance(port, tuple) else (port, port)
+            try:
+                ranges.append((int(from_port), int(to_port), from_port, to_port))
+            except (TypeError, ValueError):
+                unmerged.append((from_port, to_port))
+
+        coalesced = []
+        for (low, high, from_port, to_port) in sorted(ranges):
+            if coalesced and low <= coalesced[-1][1] + 1:
+                (previous_low, previous_high, previous_from, previous_to) = coalesced[-1]
+                if high > previous_high:
+                    coalesced[-1] = (previous_low, high, previous_from, to_port)
+            else:
+                coalesced.append((low, high, from_port, to_port))
+
+        return [(from_port, to_port) for (_, _, from_port, to_port) in coalesced] + unmerged
+
     def get_cfn_policy(self):
         """
         Helper method returns the standard IAM policy to allow cloudformation read actions
@@ -1191,6 +1685,9 @@ class Template(t.Template):
         """
         Appends the template to a list of child templates nested under this one
         These will be processed all together at the end of the create process in process_child_templates()
+        @param output_autowire [bool] Bind the child's outputs to the parameters of its sibling templates
+        @param propagate_outputs [bool|list] Re-export the child's outputs as outputs of this template: all of them
+            (see add_child_outputs_to_parameter_binding() for selective_output_propagation), none, or exactly the listed output names
         """
         child_template_entry = (child_template, merge, depends_on, output_autowire, propagate_outputs)
         self._child_templates.append(child_template_entry)
@@ -1215,7 +1712,8 @@ class Template(t.Template):
         Iterate through and process the generated child template list
         """
         for (child_template, merge, depends_on, output_autowire, propagate_outputs) in self._child_templates:
-            self.process_child_template(child_template, merge, depends_on, output_autowire, propagate_outputs)
+            with Template.profiler.span('process_child_template', template=child_template.name):
+                self.process_child_template(child_template, merge, depends_on, output_autowire, propagate_outputs)
 
     def process_child_template(self, child_template, merge, depends_on, output_autowire=True, propagate_outputs=True):
         """
@@ -1227,23 +1725,50 @@ class Template(t.Template):
 
         # This merges all attributes from the two stacks together, so all this parameter binding is unnecessary
         if merge:
-            self.merge(child_template)
+            with Template.profiler.span('merge', template=child_template.name):
+                self.merge(child_template)
             return
 
         # Add parameters from parent stack before executing build_hook
         child_template.add_common_parameters_from_parent(self)
-        child_template.build_hook()
+
+        child_template._is_child_template = True
+
+        # Reuse the previous build of the child (and its whole subtree) if nothing it depends on has changed
+        build_fingerprint = None
+        is_cached_build = False
+        if Template.build_cache:
+            build_fingerprint = Template.build_cache.get_fingerprint(child_template)
+            is_cached_build = Template.build_cache.restore(child_template, build_fingerprint)
+
+        if not is_cached_build:
+            with Template.profiler.span('build_hook', template=child_template.name):
+                with res.record_file_reads(child_template._files_read):
+                    child_template.build_hook()
+
+            if build_fingerprint:
+                Template.build_cache.record_signature(child_template, build_fingerprint)
+
         if output_autowire:
             self.add_child_outputs_to_parameter_binding(child_template, propagate_up=propagate_outputs)
 
         # Match the stack parameters with parent stack parameter values and manual parameter bindings
-        stack_params = self.match_stack_parameters(child_template)
+        with Template.profiler.span('match_stack_parameters', template=child_template.name):
+            stack_params = self.match_stack_parameters(child_template)
+
+        # The content hash is only known once the child (including its own children) has been rendered,
+        # so content addressed templates are rendered bottom-up here rather than by the serializer
+        content_hash = None
+        if Template.include_content_hash:
+            child_template.to_template_dict()
+            content_hash = child_template.content_hash
 
-        # Construct the resource path based on the prefix + name + timestamp
+        # Construct the resource path based on the prefix + name + timestamp or content hash
         child_template.resource_path = utility.get_template_s3_resource_path(
             prefix=Template.s3_path_prefix,
             template_name=child_template.name,
-            include_timestamp=Template.include_timestamp)
+            include_timestamp=Template.include_timestamp,
+            content_hash=content_hash)
 
         # Construct the template url using the bucket name and resource path
         template_s3_url = self.get_template_s3_url(child_template)
@@ -1277,16 +1802,32 @@ class Template(t.Template):
             TimeoutInMinutes=Template.stack_timeout,
             DependsOn=depends_on)
 
-        return self.add_resource(stack_obj)
+        stack = self.add_resource(stack_obj)
+        return stack
 
     def add_child_outputs_to_parameter_binding(self, child_template, propagate_up=False):
         """
         This auto-wires the outputs of the child stack to the manual_param of the parent stack
+        @param propagate_up [bool|list] Re-export the child outputs from this template, see add_child_template()
+
+        A template's outputs are wired into its parent before the template is rendered, and it only re-exports the
+        outputs of its own children while being rendered, so no stack parameter is ever bound to a re-exported output.
+        With selective_output_propagation a child template therefore only re-exports the outputs listed in
+        exported_outputs, while the root template still re-exports all of them: its outputs are the environment's
+        outputs (see EnvironmentBase.write_stack_outputs_to_file()).
         """
         for output in child_template.outputs:
-            self.manual_parameter_bindings[output] = GetAtt(child_template.name, "Outputs." + output)
-            if propagate_up:
-                self.add_output(Output(output, Value=GetAtt(child_template.name, "Outputs." + output)))
+            value = GetAtt(child_template.name, "Outputs." + output)
+            self.manual_parameter_bindings[output] = value
+
+            if isinstance(propagate_up, (list, tuple, set, frozenset)):
+                if output in propagate_up:
+                    self.add_output(Output(output, Value=value))
+            elif not propagate_up:
+                continue
+            elif (not Template.selective_output_propagation or not self._is_child_template or
+                    output in Template.exported_outputs):
+                self.add_output(Output(output, Value=value))
             # TODO: should a custom resource be addeded for each output?
 
     def match_stack_parameters(self, child_template):
@@ -1297,44 +1838,385 @@ class Template(t.Template):
         """
         stack_params = {}
 
-        for parameter in child_template.parameters.keys():
+        for (parameter, child_parameter) in child_template.parameters.iteritems():
+            binding = self._resolve_stack_parameter(parameter)
+
+            # Finally if nothing else matches copy the child templates parameter to this template's parameter list
+            # so the value will pass through this stack down to the child.
+            if binding is None:
+                binding = Ref(self.add_parameter(child_parameter))
+
+            stack_params[parameter] = binding
+
+        return stack_params
 
-            # Manual parameter bindings single-namespace
-            if parameter in self.manual_parameter_bindings:
-                manual_match = self.manual_parameter_bindings[parameter]
-                stack_params[parameter] = manual_match
+    def _resolve_stack_parameter(self, parameter):
+        """
+        Returns what a child stack parameter named parameter is bound to in this template, None if nothing matches
+        """
+        # Manual parameter bindings single-namespace
+        if parameter in self.manual_parameter_bindings:
+            return self.manual_parameter_bindings[parameter]
 
-            # Match any child stack parameters that have the same name as this stacks **parameters**
-            elif parameter in self.parameters.keys():
-                param_match = self.parameters.get(parameter)
-                stack_params[parameter] = Ref(param_match)
+        # Match any child stack parameters that have the same name as this stacks **parameters**
+        elif parameter in self.parameters:
+            return Ref(self.parameters[parameter])
 
-            # Match any child stack parameters that have the same name as this stacks **resources**
-            elif parameter in self.resources.keys():
-                resource_match = self.resources.get(parameter)
-                stack_params[parameter] = Ref(resource_match)
+        # Match any child stack parameters that have the same name as this stacks **resources**
+        elif parameter in self.resources:
+            return Ref(self.resources[parameter])
 
-            # # Match any child stack parameters that have the same name as a top-level **stack_output**
-            # TODO: Enable Output autowiring
-            # elif parameter in self.stack_outputs:
-            #     stack_params[parameter] = GetAtt(self.stack_outputs[parameter], 'Outputs.' + parameter)
+        # # Match any child stack parameters that have the same name as a top-level **stack_output**
+        # TODO: Enable Output autowiring
+        # elif parameter in self.stack_outputs:
+        #     return GetAtt(self.stack_outputs[parameter], 'Outputs.' + parameter)
 
-            # Finally if nothing else matches copy the child templates parameter to this template's parameter list
-            # so the value will pass through this stack down to the child.
+        return None
+
+    def get_template_limit_usage(self, template_dict=None):
+        """
+        Counts what this template uses of each CloudFormation template limit
+        @param template_dict [dict] rendered template (see to_dict()) to measure, rendered when not provided
+        @return [dict] usage keyed by resources, parameters, outputs and bytes (of the uploaded json body)
+        """
+        if template_dict is None:
+            template_dict = self.to_dict()
+
+        # The generated outputs are added after the limits are checked
+        generated_outputs = [self.include_templateValidationHash_output, self.include_dateGenerated_output]
+
+        return {
+            'resources': len(template_dict.get('Resources', {})),
+            'parameters': len(template_dict.get('Parameters', {})),
+            'outputs': len(template_dict.get('Outputs', {})) + len(filter(None, generated_outputs)),
+            'bytes': len(utility.to_template_body(template_dict, Template.output_format))
+        }
+
+    def check_template_limits(self, template_dict=None):
+        """
+        Raises a ValueError when this template exceeds any of the CloudFormation template limits
+        """
+        usage = self.get_template_limit_usage(template_dict)
+        limits = {
+            'resources': Template.max_resources,
+            'parameters': Template.max_parameters,
+            'outputs': Template.max_outputs,
+            'bytes': Template.max_template_bytes
+        }
+
+        exceeded = ['%s %s (limit is %s)' % (usage[key], key, limits[key]) for key in sorted(limits) if usage[key] > limits[key]]
+        if exceeded:
+            raise ValueError('Template %s exceeds the CloudFormation template limits: %s' % (self.name, ', '.join(exceeded)))
+
+    def shard_resources(self):
+        """
+        Moves resources into generated child templates (see ShardTemplate) until this template is within the
+        CloudFormation resource count and body size limits.  Executed by to_template_dict() when auto_shard is enabled,
+        after the child templates have been processed.
+
+        References between the moved resources and the ones left behind are rewired through the usual child template
+        mechanism: a Ref or GetAtt to a resource left in this template becomes a parameter of the shard, bound in
+        manual_parameter_bindings and matched by match_stack_parameters(), while a Ref or GetAtt to a moved resource
+        becomes a GetAtt of the matching shard output.  Child stacks are never moved.
+        Parameter and output counts can't be reduced this way, a ValueError is raised when they exceed the limits.
+        """
+        while True:
+            template_dict = self.to_dict()
+            usage = self.get_template_limit_usage(template_dict)
+
+            # Each shard adds a stack resource (and its parameters) to this template
+            resources_to_move = usage['resources'] + 1 - Template.max_resources
+            bytes_to_move = usage['bytes'] + SHARD_STACK_BYTES - Template.max_template_bytes
+
+            if usage['resources'] <= Template.max_resources and usage['bytes'] <= Template.max_template_bytes:
+                break
+
+            self._add_resource_shard(template_dict, resources_to_move, bytes_to_move)
+
+        self.check_template_limits(template_dict)
+
+    def _add_resource_shard(self, template_dict, resources_to_move, bytes_to_move):
+        """
+        Moves at least resources_to_move resources and bytes_to_move bytes (as far as one shard can hold them) from the
+        rendered template_dict into a new ShardTemplate and adds it as a child template
+        """
+        resources = template_dict['Resources']
+        parameters = template_dict.get('Parameters', {})
+        conditions = template_dict.get('Conditions', {})
+
+        # What every resource, output and condition references, and who references each resource
+        references = {title: self._find_references(resource) for (title, resource) in resources.iteritems()}
+        condition_references = {title: self._find_references(condition) for (title, condition) in conditions.iteritems()}
+        referrers = {}
+        referencing = references.items() + [(OUTPUT_REFERRER, self._find_references(template_dict.get('Outputs', {})))]
+        for (referrer, referenced) in referencing:
+            for (kind, target, attribute) in referenced:
+                if kind in ('Ref', 'GetAtt') and target in resources:
+                    referrers.setdefault(target, set()).add((referrer, kind, attribute))
+
+        # Fill the shard with the resources that fit, in name order so related resources tend to stay together
+        shard_titles = set()
+        shard_bytes = 0
+        candidates = sorted(title for (title, resource) in resources.iteritems() if resource.get('Type') != cf.Stack.resource_type)
+        for title in candidates:
+            if len(shard_titles) >= resources_to_move and shard_bytes >= bytes_to_move:
+                break
+
+            resource_bytes = len(utility.to_template_body({title: resources[title]}, Template.output_format))
+            if len(shard_titles) + 1 > Template.max_resources or \
+                    shard_bytes + resource_bytes > Template.max_template_bytes * SHARD_FILL_RATIO:
+                break
+
+            (shard_parameters, shard_outputs, _, _) = self._get_shard_interface(
+                shard_titles | {title}, references, condition_references, referrers, parameters)
+            if len(shard_parameters) > Template.max_parameters or len(shard_outputs) > Template.max_outputs:
+                continue
+
+            shard_titles.add(title)
+            shard_bytes += resource_bytes
+
+        if not shard_titles:
+            raise ValueError('Template %s exceeds the CloudFormation template limits and no resource can be moved '
+                             'into a nested stack' % self.name)
+
+        (shard_parameters, shard_outputs, shard_conditions, shard_mappings) = self._get_shard_interface(
+            shard_titles, references, condition_references, referrers, parameters)
+
+        shard_name = self._get_shard_name()
+        shard = ShardTemplate(shard_name)
+
+        # A GetAtt of a resource left behind becomes a Ref to the shard parameter standing in for it
+        parameter_references = {}
+        for title in shard_titles:
+            for (kind, target, attribute) in references[title]:
+                if kind == 'GetAtt' and target in resources and target not in shard_titles:
+                    parameter_references[(kind, target, attribute)] = {
+                        'Ref': self._get_shard_reference_name(target, attribute)}
+
+        # Shard resources, depending on a resource left behind becomes a dependency of the shard's stack
+        depends_on = set()
+        for title in shard_titles:
+            resource = self._replace_references(resources[title], parameter_references)
+            if 'DependsOn' in resource:
+                resource_depends_on = self._get_depends_on(resource)
+                depends_on.update(set(resource_depends_on) - shard_titles)
+                resource['DependsOn'] = [dependency for dependency in resource_depends_on if dependency in shard_titles]
+                if not resource['DependsOn']:
+                    resource.pop('DependsOn')
+            shard.resources[title] = resource
+
+        # Shard parameters, this template's own parameters are matched by name, anything else is bound explicitly
+        for (parameter_name, binding) in shard_parameters.iteritems():
+            if binding is None:
+                shard.parameters[parameter_name] = utility.restore_declaration(
+                    Parameter, parameter_name, parameters[parameter_name])
+            elif self._is_list_attribute(resources, binding):
+                shard.parameters[parameter_name] = Parameter(parameter_name, Type='CommaDelimitedList')
+                self.manual_parameter_bindings[parameter_name] = Join(',', binding)
             else:
-                new_param = self.add_parameter(child_template.parameters[parameter])
-                stack_params[parameter] = Ref(new_param)
+                shard.parameters[parameter_name] = Parameter(parameter_name, Type='String')
+                self.manual_parameter_bindings[parameter_name] = binding
 
-        return stack_params
+        for condition_name in shard_conditions:
+            shard.conditions[condition_name] = conditions[condition_name]
+
+        for mapping_name in shard_mappings & set(template_dict.get('Mappings', {})):
+            shard.mappings[mapping_name] = template_dict['Mappings'][mapping_name]
+
+        # Shard outputs for everything left behind that references a moved resource
+        moved_references = {}
+        for ((kind, target, attribute), output_name) in shard_outputs.iteritems():
+            if kind == 'Ref':
+                output = Output(output_name, Value=Ref(target))
+            else:
+                output = Output(output_name, Value=GetAtt(target, attribute))
+
+            moved_reference = {'Fn::GetAtt': [shard_name, 'Outputs.' + output_name]}
+            if kind == 'GetAtt' and self._is_list_attribute(resources, GetAtt(target, attribute)):
+                output.Value = Join(',', GetAtt(target, attribute))
+                moved_reference = {'Fn::Split': [',', moved_reference]}
+
+            if 'Condition' in resources[target]:
+                output.properties['Condition'] = resources[target]['Condition']
+
+            shard.outputs[output_name] = output
+            moved_references[(kind, target, attribute)] = moved_reference
+
+        # Rewire what's left behind to the shard
+        for title in shard_titles:
+            self.resources.pop(title)
+
+        for (title, resource) in resources.iteritems():
+            if title in shard_titles:
+                continue
+
+            rewired = self._replace_references(resource, moved_references)
+            if 'DependsOn' in rewired:
+                resource_depends_on = self._get_depends_on(rewired)
+                rewired['DependsOn'] = sorted(set(shard_name if dependency in shard_titles else dependency
+                                                  for dependency in resource_depends_on))
+
+            if rewired != resource:
+                self.resources[title] = rewired
+
+        for (title, output) in template_dict.get('Outputs', {}).iteritems():
+            rewired = self._replace_references(output, moved_references)
+            if rewired != output:
+                self.outputs[title] = utility.restore_declaration(Output, title, rewired)
+
+        self.add_child_template(shard, depends_on=sorted(depends_on), output_autowire=False, propagate_outputs=False)
+        self.process_child_template(shard, False, sorted(depends_on), output_autowire=False, propagate_outputs=False)
+
+    def _get_shard_interface(self, shard_titles, references, condition_references, referrers, parameters):
+        """
+        Works out what a shard holding shard_titles needs from, and provides to, this template
+        @return [tuple] (
+            parameters {name: None for this template's own parameters, else the Ref/GetAtt to bind the parameter to},
+            outputs {(kind, target resource, attribute): output name},
+            condition names,
+            mapping names
+        )
+        """
+        shard_parameters = {}
+        shard_outputs = {}
+        shard_conditions = set()
+        shard_mappings = set()
+
+        pending = [reference for title in shard_titles for reference in references[title]]
+        while pending:
+            (kind, target, attribute) = pending.pop()
+
+            if kind == 'Condition':
+                if target not in shard_conditions:
+                    shard_conditions.add(target)
+                    pending.extend(condition_references.get(target, []))
+
+            elif kind == 'Mapping':
+                shard_mappings.add(target)
+
+            elif target in shard_titles or target.startswith('AWS::'):
+                continue
+
+            elif kind == 'Ref' and target in parameters:
+                shard_parameters[target] = None
+
+            elif kind == 'Ref' and target in references:
+                shard_parameters[target] = Ref(target)
+
+            elif kind == 'GetAtt' and target in references:
+                shard_parameters[self._get_shard_reference_name(target, attribute)] = GetAtt(target, attribute)
+
+        for title in shard_titles:
+            for (referrer, kind, attribute) in referrers.get(title, []):
+                if referrer not in shard_titles:
+                    output_name = title if kind == 'Ref' else self._get_shard_reference_name(title, attribute)
+                    shard_outputs[(kind, title, attribute)] = output_name
+
+        return (shard_parameters, shard_outputs, shard_conditions, shard_mappings)
+
+    def _get_shard_name(self):
+        shard_index = 1
+        while True:
+            shard_name = self._get_shard_reference_name(self.name, 'Shard%d' % shard_index)
+            if shard_name not in self.resources:
+                return shard_name
+            shard_index += 1
+
+    @staticmethod
+    def _is_list_attribute(resources, binding):
+        """
+        Whether binding is a GetAtt of a list valued attribute (see LIST_ATTRIBUTES) of one of the rendered resources
+        """
+        if not isinstance(binding, GetAtt):
+            return False
+        (target, attribute) = binding.data['Fn::GetAtt']
+        return (resources.get(target, {}).get('Type'), attribute) in LIST_ATTRIBUTES
+
+    @staticmethod
+    def _get_shard_reference_name(title, attribute):
+        """
+        Logical name (alphanumeric only) of the shard parameter/output standing in for a GetAtt
+        """
+        return re.sub('[^A-Za-z0-9]', '', title + attribute)
+
+    @staticmethod
+    def _get_depends_on(resource):
+        depends_on = resource['DependsOn']
+        return [depends_on] if isinstance(depends_on, basestring) else depends_on
+
+    @staticmethod
+    def _find_references(snippet):
+        """
+        Collects the references in a rendered snippet
+        @return [set] of (kind, target, attribute) tuples, kind being one of Ref, GetAtt, Condition or Mapping
+        """
+        found = set()
+        pending = [snippet]
+        while pending:
+            snippet = pending.pop()
+            if isinstance(snippet, list):
+                pending.extend(snippet)
+                continue
+            elif not isinstance(snippet, dict):
+                continue
+
+            for (key, value) in snippet.iteritems():
+                if key == 'Ref' and isinstance(value, basestring):
+                    found.add(('Ref', value, None))
+                elif key == 'Fn::GetAtt' and isinstance(value, list) and isinstance(value[0], basestring):
+                    found.add(('GetAtt', value[0], value[1]))
+                elif key == 'Fn::FindInMap' and isinstance(value, list) and isinstance(value[0], basestring):
+                    found.add(('Mapping', value[0], None))
+                elif key == 'Fn::If' and isinstance(value, list):
+                    found.add(('Condition', value[0], None))
+                elif key == 'Condition' and isinstance(value, basestring):
+                    found.add(('Condition', value, None))
+                pending.append(value)
+
+        return found
+
+    @staticmethod
+    def _replace_references(snippet, replacements):
+        """
+        Copy of a rendered snippet with every Ref/GetAtt found in replacements (keyed like _find_references()) replaced
+        """
+        if isinstance(snippet, list):
+            return [Template._replace_references(item, replacements) for item in snippet]
+        elif not isinstance(snippet, dict):
+            return snippet
+
+        if len(snippet) == 1:
+            (key, value) = snippet.items()[0]
+            if key == 'Ref' and ('Ref', value, None) in replacements:
+                return replacements[('Ref', value, None)]
+            elif key == 'Fn::GetAtt' and isinstance(value, list) and ('GetAtt', value[0], value[1]) in replacements:
+                return replacements[('GetAtt', value[0], value[1])]
+
+        return {key: Template._replace_references(value, replacements) for (key, value) in snippet.iteritems()}
 
 
     def get_subnet_type(self, subnet_layer):
         """
         Return the subnet type (public/private) that subnet_layer belongs to
         """
-        for subnet_type in self._subnets:
-            for a_subnet_layer in self._subnets[subnet_type]:
-                if a_subnet_layer == subnet_layer:
-                    return subnet_type
-        return None
+        return self._subnets.get_type(subnet_layer)
 
+
+
+class ShardTemplate(Template):
+    """
+    Child template generated by Template.shard_resources() to hold resources moved out of a template that exceeds the
+    CloudFormation template limits.  It is created with its resources, parameters and outputs already in place.
+    """
+
+    def add_common_parameters_from_parent(self, parent):
+        """
+        Shards only take the parameters their resources reference, which were copied from the parent on creation
+        """
+        pass
+
+    def shard_resources(self):
+        """
+        Shards are filled to fit within the limits, they are checked rather than sharded further
+        """
+        self.check_template_limits()
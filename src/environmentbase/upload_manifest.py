@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_FILENAME = '.upload_manifest.json'
+
+
+class UploadManifest(object):
+    """
+    Local record of the templates uploaded to S3, used to skip uploading a template whose content has not changed
+    since the last upload to the same bucket and key.  Stored as json at <directory>/.upload_manifest.json
+    with entries of the form:
+    {
+        "<bucket>/<key>": {
+            "bucket": <bucket>,
+            "key": <key>,
+            "content_hash": <sha256 of the uploaded body>,
+            "acl": <canned acl used for the upload>,
+            "etag": <ETag returned by S3>
+        }
+    }
+    Uploads may be recorded from several threads at once.  Entries for keys not written by the current run (e.g. the
+timestamped keys of previous runs) are dropped when the manifest is saved, so the manifest doesn't grow without bound.
+    """
+
+    def __init__(self, directory, verify_remote=False):
+        """
+        :param directory: Directory to keep the manifest file in (the local template directory)
+        :param verify_remote: When enabled a HEAD request confirms the object is still present on S3 before skipping
+        """
+        self.file_path = os.path.join(directory, MANIFEST_FILENAME)
+        self.verify_remote = verify_remote
+        self.entries = {}
+        # Entry keys uploaded, or found already uploaded, during this run
+        self._written_keys = set()
+        self._lock = threading.Lock()
+
+        if os.path.isfile(self.file_path):
+            with open(self.file_path, 'r') as f:
+                try:
+                    self.entries = json.load(f)
+                except ValueError:
+                    # A damaged manifest only costs a full re-upload
+                    print '%s could not be parsed, uploading all templates' % self.file_path
+
+    @staticmethod
+    def get_content_hash(body):
+        return hashlib.sha256(body).hexdigest()
+
+    @staticmethod
+    def _entry_key(bucket, key):
+        return '%s/%s' % (bucket, key)
+
+    def is_uploaded(self, s3_client, bucket, key, content_hash, acl):
+        """
+        Checks whether the exact content was already uploaded to bucket/key with the same ACL
+        :param s3_client: boto3 S3 client, only used when verify_remote is enabled
+        :return bool: True if the upload can be skipped
+        """
+        with self._lock:
+            entry = self.entries.get(self._entry_key(bucket, key))
+
+        if not entry or entry.get('content_hash') != content_hash or entry.get('acl') != acl:
+            return False
+
+        if self.verify_remote:
+            import botocore.exceptions
+
+            try:
+                remote_object = s3_client.head_object(Bucket=bucket, Key=key)
+            except botocore.exceptions.ClientError:
+                return False
+
+            if remote_object.get('ETag') != entry.get('etag'):
+                return False
+
+        with self._lock:
+            self._written_keys.add(self._entry_key(bucket, key))
+        return True
+
+    def record_upload(self, bucket, key, content_hash, acl, etag):
+        with self._lock:
+            self._written_keys.add(self._entry_key(bucket, key))
+            self.entries[self._entry_key(bucket, key)] = {
+                'bucket': bucket,
+                'key': key,
+                'content_hash': content_hash,
+                'acl': acl,
+                'etag': etag
+            }
+
+    def save(self, prune=True):
+        """
+        :param prune: Drop the entries of the keys not written during this run, keep them when the run didn't complete
+        """
+        with self._lock:
+            if prune:
+                self.entries = {entry_key: entry for (entry_key, entry) in self.entries.iteritems()
+                                if entry_key in self._written_keys}
+            with open(self.file_path, 'w') as f:
+                f.write(json.dumps(self.entries, indent=4, sort_keys=True, separators=(',', ': ')))
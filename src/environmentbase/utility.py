@@ -1,6 +1,5 @@
 import random
 import string
-import boto3
 import json
 import time
 import troposphere as t
@@ -8,6 +7,12 @@ import tempfile
 import os
 import resources as res
 
+# Number of hex digits of the template content hash used in content addressed S3 keys
+CONTENT_HASH_LENGTH = 16
+
+# Supported values of the template.output_format setting, see to_template_body()
+TEMPLATE_OUTPUT_FORMATS = ('pretty', 'compact')
+
 
 def random_string(size=5):
     return ''.join(random.choice(string.ascii_lowercase + string.ascii_uppercase + string.digits) for _ in range(size))
@@ -15,6 +20,8 @@ def random_string(size=5):
 
 def _get_boto_session(boto_config):
     if not boto_config.get('session'):
+        # boto3 is slow to import, it's only loaded by the actions talking to AWS
+        import boto3
         boto_config['session'] = boto3.session.Session(region_name=boto_config.get('region_name'))
     return boto_config['session']
 
@@ -49,6 +56,60 @@ def tropo_to_string(snippet, indent=4, sort_keys=True, separators=(',', ': ')):
     return json.dumps(snippet, cls=t.awsencode, indent=indent, sort_keys=sort_keys, separators=separators)
 
 
+def tropo_to_dict(snippet):
+    """
+    Returns a plain python (dict/list/scalar) copy of any troposphere object, resolving each object's
+    JSONrepr() the same way troposphere.awsencode does during json serialization
+    """
+    if hasattr(snippet, 'JSONrepr'):
+        return tropo_to_dict(snippet.JSONrepr())
+    elif isinstance(snippet, dict):
+        return {key: tropo_to_dict(value) for (key, value) in snippet.iteritems()}
+    elif isinstance(snippet, (list, tuple)):
+        return [tropo_to_dict(item) for item in snippet]
+    else:
+        return snippet
+
+
+def restore_declaration(declaration_class, title, rendered):
+    """
+    Recreates a Parameter or Output from its rendered form, bypassing troposphere's type checks since the values
+    may contain rendered intrinsic functions
+    """
+    declaration = declaration_class(title)
+    declaration.properties.update(rendered)
+    return declaration
+
+
+def to_compact_json(template_dict):
+    """
+    Canonical compact json form (sorted keys, no whitespace) of an already rendered template dict.
+    This is the form used to compute the template validation hash.
+    """
+    return json.dumps(template_dict, sort_keys=True, separators=(',', ':'))
+
+
+def to_pretty_json(template_dict, separators=(',', ': ')):
+    """
+    Canonical human readable json form (sorted keys, 4 space indent) of an already rendered template dict
+    """
+    return json.dumps(template_dict, indent=4, sort_keys=True, separators=separators)
+
+
+def to_template_body(template_dict, output_format='pretty'):
+    """
+    Json body of an already rendered template dict in one of the TEMPLATE_OUTPUT_FORMATS:
+    pretty (see to_pretty_json()) or compact (see to_compact_json(), typically less than half the size)
+    """
+    if output_format == 'pretty':
+        return to_pretty_json(template_dict)
+    elif output_format == 'compact':
+        return to_compact_json(template_dict)
+    else:
+        raise ValueError('Unknown template output format "%s", expected one of: %s' % (
+            output_format, ', '.join(TEMPLATE_OUTPUT_FORMATS)))
+
+
 def get_template_from_s3(config, template_resource_path):
     """
     Given an s3 resource path, download the template and return the json dictionary
@@ -97,15 +158,18 @@ def get_stack_depends_on_from_parent_template(parent_template_contents, stack_na
     # Otherwise return the DependsOn list that the stack was deployed with
     return stack_reference.get('DependsOn')
 
-def get_template_s3_resource_path(prefix, template_name, include_timestamp=True):
+def get_template_s3_resource_path(prefix, template_name, include_timestamp=True, content_hash=None):
     """
     Constructs s3 resource path for provided template name
     :param prefix: S3 base path (marts after url port and hostname)
     :param template_name: File name minus '.template' suffix and any timestamp portion
     :param include_timestamp: Indicates whether to include the current time in the file name
+    :param content_hash: Hash of the template content to include in the file name, takes precedence over the timestamp
     :return string: Url of S3 file
     """
-    if include_timestamp:
+    if content_hash:
+        template_name += "." + content_hash[:CONTENT_HASH_LENGTH]
+    elif include_timestamp:
         key_serial = str(int(time.time()))
         template_name += "." + key_serial
 
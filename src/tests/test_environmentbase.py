@@ -3,15 +3,32 @@ import mock
 from mock import patch
 import os
 import shutil
+import subprocess
 import yaml
 import json
 import sys
 import copy
+import gzip
+import io
 from tempfile import mkdtemp
-from environmentbase import cli, resources as res, environmentbase as eb
+from environmentbase import build_cache, cli, config_cache, config_validator, resources as res, environmentbase as eb, upload_manifest
 from environmentbase import networkbase
 import environmentbase.patterns.ha_nat
-from troposphere import ec2
+from troposphere import ec2, Base64, Join, Output, Parameter, Ref, GetAtt
+
+
+class Child(eb.Template):
+    """ Child template holding a single instance, shared by the create_action() tests """
+    instance_type = 'm3.medium'
+
+    def build_hook(self):
+        self.add_resource(ec2.Instance("ec2instance", InstanceType=self.instance_type, ImageId="ami-951945d0"))
+
+
+class MyEnvBase(eb.EnvironmentBase):
+    """ Controller adding a single Child template """
+    def create_hook(self):
+        self.add_child_template(Child('Child'))
 
 
 class EnvironmentBaseTestCase(TestCase):
@@ -42,7 +59,7 @@ class EnvironmentBaseTestCase(TestCase):
         dummy_int = 3
         dummy_list = ['A', 'B', 'C']
 
-        config_requirements = copy.deepcopy(res.CONFIG_REQUIREMENTS)
+        config_requirements = copy.deepcopy(res.get_config_requirements())
 
         if env_base:
             for handler in env_base.config_handlers:
@@ -117,7 +134,7 @@ class EnvironmentBaseTestCase(TestCase):
     def test_config_yaml(self):
         """ Make sure load_config can load yaml files."""
         with open("config.yaml", 'w') as f:
-            f.write(yaml.dump(res.FACTORY_DEFAULT_CONFIG, default_flow_style=False))
+            f.write(yaml.dump(res.get_factory_default_config(), default_flow_style=False))
             f.flush()
 
         fake_cli = self.fake_cli(['create', '--config-file', 'config.yaml'])
@@ -212,7 +229,7 @@ class EnvironmentBaseTestCase(TestCase):
 
         # Check wildcard sections
         extra_reqs = {'*-db': {'host': 'str', 'port': 'int'}}
-        extra_reqs.update(res.CONFIG_REQUIREMENTS)
+        extra_reqs.update(res.get_config_requirements())
 
         valid_config.update({
             'my-db': {'host': 'localhost', 'port': 3306},
@@ -226,7 +243,7 @@ class EnvironmentBaseTestCase(TestCase):
                     'deeper': {
                         'key': 'str'
                     }}}}
-        extra_reqs.update(res.CONFIG_REQUIREMENTS)
+        extra_reqs.update(res.get_config_requirements())
 
         valid_config.update({
             'lets': {
@@ -235,6 +252,134 @@ class EnvironmentBaseTestCase(TestCase):
                         'key': 'super_secret_value'
                     }}}})
 
+    def test_config_validator(self):
+        validator = config_validator.ConfigValidator({
+            'global': {'name': 'str', 'debug': 'bool'},
+            '*-db': {'host': 'str', 'port': 'int', 'tags': []},
+            'cache-[!x]': 'str'
+        })
+
+        config = {
+            'global': {'name': 'env', 'debug': False},
+            'my-db': {'host': 'localhost', 'port': 3306, 'tags': []},
+            'other-db': {'host': 'localhost', 'port': 3306, 'tags': []},
+            'cache-a': 'redis'
+        }
+        self.assertEqual(validator.validate(config), [])
+
+        # Every violation is reported, in a single pass
+        config['global'] = {'debug': 'yes'}
+        config['other-db'].update(port='3306', tags='tag')
+        config['bad-db'] = 'host'
+        del config['cache-a']
+        config['cache-x'] = 'redis'
+        self.assertEqual(validator.validate(config), [
+            'Type mismatch in config, global.debug should be of type bool, not str',
+            'Config file missing section global.name',
+            'Type mismatch in config, bad-db should be a dict, not str',
+            'Type mismatch in config, other-db.port should be of type int, not str',
+            'Type mismatch in config, other-db.tags should be a list, not str',
+            'Config file missing section cache-[!x]'])
+
+        with self.assertRaises(ValueError):
+            config_validator.ConfigValidator({'global': {'name': 'string'}})
+
+        # The controller compiles the schema once and raises all the violations together
+        cntrl = eb.EnvironmentBase(self.fake_cli(['create']))
+        with patch.object(eb, 'ConfigValidator', wraps=config_validator.ConfigValidator) as compile_mock:
+            for _ in range(2):
+                with self.assertRaises(eb.ValidationError) as context:
+                    cntrl._validate_config({'global': {}})
+            self.assertEqual(compile_mock.call_count, 1)
+        self.assertIn('global.environment_name', context.exception.message)
+        self.assertIn('Config file missing section template', context.exception.message)
+
+    def test_config_env_override(self):
+        schema = {
+            'global': {'debug': 'bool', 'count': 'int'},
+            '*-db': {'port': 'int', 'ratio': 'float', 'tags': [], 'password': 'str'}
+        }
+        config = {
+            'global': {'debug': False, 'count': 1, 'ec2_key': 'key'},
+            'my-db': {'port': 3306, 'ratio': 0.5, 'tags': [], 'password': 'changeme'},
+            'other': {'nested': {'deep_key': 'value'}}
+        }
+        environ = {
+            'GLOBAL_DEBUG': 'true',
+            'GLOBAL_COUNT': '3',
+            'GLOBAL_EC2_KEY': 'other-key',
+            'MY-DB_PORT': '5432',
+            'MY-DB_RATIO': '0.75',
+            'MY-DB_TAGS': 'a, b',
+            'MY-DB_PASSWORD': 'false',
+            'OTHER_NESTED_DEEP_KEY': 'new',
+            'OTHER_NESTED': 'not a leaf',
+            'UNRELATED': 'value'
+        }
+
+        with patch.dict(os.environ, environ):
+            eb.EnvironmentBase._config_env_override(config, '', schema=schema)
+
+        self.assertEqual(config, {
+            'global': {'debug': True, 'count': 3, 'ec2_key': 'other-key'},
+            'my-db': {'port': 5432, 'ratio': 0.75, 'tags': ['a', 'b'], 'password': 'false'},
+            'other': {'nested': {'deep_key': 'new'}}
+        })
+
+        # Values that can't be converted are left for the validation to report, json lists are parsed
+        with patch.dict(os.environ, {'MY-DB_PORT': 'default', 'MY-DB_TAGS': '["c"]'}):
+            eb.EnvironmentBase._config_env_override(config['my-db'], 'my-db', schema=schema['*-db'])
+        self.assertEqual(config['my-db']['port'], 'default')
+        self.assertEqual(config['my-db']['tags'], ['c'])
+
+    def test_config_cache(self):
+        config = copy.deepcopy(res.get_factory_default_config())
+        config['global']['config_cache'] = True
+        config_filename = res.DEFAULT_CONFIG_FILENAME + res.EXTENSIONS[0]
+        with open(config_filename, 'w') as f:
+            f.write(json.dumps(config))
+
+        def load_config(extra_args=None):
+            base = eb.EnvironmentBase(self.fake_cli(['create'] + (extra_args or [])))
+            with patch.object(res, 'load_file', wraps=res.load_file) as load_mock:
+                base.load_config()
+            return (base.config, load_mock.call_count)
+
+        # The first load parses and stores the config, 'deploy' reuses it
+        (first_config, parse_count) = load_config()
+        self.assertEqual(parse_count, 1)
+        self.assertTrue(os.path.isfile(config_cache.CONFIG_CACHE_FILENAME))
+        self.assertEqual(load_config()[0], first_config)
+        self.assertEqual(load_config()[1], 0)
+
+        # Any change to the config file, the config CLI arguments or the environment overrides is a miss
+        self.assertEqual(load_config(['--template-file', 'other'])[1], 1)
+        with patch.dict(os.environ, {'GLOBAL_ENVIRONMENT_NAME': 'from_env'}):
+            (env_config, parse_count) = load_config()
+        self.assertEqual(parse_count, 1)
+        self.assertEqual(env_config['global']['environment_name'], 'from_env')
+        self.assertEqual(load_config()[1], 1)
+
+        config['global']['environment_name'] = 'changed'
+        with open(config_filename, 'w') as f:
+            f.write(json.dumps(config))
+        (changed_config, parse_count) = load_config()
+        self.assertEqual(parse_count, 1)
+        self.assertEqual(changed_config['global']['environment_name'], 'changed')
+
+        # Values from the environment (e.g. passwords) are applied again on a hit rather than stored
+        with patch.dict(os.environ, {'GLOBAL_ENVIRONMENT_NAME': 'from_env_only'}):
+            self.assertEqual(load_config()[1], 1)
+            (env_config, parse_count) = load_config()
+        self.assertEqual(parse_count, 0)
+        self.assertEqual(env_config['global']['environment_name'], 'from_env_only')
+        with open(config_cache.CONFIG_CACHE_FILENAME) as f:
+            self.assertNotIn('from_env_only', f.read())
+
+        # Configs that change through the json round trip aren't cached
+        self.assertFalse(config_cache.ConfigCache(config_filename, [], {}).store({'section': {1: 'value'}}))
+        self.assertTrue(config_cache.ConfigCache(config_filename, [], {}).store({'section': {'1': 'value'}}))
+
     def test_extending_config(self):
 
         # Typically this would subclass eb.Template
@@ -285,9 +430,9 @@ class EnvironmentBaseTestCase(TestCase):
         base.init_action()
         base.load_config()
         self.assertEqual(base.config['global']['print_debug'],
-                         res.FACTORY_DEFAULT_CONFIG['global']['print_debug'])
+                         res.get_factory_default_config()['global']['print_debug'])
         self.assertEqual(base.config['global']['environment_name'],
-                         res.FACTORY_DEFAULT_CONFIG['global']['environment_name'])
+                         res.get_factory_default_config()['global']['environment_name'])
 
     def test_template_file_flag(self):
         # verify that the --template-file flag changes the config value
@@ -326,6 +471,362 @@ class EnvironmentBaseTestCase(TestCase):
         # Verify that the previously created files are loaded up correctly
         eb.EnvironmentBase(self.fake_cli(['create']))
 
+    def _create_templates(self, controller_class, s3_resource=None, cli_args=None, **template_config):
+        """
+        Runs create_action() for controller_class against the factory default config with S3 mocked out
+        :param cli_args: extra command line arguments
+        :param template_config: overrides for the 'template' config section
+        :return: (controller, mocked s3 resource)
+        """
+        config = copy.deepcopy(res.get_factory_default_config())
+        config['template']['ami_map_file'] = None
+        config['template']['include_dateGenerated_output'] = False
+        config['template'].update(template_config)
+
+        if not s3_resource:
+            s3_resource = mock.MagicMock()
+            s3_resource.meta.client.put_object.return_value = {'ETag': '"etag"'}
+
+        with patch.object(eb.utility, 'get_boto_resource', return_value=s3_resource):
+            controller = controller_class(self.fake_cli(['create'] + (cli_args or [])), config_file_override=config)
+            controller.create_action()
+
+        return controller, s3_resource
+
+    def test_serialize_templates_concurrently(self):
+        """ Every template in the tree is uploaded and saved whether or not the upload pool is used """
+
+        class MyEnvBase(eb.EnvironmentBase):
+            def create_hook(self):
+                for index in range(5):
+                    self.add_child_template(Child('Child%d' % index))
+
+        generated = {}
+        for upload_concurrency in [1, 4]:
+            controller, s3_resource = self._create_templates(
+                MyEnvBase, upload_concurrency=upload_concurrency, skip_unchanged_uploads=False)
+
+            uploaded_keys = sorted(call[1]['Key'] for call in s3_resource.meta.client.put_object.call_args_list)
+            expected_keys = sorted([controller.template.resource_path] +
+                                   [child.resource_path for child, _, _, _, _ in controller.template._child_templates])
+            self.assertEqual(uploaded_keys, expected_keys)
+
+            generated[upload_concurrency] = {}
+            for key in expected_keys:
+                with open(key) as f:
+                    generated[upload_concurrency][key] = json.load(f)
+
+        self.assertEqual(generated[1], generated[4])
+
+    def test_content_addressed_child_templates(self):
+        """ Child template keys only change when the child (or one of its descendants) changes """
+        instance_types = {'Grandchild': 'm3.medium', 'Sibling': 'm3.medium'}
+
+        class Leaf(eb.Template):
+            def build_hook(self):
+                self.add_resource(ec2.Instance("ec2instance", InstanceType=instance_types[self.name], ImageId="ami-951945d0"))
+
+        class Child(eb.Template):
+            def build_hook(self):
+                self.add_child_template(Leaf('Grandchild'))
+
+        class MyEnvBase(eb.EnvironmentBase):
+            def create_hook(self):
+                self.add_child_template(Child('Child'))
+                self.add_child_template(Leaf('Sibling'))
+
+        def get_resource_paths():
+            controller, _ = self._create_templates(MyEnvBase, include_content_hash=True, include_dateGenerated_output=True)
+            (child, _, _, _, _), (sibling, _, _, _, _) = controller.template._child_templates
+            return child.resource_path, child._child_templates[0][0].resource_path, sibling.resource_path
+
+        first_paths = get_resource_paths()
+        self.assertEqual(first_paths, get_resource_paths())
+
+        instance_types['Grandchild'] = 'm3.large'
+        changed_paths = get_resource_paths()
+
+        self.assertNotEqual(first_paths[0], changed_paths[0])
+        self.assertNotEqual(first_paths[1], changed_paths[1])
+        self.assertEqual(first_paths[2], changed_paths[2])
+
+    def test_skip_unchanged_uploads(self):
+        """ Templates are only re-uploaded when their content (or the upload manifest) changes """
+
+        def get_uploaded_keys(**template_config):
+            _, s3_resource = self._create_templates(MyEnvBase, include_timestamp=False, **template_config)
+            return sorted(call[1]['Key'] for call in s3_resource.meta.client.put_object.call_args_list)
+
+        self.assertEqual(len(get_uploaded_keys()), 2)
+        self.assertEqual(get_uploaded_keys(), [])
+
+        with patch.object(Child, 'instance_type', 'm3.large'):
+            self.assertEqual(get_uploaded_keys(), ['templates/Child.template'])
+
+        # Turning the manifest off uploads everything
+        self.assertEqual(len(get_uploaded_keys(skip_unchanged_uploads=False)), 2)
+
+        # The manifest only keeps the keys written by the latest run, not the untimestamped keys of the earlier ones
+        controller, s3_resource = self._create_templates(MyEnvBase, include_timestamp=True)
+        uploaded_keys = [call[1]['Key'] for call in s3_resource.meta.client.put_object.call_args_list]
+        with open(os.path.join(controller._ensure_template_dir_exists(), upload_manifest.MANIFEST_FILENAME)) as f:
+            manifest_keys = [entry['key'] for entry in json.load(f).values()]
+        self.assertEqual(sorted(manifest_keys), sorted(uploaded_keys))
+
+    def test_output_formats(self):
+        """ The S3 body and local artifact formats are configurable and hold the same template """
+
+        bodies = {}
+        for output_format in ['pretty', 'compact']:
+            _, s3_resource = self._create_templates(
+                MyEnvBase, output_format=output_format, skip_unchanged_uploads=False, include_timestamp=False)
+            bodies[output_format] = {call[1]['Key']: call[1]['Body'] for call in s3_resource.meta.client.put_object.call_args_list}
+
+        for key in bodies['pretty']:
+            self.assertEqual(json.loads(bodies['pretty'][key]), json.loads(bodies['compact'][key]))
+            self.assertLess(len(bodies['compact'][key]), len(bodies['pretty'][key]))
+            self.assertNotIn('\n', bodies['compact'][key])
+
+        with self.assertRaises(eb.ValidationError):
+            self._create_templates(MyEnvBase, output_format='yaml')
+
+        # Gzipped local artifacts are byte for byte reproducible
+        artifacts = []
+        for _ in range(2):
+            controller, _ = self._create_templates(MyEnvBase, gzip_local_templates=True, s3_upload=False, include_timestamp=False)
+            with open(controller.template.resource_path + '.gz', 'rb') as f:
+                artifacts.append(f.read())
+
+        self.assertEqual(artifacts[0], artifacts[1])
+        self.assertIn('Child', json.loads(gzip.GzipFile(fileobj=io.BytesIO(artifacts[0])).read())['Resources'])
+
+    def test_profile(self):
+        """ --profile writes a timing report with a span for each phase and child template """
+
+        controller, _ = self._create_templates(MyEnvBase)
+        report_path = os.path.join(controller._ensure_template_dir_exists(), 'environmentbase.create.timing.json')
+        self.assertFalse(os.path.isfile(report_path))
+
+        self._create_templates(MyEnvBase, cli_args=['--profile'], skip_unchanged_uploads=False)
+        with open(report_path) as f:
+            report = json.load(f)
+
+        self.assertEqual(report['action'], 'create')
+        self.assertEqual([span['name'] for span in report['spans'] if span['name'] not in ['upload', 'save_local']],
+                         ['load_config', 'initialize_template', 'create_hook', 'serialize_templates'])
+        self.assertEqual(report['totals']['upload']['count'], 2)
+        self.assertEqual(report['totals']['build_hook']['count'], 1)
+        self.assertIn('Child', report['templates'])
+
+        # Child template spans are nested under the rendering of their parent
+        serialize_span = [span for span in report['spans'] if span['name'] == 'serialize_templates'][0]
+        child_span = serialize_span['children'][0]
+        self.assertEqual((child_span['name'], child_span['template']), ('process_child_template', 'Child'))
+        self.assertEqual([span['name'] for span in child_span['children']], ['build_hook', 'match_stack_parameters'])
+
+    def test_selective_output_propagation(self):
+        """ Child templates only re-export the listed outputs of their children, the root template keeps all of them """
+
+        class Grandchild(eb.Template):
+            def build_hook(self):
+                self.add_resource(ec2.Instance("ec2instance", InstanceType="m3.medium", ImageId="ami-951945d0"))
+                for name in ['grandchildOutput', 'exportedOutput']:
+                    self.add_output(Output(name, Value=Ref('ec2instance')))
+
+        class Child(eb.Template):
+            def build_hook(self):
+                self.add_resource(ec2.Instance("ec2instance", InstanceType="m3.medium", ImageId="ami-951945d0"))
+                self.add_output(Output('childOutput', Value=Ref('ec2instance')))
+                self.add_child_template(Grandchild('Grandchild'))
+
+        class Sibling(eb.Template):
+            def build_hook(self):
+                for name in ['childOutput', 'grandchildOutput']:
+                    self.add_parameter(Parameter(name, Type='String'))
+                self.add_resource(ec2.Instance("ec2instance", InstanceType=Ref('childOutput'), ImageId=Ref('grandchildOutput')))
+
+        class MyEnvBase(eb.EnvironmentBase):
+            def create_hook(self):
+                self.add_child_template(Child('Child'))
+                self.add_child_template(Sibling('Sibling'))
+
+        def create(**template_config):
+            controller, _ = self._create_templates(
+                MyEnvBase, s3_upload=False, include_timestamp=False, exported_outputs=['exportedOutput'], **template_config)
+            templates = {}
+            for name in ['Child', 'Sibling']:
+                with open('templates/%s.template' % name) as f:
+                    templates[name] = json.load(f)
+            with open(controller.template.resource_path) as f:
+                templates['root'] = json.load(f)
+            return templates
+
+        for selective_output_propagation in [False, True]:
+            templates = create(selective_output_propagation=selective_output_propagation)
+
+            # The child's own outputs are bound to its sibling's parameters, the re-exported outputs of the grandchild
+            # aren't known yet when the sibling is matched so they're passed in from the root template
+            stack_params = templates['root']['Resources']['Sibling']['Properties']['Parameters']
+            self.assertEqual(stack_params['childOutput'], {'Fn::GetAtt': ['Child', 'Outputs.childOutput']})
+            self.assertEqual(stack_params['grandchildOutput'], {'Ref': 'grandchildOutput'})
+            self.assertIn('grandchildOutput', templates['root']['Parameters'])
+
+            # The root template keeps the outputs of its children
+            self.assertIn('childOutput', templates['root']['Outputs'])
+
+            expected_outputs = ['childOutput', 'exportedOutput', 'templateValidationHash']
+            if not selective_output_propagation:
+                expected_outputs.append('grandchildOutput')
+            self.assertEqual(sorted(templates['Child']['Outputs']), sorted(expected_outputs))
+
+    def test_import_times(self):
+        """ --import-times records the modules imported once the arguments are parsed """
+        with open('slow_module.py', 'w') as f:
+            f.write('import json\nimport time\ntime.sleep(0.01)\n')
+
+        my_cli = self.fake_cli(['init', '--import-times'])
+        sys.path.insert(0, self.temp_dir)
+        try:
+            import slow_module
+        finally:
+            my_cli.import_timer.stop()
+            sys.path.remove(self.temp_dir)
+            sys.modules.pop('slow_module', None)
+
+        # Modules that were already loaded aren't recorded
+        ((name, seconds, self_seconds),) = my_cli.import_timer.get_report()
+        self.assertEqual(name, 'slow_module')
+        self.assertGreaterEqual(seconds, 0.01)
+        self.assertLessEqual(self_seconds, seconds)
+
+        self.assertIsNone(self.fake_cli(['init']).import_timer)
+
+        # Importing the package doesn't load the AWS SDKs, the actions using them import them
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, environmentbase.networkbase; print sorted(sys.modules)'],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        self.assertNotIn("'boto3'", loaded)
+        self.assertNotIn("'botocore'", loaded)
+
+    def test_build_cache(self):
+        """ Child templates are only rebuilt when their inputs change, and the cached build renders identically """
+        builds = []
+        instance_types = {'Child': 'm3.medium', 'Sibling': 'm3.medium'}
+
+        class Child(eb.Template):
+            def __init__(self, name, instance_type):
+                self.instance_type = instance_type
+                super(Child, self).__init__(name)
+
+            def build_hook(self):
+                builds.append(self.name)
+                instance = ec2.Instance("ec2instance", InstanceType=self.instance_type, ImageId="ami-951945d0")
+                if self.name == 'Sibling':
+                    instance.UserData = Base64(Join('\n', self.get_file_contents('user_data.sh')))
+                self.add_resource(instance)
+                self.add_output(Output(self.name + 'InstanceId', Value=Ref('ec2instance')))
+
+        class Parent(eb.Template):
+            def build_hook(self):
+                builds.append(self.name)
+                self.add_child_template(Child('Grandchild', 'm3.medium'))
+
+        class MyEnvBase(eb.EnvironmentBase):
+            def create_hook(self):
+                for name in sorted(instance_types):
+                    self.add_child_template(Child(name, instance_types[name]))
+                self.add_child_template(Parent('Parent'))
+
+        def create():
+            del builds[:]
+            controller, _ = self._create_templates(
+                MyEnvBase, build_cache=True, include_timestamp=False, s3_upload=False, include_dateGenerated_output=True)
+            with open(controller.template.resource_path) as f:
+                return json.load(f)
+
+        def without_dates(template_dict):
+            template_dict['Outputs'].pop('dateGenerated')
+            return template_dict
+
+        with open('user_data.sh', 'w') as f:
+            f.write('echo first\n')
+        os.utime('user_data.sh', (1000, 1000))
+
+        first_root = create()
+        self.assertEqual(builds, ['Child', 'Sibling', 'Parent', 'Grandchild'])
+
+        # Only templates without child stacks are restored, the rest are rebuilt so their children are saved again
+        os.remove('templates/Grandchild.template')
+        self.assertEqual(without_dates(create()), without_dates(first_root))
+        self.assertEqual(builds, ['Parent'])
+        self.assertTrue(os.path.isfile('templates/Grandchild.template'))
+
+        # The generation date of a restored template isn't the cached one
+        with open('templates/Child.template') as f:
+            self.assertIn('dateGenerated', json.load(f)['Outputs'])
+        for entry_name in os.listdir(os.path.join('templates', build_cache.BUILD_CACHE_DIRNAME)):
+            with open(os.path.join('templates', build_cache.BUILD_CACHE_DIRNAME, entry_name)) as f:
+                self.assertNotIn('dateGenerated', json.load(f)['template_dict'].get('Outputs', {}))
+
+        instance_types['Child'] = 'm3.large'
+        create()
+        self.assertEqual(builds, ['Child', 'Parent'])
+
+        # Editing a file read while building (e.g. a bootstrap script) rebuilds the templates that read it
+        with open('user_data.sh', 'w') as f:
+            f.write('echo second\n')
+        os.utime('user_data.sh', (2000, 2000))
+        create()
+        self.assertEqual(builds, ['Sibling', 'Parent'])
+        with open('templates/Sibling.template') as f:
+            self.assertIn('echo second', f.read())
+
+    def test_auto_shard(self):
+        """ Templates over the resource limit are split into nested stacks wired together through parameters/outputs """
+
+        class MyEnvBase(eb.EnvironmentBase):
+            def create_hook(self):
+                previous = None
+                for index in range(12):
+                    group = self.template.add_resource(ec2.SecurityGroup(
+                        'Group%02d' % index, GroupDescription='group', VpcId='vpc-12345678'))
+                    if previous:
+                        self.template.add_resource(ec2.SecurityGroupIngress(
+                            'Group%02dIngress' % index, GroupId=Ref(group), IpProtocol='-1', FromPort='-1', ToPort='-1',
+                            SourceSecurityGroupId=GetAtt(previous, 'GroupId')))
+                    previous = group
+                self.template.add_output(Output('firstGroup', Value=Ref('Group00')))
+
+        with patch.object(eb.Template, 'max_resources', 8):
+            controller, _ = self._create_templates(MyEnvBase, auto_shard=True, s3_upload=False)
+
+        templates = {}
+        for template in [controller.template] + [child for (child, _, _, _, _) in controller.template._child_templates]:
+            with open(template.resource_path) as f:
+                templates[template.name] = json.load(f)
+
+        root = templates.pop(controller.template.name)
+        self.assertLessEqual(len(root['Resources']), 8)
+        self.assertTrue(len(templates) > 1)
+
+        moved_resources = set()
+        for (name, shard) in templates.iteritems():
+            self.assertLessEqual(len(shard['Resources']), 8)
+            moved_resources.update(shard['Resources'])
+
+            # Every shard parameter is passed in by the root template
+            stack_params = root['Resources'][name]['Properties']['Parameters']
+            self.assertEqual(set(stack_params), set(shard.get('Parameters', {})))
+
+        # Nothing is lost or duplicated
+        expected = set(['Group%02d' % index for index in range(12)] + ['Group%02dIngress' % index for index in range(1, 12)])
+        self.assertLessEqual(expected, moved_resources | (set(root['Resources']) - set(templates)))
+        self.assertFalse(moved_resources & set(root['Resources']))
+
+        # Outputs of moved resources are read from the shard stack
+        self.assertIn('Group00', moved_resources)
+        self.assertIn('Fn::GetAtt', root['Outputs']['firstGroup']['Value'])
+
 
     # The following two tests use a create_action, which currently doesn't test correctly
 
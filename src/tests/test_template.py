@@ -1,14 +1,20 @@
 from unittest2 import TestCase, main
 import mock
 from mock import patch
+import email
+import gzip
+import io
 import os
 import shutil
 import sys
 from tempfile import mkdtemp
-from environmentbase import cli, template, utility
+from environmentbase import cli, resources, subnet_registry, template, utility
 import troposphere as tropo
 from troposphere import ec2
+from toolz.dicttoolz import merge
 import yaml
+import json
+import hashlib
 
 
 class TemplateTestCase(TestCase):
@@ -96,5 +102,347 @@ class TemplateTestCase(TestCase):
 
         self.assertEqual(generated_json, expected_json_2)
 
+    def test_compressed_user_data(self):
+        user_data = '#~comment\n' + '\n'.join('echo line%d' % index for index in range(200))
+        env_vars = {'STATIC': 'value', 'STACK': tropo.Ref('AWS::StackName')}
+
+        plain = template.Template.construct_user_data(env_vars, user_data)
+        compressed = template.Template.construct_user_data(env_vars, user_data, compress=True)
+        self.assertLess(len(utility.tropo_to_string(compressed)), len(utility.tropo_to_string(plain)) / 2)
+
+        # The Join holding the Ref stays in the uncompressed preamble
+        lines = utility.tropo_to_dict(compressed)['Fn::Base64']['Fn::Join'][1]
+        joins = [line for line in lines if not isinstance(line, basestring)]
+        self.assertEqual(joins, [{'Fn::Join': ['=', ['STACK', {'Ref': 'AWS::StackName'}]]}])
+
+        # Parsed the same way cloud-init does
+        message = email.message_from_string('\n'.join(line if isinstance(line, basestring) else 'STACK=name'
+                                                      for line in lines))
+        (preamble, script) = message.get_payload()
+        self.assertEqual(preamble.get_content_type(), 'text/x-shellscript')
+        self.assertIn('STACK=name', preamble.get_payload())
+        self.assertEqual(script.get_content_type(), 'application/x-gzip')
+
+        script_lines = gzip.GzipFile(fileobj=io.BytesIO(script.get_payload(decode=True))).read().split('\n')
+        self.assertEqual(script_lines[:3], ['#!/bin/bash', '. ' + template.USER_DATA_ENV_FILE, 'STATIC=value'])
+        self.assertEqual(script_lines[3:], ['echo line%d' % index for index in range(200)])
+
+        # Same script, same payload
+        self.assertEqual(utility.tropo_to_dict(compressed),
+                         utility.tropo_to_dict(template.Template.construct_user_data(env_vars, user_data, compress=True)))
+
+    def test_create_reciprocal_sgs(self):
+        port_parameter = tropo.Ref('portParameter')
+        self.assertEqual(
+            template.Template.coalesce_ports([8081, '8080', 443, (8082, 8090), 8085, port_parameter, 22]),
+            [(22, 22), (443, 443), ('8080', 8090), (port_parameter, port_parameter)])
+
+        tpl = template.Template('test')
+        elb_sg = tpl.add_resource(ec2.SecurityGroup('elbSg', GroupDescription='elb'))
+        cluster_sg = tpl.add_resource(ec2.SecurityGroup('clusterSg', GroupDescription='cluster'))
+
+        tpl.create_reciprocal_sgs(elb_sg, 'elbSg', cluster_sg, 'clusterSg', ports=[80, 81, 82, 443])
+        self.assertEqual(sorted(tpl.resources), [
+            'clusterSg', 'clusterSgIngresselbSgTcp443', 'clusterSgIngresselbSgTcp80To82',
+            'elbSg', 'elbSgEgressclusterSgTcp443', 'elbSgEgressclusterSgTcp80To82'])
+
+        # Inlined ingress rules are added to the destination group, the egress rules stay separate resources
+        tpl = template.Template('test')
+        elb_sg = tpl.add_resource(ec2.SecurityGroup('elbSg', GroupDescription='elb'))
+        cluster_sg = tpl.add_resource(ec2.SecurityGroup('clusterSg', GroupDescription='cluster'))
+
+        tpl.create_reciprocal_sgs(elb_sg, 'elbSg', cluster_sg, 'clusterSg', ports=[80, 81, 443], inline=True)
+        self.assertEqual(sorted(tpl.resources), [
+            'clusterSg', 'elbSg', 'elbSgEgressclusterSgTcp443', 'elbSgEgressclusterSgTcp80To81'])
+        self.assertEqual(utility.tropo_to_dict(cluster_sg)['Properties']['SecurityGroupIngress'], [
+            {'SourceSecurityGroupId': {'Ref': 'elbSg'}, 'FromPort': 80, 'ToPort': 81, 'IpProtocol': 'tcp'},
+            {'SourceSecurityGroupId': {'Ref': 'elbSg'}, 'FromPort': 443, 'ToPort': 443, 'IpProtocol': 'tcp'}])
+
+    def test_shared_common_parameters(self):
+        parent = template.Template('parent')
+        parent._ec2_key = parent.add_parameter(tropo.Parameter('ec2Key', Type='String', Default='key'))
+        parent._subnets.add('private', 'app', tropo.Ref('appAZ0'))
+
+        children = [template.Template('child%d' % index) for index in range(2)]
+        for child in children:
+            child.add_common_parameters_from_parent(parent)
+
+        # Identical declarations are shared, and can't be changed through one of the children
+        for name in ['vpcId', 'ec2Key', 'appAZ0']:
+            self.assertIs(children[0].parameters[name], children[1].parameters[name])
+        with self.assertRaises(AttributeError):
+            children[0].parameters['ec2Key'].Default = 'other'
+
+        other = template.Template('other')
+        other.add_common_parameters('other_key', {})
+        self.assertIsNot(other.parameters['ec2Key'], children[0].parameters['ec2Key'])
+        self.assertEqual(other.parameters['ec2Key'].Default, 'other_key')
+
+        allowed = template.Template.get_common_parameter('x', Type='String', AllowedValues=['a', 'b'])
+        self.assertIs(allowed, template.Template.get_common_parameter('x', AllowedValues=['a', 'b'], Type='String'))
+        self.assertIsNot(allowed, template.Template.get_common_parameter('x', Type='String', AllowedValues=['b', 'a']))
+
+    def test_file_cache(self):
+        file_name = 'bootstrap.sh'
+        self._create_local_file(file_name, '#~comment\nline1\nline2\n').close()
+        os.utime(file_name, (1000, 1000))
+
+        self.assertEqual(template.Template.get_file_contents(file_name), ['line1', 'line2'])
+        nat_takeover = resources.get_resource('nat_takeover.sh')
+
+        # Served from the cache while the file is unchanged, the package resources on disk are read as files too
+        with patch('__builtin__.open', side_effect=AssertionError('file read again')):
+            self.assertEqual(template.Template.get_file_contents(file_name), ['line1', 'line2'])
+            self.assertIs(resources.get_resource('nat_takeover.sh'), nat_takeover)
+
+        # A new modification time invalidates the cached lines
+        with open(file_name, 'w') as f:
+            f.write('line3')
+        os.utime(file_name, (2000, 2000))
+        self.assertEqual(template.Template.get_file_contents(file_name), ['line3'])
+
+    def test_to_template_dict(self):
+        tpl = template.Template('test')
+        tpl.add_resource(ec2.Instance(
+            "ec2instance",
+            InstanceType="m3.medium",
+            ImageId="ami-951945d0"))
+
+        with patch.object(template.Template, 'include_templateValidationHash_output', True, create=True), \
+                patch.object(template.Template, 'include_dateGenerated_output', False, create=True):
+            template_dict = tpl.to_template_dict()
+
+        # The rendered dict matches troposphere's own serialization, including the generated hash output
+        self.assertEqual(template_dict, json.loads(tpl.to_json()))
+
+        # The hash covers the canonical compact form of the template without the hash output
+        template_hash = template_dict['Outputs'].pop('templateValidationHash')['Value']
+        if not template_dict['Outputs']:
+            del template_dict['Outputs']
+        self.assertEqual(template_hash, hashlib.sha256(utility.to_compact_json(template_dict)).hexdigest())
+
+    def test_ref_views(self):
+        tpl = template.Template('test')
+        tpl._vpc_id = tpl.add_parameter(tropo.Parameter('vpcId', Type='String'))
+        tpl._subnets.add('private', 'app', tpl.add_parameter(tropo.Parameter('appAZ0', Type='String')))
+
+        # Repeated reads reuse the same view
+        subnets = tpl.subnets
+        self.assertIs(tpl.subnets, subnets)
+        self.assertIs(tpl.vpc_id, tpl.vpc_id)
+        self.assertEqual(tpl.vpc_id.data, {'Ref': 'vpcId'})
+
+        # Updating the fields in place or reassigning them refreshes the view
+        tpl._subnets.add('private', 'app', tpl.add_parameter(tropo.Parameter('appAZ1', Type='String')))
+        self.assertEqual([subnet.data['Ref'] for subnet in tpl.subnets['private']['app']], ['appAZ0', 'appAZ1'])
+
+        tpl._subnets['public'] = {'web': [tpl.add_parameter(tropo.Parameter('webAZ0', Type='String'))]}
+        self.assertEqual(sorted(tpl.subnets), ['private', 'public'])
+
+        tpl._vpc_id = tropo.GetAtt('BaseNetwork', 'Outputs.vpcId')
+        self.assertIs(tpl.vpc_id, tpl._vpc_id)
+
+        # The shared view can't be modified, its clones can
+        subnets = tpl.subnets
+        for modify in [lambda: subnets.add('private', 'app', tropo.Ref('appAZ2')),
+                       lambda: subnets['private']['app'].append(tropo.Ref('appAZ2')),
+                       lambda: subnets['private'].pop('app'),
+                       lambda: subnets.update(isolated={})]:
+            with self.assertRaises(TypeError):
+                modify()
+        self.assertEqual(len(subnets['private']['app']), 2)
+
+        clone = subnets.clone()
+        clone.add('private', 'app', tropo.Ref('appAZ2'))
+        self.assertEqual(len(clone['private']['app']), 3)
+        self.assertIs(tpl.subnets, subnets)
+
+    def test_subnet_registry(self):
+        registry = subnet_registry.SubnetRegistry()
+        for layer in ['web', 'edge']:
+            for az in range(2):
+                registry.add('public', layer, tropo.Ref(layer + 'AZ%d' % az), az_index=az)
+        registry.add('private', 'app', tropo.Ref('appAZ1'), az_index=1)
+
+        self.assertEqual(registry.get_type('edge'), 'public')
+        self.assertIsNone(registry.get_type('db'))
+
+        # Defaults follow insertion order and the order of the preferred types
+        self.assertEqual(registry.get_layers('public'), ['web', 'edge'])
+        self.assertEqual(registry.get_default_layer('private', 'public'), 'app')
+        self.assertEqual(registry.get_default_layer('isolated', 'public'), 'web')
+        self.assertIsNone(registry.get_default_layer('isolated'))
+
+        self.assertEqual([ref.data['Ref'] for ref in registry.get_az_subnets(1).values()], ['webAZ1', 'edgeAZ1', 'appAZ1'])
+        self.assertEqual(registry.get_az_subnets(1, 'private').keys(), ['app'])
+
+        with self.assertRaises(ValueError):
+            registry.add('private', 'web', tropo.Ref('webAZ2'))
+
+        # Clones share everything until written to, writes on either side don't leak to the other
+        clone = registry.clone()
+        self.assertIs(clone['public'], registry['public'])
+
+        clone.add('public', 'web', tropo.Ref('webAZ2'))
+        registry.add('private', 'db', tropo.Ref('dbAZ0'))
+
+        self.assertEqual(len(clone['public']['web']), 3)
+        self.assertEqual(len(registry['public']['web']), 2)
+        self.assertIs(clone['public']['edge'], registry['public']['edge'])
+        self.assertEqual(registry.get_type('db'), 'private')
+        self.assertIsNone(clone.get_type('db'))
+        self.assertEqual(registry.get_az_subnets(2), {})
+        self.assertEqual([(layer, ref.data['Ref']) for (layer, ref) in clone.get_az_subnets(2).items()], [('web', 'webAZ2')])
+
+        # The Ref view keeps the layer order and the AZ indexes
+        tpl = template.Template('test')
+        tpl._subnets = registry
+        self.assertEqual(tpl.subnets.get_az_subnets(1, 'private')['app'].data, {'Ref': 'appAZ1'})
+        self.assertEqual(tpl.subnets.get_layers('public'), ['web', 'edge'])
+
+    def test_subnet_list_parameters(self):
+        parent = template.Template('parent')
+        parent.add_common_parameters('key', {'private': {'app': [tropo.Ref('appAZ0'), tropo.Ref('appAZ1')]}})
+
+        with patch.object(template.Template, 'subnet_list_parameters', True):
+            child = template.Template('child')
+            child.add_common_parameters_from_parent(parent)
+            grandchild = template.Template('grandchild')
+            grandchild.add_common_parameters_from_parent(child)
+
+        self.assertEqual(child.parameters['appSubnets'].Type, 'List<AWS::EC2::Subnet::Id>')
+        self.assertNotIn('appAZ0', child.parameters)
+
+        # The layer renders as a Ref of the list parameter, its subnets as Selects from it
+        subnets = child.subnets['private']['app']
+        self.assertEqual(len(subnets), 2)
+        self.assertEqual(utility.tropo_to_dict(subnets), {'Ref': 'appSubnets'})
+        self.assertEqual(utility.tropo_to_dict(subnets[1]), {'Fn::Select': [1, {'Ref': 'appSubnets'}]})
+        self.assertIs(child.subnets.get_az_subnets(1)['app'], subnets[1])
+
+        # The subnets are passed down as comma delimited strings
+        params = parent.match_stack_parameters(child)
+        self.assertEqual(utility.tropo_to_dict(params['appSubnets']),
+                         {'Fn::Join': [',', [{'Ref': 'appAZ0'}, {'Ref': 'appAZ1'}]]})
+        params = child.match_stack_parameters(grandchild)
+        self.assertEqual(utility.tropo_to_dict(params['appSubnets']), {'Fn::Join': [',', {'Ref': 'appSubnets'}]})
+
+    def test_match_stack_parameters(self):
+        parent = template.Template('parent')
+        parent.add_parameter(tropo.Parameter('shared', Type='String'))
+        parent.add_parameter(tropo.Parameter('bound', Type='String'))
+        parent.add_resource(ec2.SecurityGroup('group', GroupDescription='test'))
+        parent.manual_parameter_bindings['bound'] = 'manual'
+
+        child = template.Template('child')
+        for name in ['shared', 'bound', 'group', 'passThrough']:
+            child.add_parameter(tropo.Parameter(name, Type='String'))
+
+        # Manual bindings win over parameters, unmatched parameters pass through the parent
+        params = parent.match_stack_parameters(child)
+        self.assertEqual(params['bound'], 'manual')
+        self.assertEqual(params['shared'].data, {'Ref': 'shared'})
+        self.assertEqual(params['group'].data, {'Ref': 'group'})
+        self.assertEqual(params['passThrough'].data, {'Ref': 'passThrough'})
+        self.assertIn('passThrough', parent.parameters)
+
+        # Bindings added or rebound after a first match are picked up
+        parent.manual_parameter_bindings['shared'] = 'late'
+        parent.manual_parameter_bindings['bound'] = 'rebound'
+        parent.add_stack('child', 'https://example.com/child.json')
+        other = template.Template('other')
+        other.add_parameter(tropo.Parameter('shared', Type='String'))
+        other.add_parameter(tropo.Parameter('child', Type='String'))
+        other.add_parameter(tropo.Parameter('bound', Type='String'))
+        params = parent.match_stack_parameters(other)
+        self.assertEqual(params['shared'], 'late')
+        self.assertEqual(params['bound'], 'rebound')
+        self.assertEqual(params['child'].data, {'Ref': 'child'})
+
+    def test_merge(self):
+        class Addition(template.Template):
+            def build_hook(self):
+                # The parent's entries are visible without being copied
+                assert 'existing' in self.resources
+                self.add_resource(ec2.SecurityGroup('added', GroupDescription='test'))
+                self.parameters.pop('removed')
+
+        parent = template.Template('parent')
+        existing = parent.add_resource(ec2.SecurityGroup('existing', GroupDescription='test'))
+        parent.add_parameter(tropo.Parameter('removed', Type='String'))
+
+        addition = Addition('addition')
+        parent.merge(addition)
+
+        self.assertEqual(addition.resources.get_delta().keys(), ['added'])
+        self.assertEqual(sorted(addition.resources), ['added', 'existing'])
+        self.assertEqual(sorted(parent.resources), ['added', 'existing'])
+        self.assertIs(parent.resources['existing'], existing)
+
+        # Removing an entry only hides it from the merged template
+        self.assertNotIn('removed', addition.parameters)
+        self.assertIn('removed', parent.parameters)
+
+        # Copies made through the dict protocol see the parent's entries too
+        copied = {}
+        copied.update(addition.resources)
+        for resources in [dict(addition.resources), dict(**addition.resources), copied, merge(addition.resources, {})]:
+            self.assertEqual(sorted(resources), ['added', 'existing'])
+        self.assertEqual(sorted(addition.to_dict()['Resources']), ['added', 'existing'])
+
+    def test_shard_list_attributes(self):
+        # The zone is moved into the shard or left behind depending on its name, list values cross either way as strings
+        for zone_name in ['aZone', 'zone']:
+            tpl = template.Template('test')
+            zone = tpl.add_resource(tropo.route53.HostedZone(zone_name, Name='example.com'))
+            for index in range(6):
+                tpl.add_resource(tropo.route53.RecordSetType(
+                    'delegation%d' % index, HostedZoneName='example.com.', Name='sub%d.example.com.' % index, Type='NS',
+                    TTL='300', ResourceRecords=tropo.GetAtt(zone, 'NameServers')))
+
+            with patch.object(template.Template, 'max_resources', 4), \
+                    patch.object(template.Template, 'include_templateValidationHash_output', False, create=True), \
+                    patch.object(template.Template, 'include_dateGenerated_output', False, create=True), \
+                    patch.object(template.Template, 'include_timestamp', False, create=True):
+                tpl.shard_resources()
+
+            (shard, _, _, _, _) = tpl._child_templates[0]
+            shard_dict = shard.to_dict()
+            records = [resource['Properties']['ResourceRecords'] for resource in tpl.to_dict()['Resources'].values()
+                       if resource['Type'] == 'AWS::Route53::RecordSet']
+
+            if zone_name in shard_dict['Resources']:
+                output = shard_dict['Outputs'][zone_name + 'NameServers']
+                self.assertEqual(output['Value'], {'Fn::Join': [',', {'Fn::GetAtt': [zone_name, 'NameServers']}]})
+                self.assertEqual(records[0], {'Fn::Split': [',', {'Fn::GetAtt': [shard.name, 'Outputs.' + zone_name + 'NameServers']}]})
+            else:
+                self.assertEqual(shard_dict['Parameters'][zone_name + 'NameServers'], {'Type': 'CommaDelimitedList'})
+                self.assertEqual(utility.tropo_to_dict(tpl.manual_parameter_bindings[zone_name + 'NameServers']),
+                                 {'Fn::Join': [',', {'Fn::GetAtt': [zone_name, 'NameServers']}]})
+
+    def test_prune_region_map(self):
+        tpl = template.Template('test')
+        for region in ['us-east-1', 'us-west-2', 'eu-west-1']:
+            tpl.add_region_map_value(region, 'amiId', 'ami-' + region)
+            tpl.add_region_map_value(region, 'unusedAmiId', 'ami-unused')
+        tpl.add_resource(ec2.Instance('instance', ImageId=tropo.FindInMap('RegionMap', tropo.Ref('AWS::Region'), 'amiId')))
+
+        template_dict = tpl.to_dict()
+        template.Template._prune_region_map(template_dict)
+        self.assertEqual(template_dict['Mappings']['RegionMap']['us-west-2'], {'amiId': 'ami-us-west-2'})
+        self.assertEqual(len(template_dict['Mappings']['RegionMap']), 3)
+
+        with patch.object(template.Template, 'target_regions', ['us-west-2', 'ap-south-1']):
+            template_dict = tpl.to_dict()
+            template.Template._prune_region_map(template_dict)
+        self.assertEqual(template_dict['Mappings'], {'RegionMap': {'us-west-2': {'amiId': 'ami-us-west-2'}}})
+
+        # Without any lookup the RegionMap goes
+        tpl.resources.pop('instance')
+        tpl.add_resource(ec2.SecurityGroup('group', GroupDescription='test'))
+        template_dict = tpl.to_dict()
+        template.Template._prune_region_map(template_dict)
+        self.assertNotIn('Mappings', template_dict)
+
 if __name__ == '__main__':
     main()